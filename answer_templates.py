@@ -0,0 +1,91 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _parse_time(value: Dict[str, Any]) -> Optional[datetime]:
+    raw = value.get("dateTime") or value.get("date") if isinstance(value, dict) else value
+    try:
+        return datetime.fromisoformat(str(raw).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def format_range(start: Optional[datetime], end: Optional[datetime]) -> str:
+    """"Wed 17 Jul 2024 10:00-11:00", or with both dates when the range spans days."""
+    if start is None:
+        return "unknown time"
+    if end is None:
+        return start.strftime("%a %d %b %Y %H:%M")
+    if start.date() == end.date():
+        return f"{start.strftime('%a %d %b %Y %H:%M')}-{end.strftime('%H:%M')}"
+    return f"{start.strftime('%a %d %b %Y %H:%M')} - {end.strftime('%a %d %b %Y %H:%M')}"
+
+
+def format_event(event: Dict[str, Any]) -> str:
+    when = format_range(_parse_time(event.get("start", {})), _parse_time(event.get("end", {})))
+    return f"{when}: {event.get('summary') or '(no title)'} (ID: {event.get('id')})"
+
+
+def _format_events(args: Dict[str, Any], content: str) -> Optional[str]:
+    items = json.loads(content).get("items")
+    if items is None:
+        return None
+    if not items:
+        where = f" matching '{args['summary']}'" if args.get("summary") else ""
+        start, end = args.get("start_datetime"), args.get("end_datetime")
+        window = f" between {start} and {end}" if start and end else ""
+        return f"You have no events{where}{window}."
+    lines = [f"You have {len(items)} event{'s' if len(items) != 1 else ''}:"]
+    lines.extend(f"- {format_event(item)}" for item in items)
+    return "\n".join(lines)
+
+
+def _format_event(args: Dict[str, Any], content: str) -> Optional[str]:
+    if content.startswith("Event not found"):
+        return content + "."
+    event = json.loads(content)
+    return format_event(event) if "id" in event else None
+
+
+def _format_slots(args: Dict[str, Any], content: str) -> Optional[str]:
+    slots = json.loads(content).get("slots")
+    if slots is None:
+        return None
+    duration = args.get("duration_minutes", 30)
+    if not slots:
+        return f"There are no free slots of {duration} minutes or more in that period."
+    lines = [f"Free slots of at least {duration} minutes:"]
+    lines.extend(f"- {format_range(_parse_time(s['start']), _parse_time(s['end']))}" for s in slots)
+    return "\n".join(lines)
+
+
+# Tool results are formatted only for these read-only tools; anything else goes back to the model
+_FORMATTERS = {
+    "get_calendar_events": _format_events,
+    "get_calendar_event": _format_event,
+    "find_free_slots": _format_slots,
+}
+
+
+def format_tool_results(results: List[Tuple[Dict[str, Any], str]]) -> Optional[str]:
+    """
+    Deterministic answer for a turn whose tool calls are all retrievals, from (tool_call, result)
+    pairs. Returns None when any call is not a templated tool or its result is an error or
+    unexpected, in which case the model has to phrase the answer.
+    """
+    if not results:
+        return None
+    parts = []
+    for call, content in results:
+        formatter = _FORMATTERS.get(call.get("name"))
+        if formatter is None or not isinstance(content, str):
+            return None
+        try:
+            text = formatter(call.get("args") or {}, content)
+        except (ValueError, AttributeError, KeyError, TypeError):
+            return None
+        if text is None:
+            return None
+        parts.append(text)
+    return "\n\n".join(parts)
@@ -0,0 +1,426 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+import pytz
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import calendar_tools
+from calendar_store import DEFAULT_TIMEZONE, EventStore
+from date_resolver import annotate
+from eval import FIXED_EVAL_TIME, build_eval_messages
+from fake_calendar_api import BATCH_PATH, FakeCalendarServer
+from google_calendar import GoogleCalendarBackend, build_service
+from main import GRAPH_MODES, LLAMA_FORMAT_RULES, build_graph, build_initial_messages, get_tools
+from prompts import TOOL_SCHEMA_MODES, count_tokens, prompt_tokens, tokenizer_name, tool_schemas
+from scoring import match_tool_calls, score_results
+
+BENCHMARKS = ("startup", "compile", "turn", "prompt", "dates", "store", "calendar_api", "scoring")
+# Entry points whose cold import time is measured, each in a fresh interpreter
+STARTUP_MODULES = ("main", "eval", "server")
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_OUTPUT = "benchmark_results.json"
+# A metric regresses when it is this fraction worse than the baseline
+DEFAULT_THRESHOLD = 0.25
+# Synthetic calendars have this many events per day, whatever their size
+EVENTS_PER_DAY = 8
+BENCH_START = datetime(2024, 1, 1)
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Zero-latency chat model for measuring graph overhead. With use_tool it first calls
+    get_calendar_events and answers once the tool result is in; otherwise it answers directly.
+    With then_delete it deletes the first event found before answering, as for "cancel ...".
+    """
+
+    use_tool: bool = True
+    then_delete: bool = False
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "StubChatModel":
+        return self
+
+    def _generate(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager: Any = None,
+                  **kwargs: Any) -> ChatResult:
+        usage = {"input_tokens": 100, "output_tokens": 10, "total_tokens": 110}
+        self.calls += 1
+        last = messages[-1]
+        if self.use_tool and not isinstance(last, ToolMessage):
+            message = AIMessage(content="", usage_metadata=usage, tool_calls=[{
+                "id": "call_0", "name": "get_calendar_events",
+                "args": {"start_datetime": "2024-01-02 00:00:00", "end_datetime": "2024-01-02 23:59:59"},
+            }])
+        elif self.then_delete and last.name == "get_calendar_events" and json.loads(last.content)["items"]:
+            message = AIMessage(content="", usage_metadata=usage, tool_calls=[{
+                "id": "call_1", "name": "delete_calendar_event",
+                "args": {"event_id": json.loads(last.content)["items"][0]["id"]},
+            }])
+        else:
+            message = AIMessage(content="Done.", usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def _measure(fn: Callable[[], Any], repeat: int) -> float:
+    """Median wall time of fn() in seconds over repeat runs."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def _metric(value: float, unit: str, higher_is_better: bool) -> Dict[str, Any]:
+    return {"value": round(value, 4), "unit": unit, "higher_is_better": higher_is_better}
+
+
+def _import_time(module: str) -> tuple:
+    """
+    Import module in a fresh interpreter with -X importtime. Returns its cumulative import time
+    in ms and the self time in ms per top-level package (e.g. all of langchain_core.*).
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=REPO_DIR)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+    total_ms = 0.0
+    by_package: Dict[str, float] = defaultdict(float)
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        by_package[name.split(".")[0]] += int(self_us) / 1000
+        if name == module:
+            total_ms = int(cumulative_us) / 1000
+    return total_ms, dict(by_package)
+
+
+def bench_startup(repeat: int, summary: Dict[str, Any], top: int = 10) -> Dict[str, Dict[str, Any]]:
+    """
+    Cold-start cost: import time of each entry point and wall time of `main.py --help`.
+    summary receives, per entry point, the packages with the largest import self time.
+    """
+    results = {}
+    for module in STARTUP_MODULES:
+        _import_time(module)  # warm-up, so bytecode compilation is not measured
+        runs = [_import_time(module) for _ in range(max(1, repeat))]
+        total_ms = statistics.median(r[0] for r in runs)
+        results[f"startup.import_{module}_ms"] = _metric(total_ms, "ms", False)
+        by_package = runs[-1][1]
+        summary[module] = {"total_ms": round(total_ms, 1), "top_packages_ms": {
+            name: round(ms, 1) for name, ms in sorted(by_package.items(), key=lambda item: -item[1])[:top]
+        }}
+    command = [sys.executable, os.path.join(REPO_DIR, "main.py"), "--help"]
+    seconds = _measure(lambda: subprocess.run(command, capture_output=True, check=True), max(1, repeat))
+    results["startup.main_help_ms"] = _metric(seconds * 1000, "ms", False)
+    return results
+
+
+def bench_compile(repeat: int) -> Dict[str, Dict[str, Any]]:
+    """build_graph time per graph mode, with a stub model so no client is constructed."""
+    results = {}
+    for mode in GRAPH_MODES:
+        seconds = _measure(lambda: build_graph("stub", graph_mode=mode, llm_with_tools=StubChatModel()), repeat)
+        results[f"compile.{mode}_ms"] = _metric(seconds * 1000, "ms", False)
+    return results
+
+
+def bench_turn(repeat: int) -> Dict[str, Dict[str, Any]]:
+    """Per-turn cost of the LangGraph loop around a zero-latency model."""
+    calendar_tools.set_event_store(EventStore())
+    messages = [SystemMessage(content="The current date and time is 2024-01-01 09:00:00 (Europe/Amsterdam)."),
+                HumanMessage(content="What is on my calendar tomorrow?")]
+    results = {}
+    for name, use_tool in (("direct", False), ("tool_loop", True)):
+        graph = build_graph("stub", llm_with_tools=StubChatModel(use_tool=use_tool))
+        graph.invoke({"messages": messages})  # warm-up
+        turns = max(20, repeat * 20)
+        seconds = _measure(lambda: graph.invoke({"messages": messages}), turns)
+        results[f"turn.{name}_ms"] = _metric(seconds * 1000, "ms", False)
+    check_fast_mode_writes()
+    return results
+
+
+def check_fast_mode_writes() -> None:
+    """
+    Fast mode may answer a pure lookup from a template, but a lookup-then-write turn ("cancel ...")
+    has to go back to the model after the lookup. Fails when the write never happens.
+    """
+    tz = pytz.timezone(DEFAULT_TIMEZONE)
+    for text, then_delete, expected_calls in (("What is on my calendar tomorrow?", False, 1),
+                                              ("Cancel my dentist appointment tomorrow.", True, 3)):
+        store = EventStore()
+        start = tz.localize(BENCH_START + timedelta(days=1, hours=9))
+        store.create_event("Dentist", start, start + timedelta(minutes=30))
+        calendar_tools.set_event_store(store)
+        model = StubChatModel(then_delete=then_delete)
+        graph = build_graph("stub", graph_mode="fast", llm_with_tools=model)
+        graph.invoke({"messages": [SystemMessage(content="The current date and time is 2024-01-01 09:00:00 (Europe/Amsterdam)."),
+                                   HumanMessage(content=text)]})
+        remaining = len(list(store.events()))
+        if model.calls != expected_calls or remaining != (0 if then_delete else 1):
+            raise RuntimeError(f"Fast mode turn {text!r}: {model.calls} model calls (expected {expected_calls}), "
+                               f"{remaining} events left.")
+    calendar_tools.set_event_store(EventStore())
+
+
+def bench_prompt(summary: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Prompt tokens of the first model call of a turn per tool schema mode, for the evaluation
+    prompt and the interactive prompt of small Llama models. summary receives the breakdown and
+    the static prefix (tool schemas plus static system prompt) that provider prompt caches can reuse.
+    """
+    message = "Schedule a doctor's appointment next Tuesday at 15:30 for 30 minutes."
+    eval_messages = build_eval_messages(message)
+    cases = {
+        "eval": (eval_messages, count_tokens(eval_messages[0].content)),
+        "llama": (build_initial_messages("meta-llama/llama-3.2-3b-instruct", message), count_tokens(LLAMA_FORMAT_RULES)),
+    }
+    results = {}
+    for name, (messages, static_system) in cases.items():
+        for mode in TOOL_SCHEMA_MODES:
+            counts = prompt_tokens(messages, tool_schemas(get_tools(), mode))
+            results[f"prompt.{name}_{mode}_tokens"] = _metric(counts["total"], "tokens", False)
+            summary[f"{name}_{mode}"] = {**counts, "static_prefix": counts["tools"] + static_system}
+    summary["tokenizer"] = tokenizer_name()
+    return results
+
+
+def bench_dates(repeat: int, input_csv: str = "test_inputs.csv") -> Dict[str, Dict[str, Any]]:
+    """Time the date resolver adds per message (resolve_dates node), over the test inputs."""
+    if not os.path.exists(input_csv):
+        print(f"{input_csv} not found; skipping dates benchmark.")
+        return {}
+    inputs = pd.read_csv(input_csv)["input"].astype(str).tolist()
+    now = datetime.strptime(FIXED_EVAL_TIME, "%Y-%m-%d %H:%M:%S")
+    seconds = _measure(lambda: [annotate(text, now) for text in inputs], repeat)
+    return {"dates.annotate_us_per_message": _metric(seconds / len(inputs) * 1e6, "us", False)}
+
+
+def _synthetic_events(size: int, seed: int = 0) -> Iterator[tuple]:
+    """(summary, start, end) for size events spread over size / EVENTS_PER_DAY working days."""
+    rng = random.Random(seed)
+    tz = pytz.timezone(DEFAULT_TIMEZONE)
+    days = max(1, size // EVENTS_PER_DAY)
+    for i in range(size):
+        start = tz.localize(BENCH_START + timedelta(days=rng.randrange(days), hours=rng.randint(8, 18),
+                                                    minutes=rng.choice((0, 15, 30, 45))))
+        yield f"Event {i}", start, start + timedelta(minutes=rng.choice((15, 30, 60, 90)))
+
+
+def bench_store(sizes: List[int], repeat: int, queries: int = 2000) -> Dict[str, Dict[str, Any]]:
+    """Insert and one-day range query throughput of the local store and the calendar tools."""
+    results = {}
+    tz = pytz.timezone(DEFAULT_TIMEZONE)
+    for size in sizes:
+        events = list(_synthetic_events(size))
+        store = EventStore()
+        start = time.perf_counter()
+        for summary, event_start, event_end in events:
+            store.create_event(summary, event_start, event_end)
+        results[f"store.insert_per_s[{size}]"] = _metric(size / (time.perf_counter() - start), "events/s", True)
+
+        rng = random.Random(1)
+        days = max(1, size // EVENTS_PER_DAY)
+        windows = []
+        for _ in range(queries):
+            day = tz.localize(BENCH_START + timedelta(days=rng.randrange(days)))
+            windows.append((day, day + timedelta(days=1)))
+        seconds = _measure(lambda: [store.list_events(s, e, max_results=50) for s, e in windows], repeat)
+        results[f"store.range_per_s[{size}]"] = _metric(queries / seconds, "queries/s", True)
+
+        # The same queries through the tool, including argument parsing and JSON encoding
+        calendar_tools.set_event_store(store)
+        tool_args = [{"start_datetime": s.strftime("%Y-%m-%d %H:%M:%S"), "end_datetime": e.strftime("%Y-%m-%d %H:%M:%S")}
+                     for s, e in windows]
+        seconds = _measure(lambda: [calendar_tools.get_calendar_events.invoke(a) for a in tool_args], repeat)
+        results[f"tools.get_calendar_events_per_s[{size}]"] = _metric(queries / seconds, "calls/s", True)
+    calendar_tools.set_event_store(EventStore())
+    return results
+
+
+def bench_calendar_api(repeat: int, calls: int = 200, workers: int = 16) -> Dict[str, Dict[str, Any]]:
+    """
+    Concurrent create_event calls through GoogleCalendarBackend against the local fake API, so
+    they reach it as real googleapiclient batches. Fails when any batched insert is rejected.
+    """
+    results = {}
+    tz = pytz.timezone(DEFAULT_TIMEZONE)
+    times, factors = [], []
+    for _ in range(repeat):
+        server = FakeCalendarServer(("127.0.0.1", 0)).start()
+        backend = GoogleCalendarBackend(build_service(root_url=server.root_url),
+                                        batch_uri=server.root_url.rstrip("/") + BATCH_PATH)
+        starts = [tz.localize(BENCH_START + timedelta(hours=i)) for i in range(calls)]
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(workers) as pool:
+                events = list(pool.map(lambda s: backend.create_event("Event", s, s + timedelta(minutes=30)), starts))
+            times.append(time.perf_counter() - start)
+            stored = len(list(server.api.store.events("primary")))
+            if len(events) != calls or stored != calls:
+                raise RuntimeError(f"Fake calendar API stored {stored} of {calls} batched inserts.")
+            factors.append(backend.dispatcher.calls / backend.dispatcher.round_trips)
+        finally:
+            backend.close()
+            server.shutdown()
+            server.server_close()
+    results["calendar_api.create_event_per_s"] = _metric(calls / statistics.median(times), "calls/s", True)
+    results["calendar_api.calls_per_round_trip"] = _metric(statistics.median(factors), "calls", True)
+    return results
+
+
+def bench_scoring(repeat: int, rows: int = 10000) -> Dict[str, Dict[str, Any]]:
+    """Scoring throughput over the stored results files, replicated to the requested row count."""
+    columns = ["expected_tool_name", "expected_tool_args", "actual_tool_calls"]
+    frames = [pd.read_csv(path, engine="python", usecols=columns) for path in sorted(glob.glob("results*.csv"))]
+    if not frames:
+        print("No results*.csv files found; skipping scoring benchmark.")
+        return {}
+    base = pd.concat(frames, ignore_index=True)
+    df = pd.concat([base] * (rows // len(base) + 1), ignore_index=True).iloc[:rows]
+    seconds = _measure(lambda: score_results(df), repeat)
+    results = {"scoring.score_results_rows_per_s": _metric(rows / seconds, "rows/s", True)}
+
+    # Scalar per-row matcher as used by evaluate_row, over every stored row
+    decoded = [(json.loads(r.actual_tool_calls or "[]") if isinstance(r.actual_tool_calls, str) else [],
+                r.expected_tool_name, json.loads(r.expected_tool_args)) for r in base.itertuples()]
+    seconds = _measure(lambda: [match_tool_calls(*row) for row in decoded], repeat)
+    results["scoring.match_tool_calls_rows_per_s"] = _metric(len(decoded) / seconds, "rows/s", True)
+    return results
+
+
+def run_benchmarks(selected: List[str], sizes: List[int], repeat: int) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, Any]] = {}
+    importtime: Dict[str, Any] = {}
+    prompt: Dict[str, Any] = {}
+    for name in selected:
+        print(f"Running {name} benchmark...")
+        if name == "startup":
+            results.update(bench_startup(repeat, importtime))
+        elif name == "compile":
+            results.update(bench_compile(repeat))
+        elif name == "turn":
+            results.update(bench_turn(repeat))
+        elif name == "prompt":
+            results.update(bench_prompt(prompt))
+        elif name == "dates":
+            results.update(bench_dates(repeat))
+        elif name == "store":
+            results.update(bench_store(sizes, repeat))
+        elif name == "calendar_api":
+            results.update(bench_calendar_api(repeat))
+        elif name == "scoring":
+            results.update(bench_scoring(repeat))
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {"benchmarks": selected, "sizes": sizes, "repeat": repeat},
+        "results": results,
+        "importtime": importtime,
+        "prompt": prompt,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """
+    Compare two benchmark reports. A metric regresses when it is worse than the baseline by more
+    than its threshold: the baseline's "thresholds" entry for that metric, else threshold.
+    Returns a description of every regression; metrics missing on either side are skipped.
+    """
+    thresholds = baseline.get("thresholds", {})
+    regressions = []
+    for name, metric in sorted(current["results"].items()):
+        base = baseline.get("results", {}).get(name)
+        if base is None or not base["value"]:
+            continue
+        change = (metric["value"] - base["value"]) / base["value"]
+        worse = -change if metric["higher_is_better"] else change
+        limit = thresholds.get(name, threshold)
+        status = "REGRESSION" if worse > limit else "ok"
+        print(f"{name:45s} {base['value']:>12.2f} -> {metric['value']:>12.2f} {metric['unit']:10s} "
+              f"{change:+7.1%}  {status}")
+        if worse > limit:
+            regressions.append(f"{name}: {base['value']} -> {metric['value']} {metric['unit']} "
+                               f"({change:+.1%}, limit {limit:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the agent graph, calendar store and scoring.")
+    parser.add_argument('--benchmarks', type=str, default=",".join(BENCHMARKS), help=f'Comma-separated benchmarks to run, from {", ".join(BENCHMARKS)}.')
+    parser.add_argument('--sizes', type=str, default=",".join(str(s) for s in DEFAULT_SIZES), help='Comma-separated calendar sizes (events) for the store benchmark.')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions per measurement; the median is reported.')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT, help='Where to write the results as JSON.')
+    parser.add_argument('--baseline', type=str, default=None, help='Baseline results JSON to compare against. Exits with status 1 on regressions.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Allowed relative slowdown per metric, unless the baseline sets its own under "thresholds".')
+    parser.add_argument('--update_baseline', action='store_true', help='Write the results to --baseline instead of comparing against it.')
+    args = parser.parse_args()
+
+    selected = [b.strip() for b in args.benchmarks.split(",") if b.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    report = run_benchmarks(selected, sizes, args.repeat)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to: {args.output}")
+    for name, metric in report["results"].items():
+        print(f"{name:45s} {metric['value']:>12.2f} {metric['unit']}")
+    for module, summary in report["importtime"].items():
+        packages = ", ".join(f"{name} {ms:.0f}" for name, ms in summary["top_packages_ms"].items())
+        print(f"\nimport {module}: {summary['total_ms']:.0f} ms; largest (self ms): {packages}")
+    if report["prompt"]:
+        print(f"\nprompt tokens ({report['prompt']['tokenizer']}):")
+        for case, counts in report["prompt"].items():
+            if case != "tokenizer":
+                print(f"  {case:14s} total {counts['total']:>5}  tools {counts['tools']:>5}  system {counts['system']:>4}  "
+                      f"messages {counts['messages']:>4}  static prefix {counts['static_prefix']:>5}")
+
+    if args.baseline and args.update_baseline:
+        thresholds = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                thresholds = json.load(f).get("thresholds", {})
+        with open(args.baseline, "w") as f:
+            json.dump({**report, "thresholds": thresholds}, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparison against {args.baseline}:")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+import heapq
+import threading
+import uuid
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from datetime import datetime, time as dt_time, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pytz
+
+DEFAULT_TIMEZONE = "Europe/Amsterdam"
+# Backends behind the calendar tools (calendar_tools.configure_calendar_backend): "local" is the
+# in-memory EventStore, "google" the batched Google Calendar API backend and "mirror" the Google
+# backend behind a local SQLite mirror kept current with incremental syncs
+CALENDAR_BACKENDS = ("local", "google", "mirror")
+# Number of (rule, window) expansions kept by the recurrence cache
+EXPANSION_CACHE_SIZE = 1024
+
+
+def parse_datetime(value: str, timezone: str = DEFAULT_TIMEZONE) -> datetime:
+    """
+    Parse an ISO datetime string ("2024-07-17 10:00:00", "2024-07-17T10:00:00+02:00", "2024-07-17").
+    Naive values are interpreted in the given timezone; the result is always timezone-aware.
+    """
+    dt = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = pytz.timezone(timezone).localize(dt)
+    return dt
+
+
+@dataclass
+class StoredEvent:
+    """One event plus the epoch-second bounds used by the index."""
+    id: str
+    summary: str
+    start: datetime
+    end: datetime
+    timezone: str = DEFAULT_TIMEZONE
+    calendar_id: str = "primary"
+    extra: Dict[str, Any] = field(default_factory=dict)
+    # RRULE for recurring series, e.g. "RRULE:FREQ=WEEKLY;BYDAY=MO"; start/end are the first occurrence
+    recurrence: Optional[str] = None
+    # Start timestamps of cancelled occurrences of a recurring series
+    exdates: set = field(default_factory=set)
+    # Set on expanded occurrences: id of the series they belong to
+    recurring_event_id: Optional[str] = None
+    # Cached epoch seconds; range scans compare these instead of aware datetimes
+    start_ts: float = field(init=False, repr=False)
+    end_ts: float = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.start_ts = self.start.timestamp()
+        self.end_ts = self.end.timestamp()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Google Calendar-shaped representation returned by the tools."""
+        tz = pytz.timezone(self.timezone)
+        event = {
+            "id": self.id,
+            "summary": self.summary,
+            "start": {"dateTime": self.start.astimezone(tz).isoformat(), "timeZone": self.timezone},
+            "end": {"dateTime": self.end.astimezone(tz).isoformat(), "timeZone": self.timezone},
+        }
+        if self.recurrence:
+            event["recurrence"] = [self.recurrence]
+        if self.recurring_event_id:
+            event["recurringEventId"] = self.recurring_event_id
+            event["originalStartTime"] = event["start"]
+        event.update(self.extra)
+        return event
+
+
+def instance_id(series_id: str, start: datetime) -> str:
+    """Google-style id of one occurrence of a recurring series, e.g. "abc_20240717T080000Z"."""
+    return f"{series_id}_{start.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')}"
+
+
+@lru_cache(maxsize=256)
+def _parse_rule(recurrence: str, dtstart: datetime) -> Any:
+    # Rules are expanded in naive local time and localized per occurrence, so a 09:00
+    # weekly meeting stays at 09:00 across DST changes; UNTIL=...Z is read as local time
+    from dateutil.rrule import rrulestr  # only needed once a recurring event exists
+    return rrulestr(recurrence, dtstart=dtstart, ignoretz=True)
+
+
+def validate_recurrence(recurrence: str, start: datetime) -> None:
+    """Raise ValueError if recurrence is not a valid RRULE for a series starting at start."""
+    _parse_rule(recurrence, start.replace(tzinfo=None))
+
+
+class ExpansionCache:
+    """
+    LRU cache of recurrence expansions, keyed by (rule, series start, timezone, window).
+    Occurrences are produced lazily; a window is only cached once it has been expanded
+    completely, so an early stop (max_results) never stores a truncated expansion.
+    """
+
+    def __init__(self, maxsize: int = EXPANSION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Tuple[float, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: tuple) -> Optional[Tuple[float, ...]]:
+        with self._lock:
+            starts = self._entries.get(key)
+            if starts is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return starts
+
+    def _put(self, key: tuple, starts: Tuple[float, ...]) -> None:
+        with self._lock:
+            self._entries[key] = starts
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def occurrence_starts(self, series: StoredEvent, window_start_ts: float, window_end_ts: float) -> Iterator[float]:
+        """Yield start timestamps of occurrences that overlap [window_start_ts, window_end_ts), in order."""
+        duration = series.end_ts - series.start_ts
+        key = (series.recurrence, series.start_ts, series.timezone, window_start_ts - duration, window_end_ts)
+        cached = self._get(key)
+        if cached is not None:
+            yield from cached
+            return
+
+        tz = pytz.timezone(series.timezone)
+        rule = _parse_rule(series.recurrence, series.start.astimezone(tz).replace(tzinfo=None))
+        after = datetime.fromtimestamp(window_start_ts - duration, tz).replace(tzinfo=None)
+        starts: List[float] = []
+        for local_start in rule.xafter(after, inc=False):
+            start_ts = tz.localize(local_start).timestamp()
+            if start_ts >= window_end_ts:
+                break
+            if start_ts + duration <= window_start_ts:
+                continue
+            starts.append(start_ts)
+            yield start_ts
+        self._put(key, tuple(starts))
+
+
+# Shared by all stores; keys include the rule and series start, so series never collide
+expansion_cache = ExpansionCache()
+
+
+class CalendarIndex:
+    """
+    Events of one calendar, indexed for range queries.
+
+    Events are kept in a list sorted by (start_ts, id) and an id -> event hash map. An event
+    overlaps [start, end) iff event.start < end and event.end > start; since no event is longer
+    than max_duration, all candidates have start in [start - max_duration, end), which two
+    bisections locate in O(log n). The scan then only touches events near the window.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[float, str]] = []
+        self._events: Dict[str, StoredEvent] = {}
+        # Recurring series are not materialised; they are expanded per query window
+        self._recurring: Dict[str, StoredEvent] = {}
+        # Upper bound on event length; not lowered on delete, which only widens the scan slightly
+        self._max_duration = 0.0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def add(self, event: StoredEvent) -> None:
+        if event.id in self._events:
+            self.remove(event.id)
+        self._events[event.id] = event
+        if event.recurrence:
+            self._recurring[event.id] = event
+            return
+        insort(self._keys, (event.start_ts, event.id))
+        self._max_duration = max(self._max_duration, event.end_ts - event.start_ts)
+
+    def bulk_add(self, events: List[StoredEvent]) -> None:
+        """Add many events with a single sort instead of one insertion each."""
+        # Later duplicates of an id win, as with repeated add() calls
+        batch = {event.id: event for event in events}
+        single = []
+        for event in batch.values():
+            if event.id in self._events:
+                self.remove(event.id)
+            self._events[event.id] = event
+            if event.recurrence:
+                self._recurring[event.id] = event
+                continue
+            single.append(event)
+            self._max_duration = max(self._max_duration, event.end_ts - event.start_ts)
+        self._keys.extend((e.start_ts, e.id) for e in single)
+        self._keys.sort()
+
+    def get(self, event_id: str) -> Optional[StoredEvent]:
+        event = self._events.get(event_id)
+        if event is None and "_" in event_id:
+            event = self._instance(event_id)
+        return event
+
+    def _instance(self, event_id: str) -> Optional[StoredEvent]:
+        """Resolve an occurrence id ("<series id>_<UTC start>") of a recurring series."""
+        series_id, _, stamp = event_id.rpartition("_")
+        series = self._recurring.get(series_id)
+        if series is None:
+            return None
+        try:
+            start_ts = pytz.utc.localize(datetime.strptime(stamp, "%Y%m%dT%H%M%SZ")).timestamp()
+        except ValueError:
+            return None
+        # Confirm the rule really produces an occurrence at that time
+        if start_ts in series.exdates or start_ts not in expansion_cache.occurrence_starts(series, start_ts - 1, start_ts + 1):
+            return None
+        return self._occurrence(series, start_ts)
+
+    @staticmethod
+    def _occurrence(series: StoredEvent, start_ts: float) -> StoredEvent:
+        tz = pytz.timezone(series.timezone)
+        start = datetime.fromtimestamp(start_ts, tz)
+        return StoredEvent(
+            id=instance_id(series.id, start),
+            summary=series.summary,
+            start=start,
+            end=datetime.fromtimestamp(start_ts + series.end_ts - series.start_ts, tz),
+            timezone=series.timezone,
+            calendar_id=series.calendar_id,
+            extra=series.extra,
+            recurring_event_id=series.id,
+        )
+
+    def remove(self, event_id: str) -> Optional[StoredEvent]:
+        """Remove an event or a whole series; an occurrence id cancels just that occurrence."""
+        event = self._events.pop(event_id, None)
+        if event is None:
+            occurrence = self._instance(event_id) if "_" in event_id else None
+            if occurrence is not None:
+                self._recurring[occurrence.recurring_event_id].exdates.add(occurrence.start_ts)
+            return occurrence
+        if self._recurring.pop(event_id, None) is not None:
+            return event
+        key = (event.start_ts, event.id)
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+        return event
+
+    def events(self) -> List[StoredEvent]:
+        """All stored events, with recurring series unexpanded."""
+        return list(self._events.values())
+
+    def _range_single(self, start_ts: float, end_ts: float) -> Iterator[StoredEvent]:
+        lo = bisect_left(self._keys, (start_ts - self._max_duration,))
+        hi = bisect_left(self._keys, (end_ts,))
+        for i in range(lo, hi):
+            event = self._events[self._keys[i][1]]
+            if event.end_ts > start_ts:
+                yield event
+
+    def _range_series(self, series: StoredEvent, start_ts: float, end_ts: float) -> Iterator[StoredEvent]:
+        for occurrence_ts in expansion_cache.occurrence_starts(series, start_ts, end_ts):
+            if occurrence_ts not in series.exdates:
+                yield self._occurrence(series, occurrence_ts)
+
+    def range(self, start_ts: float, end_ts: float) -> Iterator[StoredEvent]:
+        """
+        Yield events overlapping [start_ts, end_ts) in start order. Recurring series are expanded
+        lazily and merged in, so stopping early only expands as many occurrences as were consumed.
+        """
+        single = self._range_single(start_ts, end_ts)
+        if not self._recurring:
+            return single
+        series = [self._range_series(e, start_ts, end_ts) for e in self._recurring.values()]
+        return heapq.merge(single, *series, key=lambda e: (e.start_ts, e.id))
+
+
+class EventStore:
+    """In-memory, thread-safe event store with one CalendarIndex per calendar_id."""
+
+    def __init__(self):
+        self._calendars: Dict[str, CalendarIndex] = {}
+        self._lock = threading.RLock()
+
+    def _calendar(self, calendar_id: str) -> CalendarIndex:
+        index = self._calendars.get(calendar_id)
+        if index is None:
+            index = self._calendars[calendar_id] = CalendarIndex()
+        return index
+
+    def create_event(self, summary: str, start: datetime, end: datetime, timezone: str = DEFAULT_TIMEZONE,
+                     calendar_id: str = "primary", event_id: Optional[str] = None,
+                     recurrence: Optional[str] = None, **extra: Any) -> StoredEvent:
+        if end < start:
+            raise ValueError(f"Event end {end.isoformat()} is before its start {start.isoformat()}.")
+        if recurrence:
+            validate_recurrence(recurrence, start.astimezone(pytz.timezone(timezone)))
+        event = StoredEvent(
+            id=event_id or uuid.uuid4().hex,
+            summary=summary,
+            start=start,
+            end=end,
+            timezone=timezone,
+            calendar_id=calendar_id,
+            extra=extra,
+            recurrence=recurrence or None,
+        )
+        with self._lock:
+            self._calendar(calendar_id).add(event)
+        return event
+
+    def bulk_load(self, events: List[StoredEvent]) -> None:
+        by_calendar: Dict[str, List[StoredEvent]] = {}
+        for event in events:
+            by_calendar.setdefault(event.calendar_id, []).append(event)
+        with self._lock:
+            for calendar_id, calendar_events in by_calendar.items():
+                self._calendar(calendar_id).bulk_add(calendar_events)
+
+    def get_event(self, event_id: str, calendar_id: Optional[str] = None) -> Optional[StoredEvent]:
+        """Look up an event by id, in one calendar or (calendar_id=None) in all of them."""
+        with self._lock:
+            if calendar_id is not None:
+                index = self._calendars.get(calendar_id)
+                return index.get(event_id) if index else None
+            for index in self._calendars.values():
+                event = index.get(event_id)
+                if event is not None:
+                    return event
+        return None
+
+    def delete_event(self, event_id: str, calendar_id: Optional[str] = None) -> Optional[StoredEvent]:
+        with self._lock:
+            event = self.get_event(event_id, calendar_id)
+            if event is None:
+                return None
+            return self._calendars[event.calendar_id].remove(event_id)
+
+    def list_events(self, start: datetime, end: datetime, calendar_id: str = "primary",
+                    summary: Optional[str] = None, max_results: Optional[int] = None) -> List[StoredEvent]:
+        """Events overlapping [start, end) in start order, optionally filtered by a summary substring."""
+        needle = summary.lower() if summary else None
+        results: List[StoredEvent] = []
+        with self._lock:
+            index = self._calendars.get(calendar_id)
+            if index is None:
+                return results
+            for event in index.range(start.timestamp(), end.timestamp()):
+                if needle is not None and needle not in event.summary.lower():
+                    continue
+                results.append(event)
+                if max_results is not None and len(results) >= max_results:
+                    break
+        return results
+
+    def find_free_slots(self, start: datetime, end: datetime, duration: timedelta,
+                        calendar_ids: Optional[List[str]] = None, work_start: dt_time = dt_time(9, 0),
+                        work_end: dt_time = dt_time(17, 0), timezone: str = DEFAULT_TIMEZONE,
+                        include_weekends: bool = False) -> List[Tuple[datetime, datetime]]:
+        """Free slots of at least `duration` within working hours, busy in any of the calendars counts as busy."""
+        busy: List[Tuple[float, float]] = []
+        for calendar_id in calendar_ids or ["primary"]:
+            busy.extend((e.start_ts, e.end_ts) for e in self.list_events(start, end, calendar_id=calendar_id))
+        return free_slots_in_working_hours(busy, start, end, duration, work_start, work_end, timezone, include_weekends)
+
+    def events(self, calendar_id: str = "primary") -> List[StoredEvent]:
+        """All events of a calendar as stored, with recurring series unexpanded."""
+        with self._lock:
+            index = self._calendars.get(calendar_id)
+            return index.events() if index else []
+
+    def count(self, calendar_id: Optional[str] = None) -> int:
+        with self._lock:
+            if calendar_id is not None:
+                return len(self._calendars.get(calendar_id, ()))
+            return sum(len(index) for index in self._calendars.values())
+
+
+def merge_intervals(intervals: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """Sort-and-sweep merge of (start, end) intervals; touching intervals are merged too."""
+    merged: List[Tuple[float, float]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def working_windows(start: datetime, end: datetime, work_start: dt_time, work_end: dt_time,
+                    timezone: str = DEFAULT_TIMEZONE, include_weekends: bool = False) -> List[Tuple[float, float]]:
+    """Working-hours windows (epoch seconds) for every local day between start and end, clipped to [start, end)."""
+    tz = pytz.timezone(timezone)
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    windows: List[Tuple[float, float]] = []
+    day = start.astimezone(tz).date()
+    last_day = end.astimezone(tz).date()
+    while day <= last_day:
+        if include_weekends or day.weekday() < 5:
+            # Localize per day so DST changes shift the window correctly
+            w_start = tz.localize(datetime.combine(day, work_start)).timestamp()
+            w_end = tz.localize(datetime.combine(day, work_end)).timestamp()
+            w_start, w_end = max(w_start, start_ts), min(w_end, end_ts)
+            if w_start < w_end:
+                windows.append((w_start, w_end))
+        day += timedelta(days=1)
+    return windows
+
+
+def free_slots(busy: List[Tuple[float, float]], windows: List[Tuple[float, float]],
+               min_duration: float) -> List[Tuple[float, float]]:
+    """
+    Gaps of at least min_duration seconds inside the windows that do not overlap any busy interval.
+    Busy intervals are merged once, then swept alongside the sorted windows.
+    """
+    merged = merge_intervals(busy)
+    slots: List[Tuple[float, float]] = []
+    i = 0
+    for w_start, w_end in windows:
+        # Skip busy intervals that end before this window
+        while i < len(merged) and merged[i][1] <= w_start:
+            i += 1
+        cursor = w_start
+        j = i
+        while j < len(merged) and merged[j][0] < w_end:
+            b_start, b_end = merged[j]
+            if b_start - cursor >= min_duration:
+                slots.append((cursor, b_start))
+            cursor = max(cursor, b_end)
+            j += 1
+        if w_end - cursor >= min_duration:
+            slots.append((cursor, w_end))
+    return slots
+
+
+def free_slots_in_working_hours(busy: List[Tuple[float, float]], start: datetime, end: datetime, duration: timedelta,
+                                work_start: dt_time = dt_time(9, 0), work_end: dt_time = dt_time(17, 0),
+                                timezone: str = DEFAULT_TIMEZONE,
+                                include_weekends: bool = False) -> List[Tuple[datetime, datetime]]:
+    """
+    Free slots of at least `duration` within working hours between start and end, given busy
+    (start, end) intervals in epoch seconds. Slots are returned as datetimes in `timezone`.
+    Shared by every calendar backend; only how the busy intervals are fetched differs.
+    """
+    windows = working_windows(start, end, work_start, work_end, timezone, include_weekends)
+    tz = pytz.timezone(timezone)
+    return [
+        (datetime.fromtimestamp(s, tz), datetime.fromtimestamp(e, tz))
+        for s, e in free_slots(busy, windows, duration.total_seconds())
+    ]
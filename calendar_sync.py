@@ -0,0 +1,247 @@
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from calendar_store import DEFAULT_TIMEZONE, CalendarIndex, StoredEvent, free_slots_in_working_hours
+from google_calendar import GoogleCalendarBackend, SyncTokenExpired, event_from_google, parse_google_time
+
+DEFAULT_MIRROR_PATH = ".calendar_mirror.sqlite"
+# Reads within this many seconds of the last sync are answered without contacting the API
+DEFAULT_MAX_STALENESS = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    status TEXT,
+    summary TEXT,
+    start_ts REAL,
+    end_ts REAL,
+    recurrence TEXT,
+    recurring_event_id TEXT,
+    original_start_ts REAL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, id)
+);
+CREATE INDEX IF NOT EXISTS events_by_start ON events (calendar_id, start_ts);
+CREATE TABLE IF NOT EXISTS sync_state (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT,
+    synced_at REAL
+);
+"""
+
+
+class CalendarMirror:
+    """
+    Local SQLite mirror of Google calendars, kept current with incremental syncs (syncToken).
+
+    Has the EventStore interface, so it can back calendar_tools via set_event_store(). Reads are
+    answered from the mirror; a calendar is re-synced first only if its last sync is older than
+    max_staleness seconds, and an incremental sync only transfers events changed since then.
+    Writes go to the API and are applied to the mirror right away, so the agent sees its own
+    changes. Recurring series are stored unexpanded and expanded locally per query.
+    """
+
+    def __init__(self, backend: GoogleCalendarBackend, path: str = DEFAULT_MIRROR_PATH,
+                 max_staleness: float = DEFAULT_MAX_STALENESS, timezone: str = DEFAULT_TIMEZONE):
+        self.backend = backend
+        self.max_staleness = max_staleness
+        self.timezone = timezone
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        # Per calendar: time of the last sync, longest single event, and recurring series index
+        self._synced_at: Dict[str, float] = {}
+        self._max_duration: Dict[str, float] = {}
+        self._series: Dict[str, CalendarIndex] = {}
+
+    def close(self) -> None:
+        self._conn.close()
+
+    # --- Sync ---
+
+    def sync(self, calendar_id: str = "primary") -> int:
+        """Bring one calendar up to date; returns the number of changed events applied."""
+        with self._lock:
+            row = self._conn.execute("SELECT sync_token FROM sync_state WHERE calendar_id = ?", (calendar_id,)).fetchone()
+            sync_token = row[0] if row else None
+            try:
+                changed = self._pull(calendar_id, sync_token)
+            except SyncTokenExpired:
+                # Google's documented recovery: drop the mirror and do a full sync
+                changed = self._pull(calendar_id, None)
+            self._synced_at[calendar_id] = time.monotonic()
+            return changed
+
+    def _pull(self, calendar_id: str, sync_token: Optional[str]) -> int:
+        items: List[Dict[str, Any]] = []
+        page_token = None
+        while True:
+            page = self.backend.list_changes(calendar_id, sync_token=sync_token, page_token=page_token)
+            items.extend(page.get("items", []))
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                break
+        with self._conn:
+            if sync_token is None:
+                self._conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+            for item in items:
+                self._apply(calendar_id, item)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (calendar_id, sync_token, synced_at) VALUES (?, ?, ?)",
+                (calendar_id, page.get("nextSyncToken"), time.time()),
+            )
+        self._invalidate(calendar_id)
+        return len(items)
+
+    def _apply(self, calendar_id: str, item: Dict[str, Any]) -> None:
+        original = item.get("originalStartTime")
+        original_ts = parse_google_time(original, self.timezone).timestamp() if original else None
+        if item.get("status") == "cancelled":
+            if item.get("recurringEventId"):
+                # Keep cancelled occurrences: they are the exceptions of their series
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO events (calendar_id, id, status, recurring_event_id, original_start_ts, data) "
+                    "VALUES (?, ?, 'cancelled', ?, ?, ?)",
+                    (calendar_id, item["id"], item["recurringEventId"], original_ts, json.dumps(item)),
+                )
+            else:
+                self._conn.execute("DELETE FROM events WHERE calendar_id = ? AND (id = ? OR recurring_event_id = ?)",
+                                   (calendar_id, item["id"], item["id"]))
+            return
+        event = event_from_google(item, calendar_id, self.timezone)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO events (calendar_id, id, status, summary, start_ts, end_ts, recurrence, "
+            "recurring_event_id, original_start_ts, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (calendar_id, event.id, item.get("status", "confirmed"), event.summary, event.start_ts, event.end_ts,
+             event.recurrence, event.recurring_event_id, original_ts, json.dumps(item)),
+        )
+
+    def _invalidate(self, calendar_id: str) -> None:
+        self._max_duration.pop(calendar_id, None)
+        self._series.pop(calendar_id, None)
+
+    def _ensure_fresh(self, calendar_id: str) -> None:
+        synced_at = self._synced_at.get(calendar_id)
+        if synced_at is None or time.monotonic() - synced_at > self.max_staleness:
+            self.sync(calendar_id)
+
+    def _series_index(self, calendar_id: str) -> CalendarIndex:
+        """Recurring series of a calendar, with modified and cancelled occurrences as exdates."""
+        index = self._series.get(calendar_id)
+        if index is None:
+            index = CalendarIndex()
+            series = [
+                event_from_google(json.loads(data), calendar_id, self.timezone)
+                for (data,) in self._conn.execute(
+                    "SELECT data FROM events WHERE calendar_id = ? AND recurrence IS NOT NULL AND status != 'cancelled'",
+                    (calendar_id,))
+            ]
+            by_id = {event.id: event for event in series}
+            for series_id, original_ts in self._conn.execute(
+                    "SELECT recurring_event_id, original_start_ts FROM events "
+                    "WHERE calendar_id = ? AND recurring_event_id IS NOT NULL AND original_start_ts IS NOT NULL",
+                    (calendar_id,)):
+                if series_id in by_id:
+                    by_id[series_id].exdates.add(original_ts)
+            index.bulk_add(series)
+            self._series[calendar_id] = index
+        return index
+
+    def _single_range(self, calendar_id: str, start_ts: float, end_ts: float) -> Iterator[StoredEvent]:
+        max_duration = self._max_duration.get(calendar_id)
+        if max_duration is None:
+            row = self._conn.execute(
+                "SELECT MAX(end_ts - start_ts) FROM events WHERE calendar_id = ? AND recurrence IS NULL", (calendar_id,)
+            ).fetchone()
+            max_duration = self._max_duration[calendar_id] = row[0] or 0.0
+        # Bounded index range scan on (calendar_id, start_ts), as CalendarIndex does with bisect
+        rows = self._conn.execute(
+            "SELECT data FROM events WHERE calendar_id = ? AND start_ts >= ? AND start_ts < ? AND end_ts > ? "
+            "AND recurrence IS NULL AND status != 'cancelled' ORDER BY start_ts, id",
+            (calendar_id, start_ts - max_duration, end_ts, start_ts),
+        )
+        for (data,) in rows:
+            yield event_from_google(json.loads(data), calendar_id, self.timezone)
+
+    # --- EventStore interface ---
+
+    def create_event(self, summary: str, start: datetime, end: datetime, timezone: str = DEFAULT_TIMEZONE,
+                     calendar_id: str = "primary", event_id: Optional[str] = None,
+                     recurrence: Optional[str] = None, **extra: Any) -> StoredEvent:
+        event = self.backend.create_event(summary, start, end, timezone=timezone, calendar_id=calendar_id,
+                                          event_id=event_id, recurrence=recurrence, **extra)
+        with self._lock, self._conn:
+            self._apply(calendar_id, event.to_dict())
+            self._invalidate(calendar_id)
+        return event
+
+    def get_event(self, event_id: str, calendar_id: Optional[str] = None) -> Optional[StoredEvent]:
+        calendar_id = calendar_id or "primary"
+        with self._lock:
+            self._ensure_fresh(calendar_id)
+            row = self._conn.execute(
+                "SELECT data FROM events WHERE calendar_id = ? AND id = ? AND status != 'cancelled'", (calendar_id, event_id)
+            ).fetchone()
+            if row is not None:
+                return event_from_google(json.loads(row[0]), calendar_id, self.timezone)
+            # Unmodified occurrences of a series are not stored; resolve them from the series
+            return self._series_index(calendar_id).get(event_id)
+
+    def delete_event(self, event_id: str, calendar_id: Optional[str] = None) -> Optional[StoredEvent]:
+        calendar_id = calendar_id or "primary"
+        event = self.backend.delete_event(event_id, calendar_id)
+        if event is None:
+            return None
+        item: Dict[str, Any] = {"id": event_id, "status": "cancelled"}
+        if event.recurring_event_id:
+            item["recurringEventId"] = event.recurring_event_id
+            item["originalStartTime"] = {"dateTime": event.start.isoformat(), "timeZone": event.timezone}
+        with self._lock, self._conn:
+            self._apply(calendar_id, item)
+            self._invalidate(calendar_id)
+        return event
+
+    def list_events(self, start: datetime, end: datetime, calendar_id: str = "primary",
+                    summary: Optional[str] = None, max_results: Optional[int] = None) -> List[StoredEvent]:
+        """Events overlapping [start, end) in start order, optionally filtered by a summary substring."""
+        needle = summary.lower() if summary else None
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        results: List[StoredEvent] = []
+        with self._lock:
+            self._ensure_fresh(calendar_id)
+            events = heapq.merge(self._single_range(calendar_id, start_ts, end_ts),
+                                 self._series_index(calendar_id).range(start_ts, end_ts),
+                                 key=lambda e: (e.start_ts, e.id))
+            for event in events:
+                if needle is not None and needle not in event.summary.lower():
+                    continue
+                results.append(event)
+                if max_results is not None and len(results) >= max_results:
+                    break
+        return results
+
+    def find_free_slots(self, start: datetime, end: datetime, duration: timedelta,
+                        calendar_ids: Optional[List[str]] = None, work_start: dt_time = dt_time(9, 0),
+                        work_end: dt_time = dt_time(17, 0), timezone: str = DEFAULT_TIMEZONE,
+                        include_weekends: bool = False) -> List[Tuple[datetime, datetime]]:
+        """Same as EventStore.find_free_slots, computed from the mirror."""
+        busy: List[Tuple[float, float]] = []
+        for calendar_id in calendar_ids or ["primary"]:
+            busy.extend((e.start_ts, e.end_ts) for e in self.list_events(start, end, calendar_id=calendar_id))
+        return free_slots_in_working_hours(busy, start, end, duration, work_start, work_end, timezone, include_weekends)
+
+    def count(self, calendar_id: Optional[str] = None) -> int:
+        """Stored (unexpanded) events, excluding cancelled occurrences."""
+        with self._lock:
+            if calendar_id is not None:
+                row = self._conn.execute("SELECT COUNT(*) FROM events WHERE calendar_id = ? AND status != 'cancelled'",
+                                         (calendar_id,)).fetchone()
+            else:
+                row = self._conn.execute("SELECT COUNT(*) FROM events WHERE status != 'cancelled'").fetchone()
+            return row[0]
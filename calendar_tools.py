@@ -1,12 +1,55 @@
+import json
 import os
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime, time as dt_time, timedelta
+from typing import List, Optional
 import pytz
 from langchain_core.tools import tool
 
+from calendar_store import CALENDAR_BACKENDS, EventStore, parse_datetime
+
 # Timezone config
 AMSTERDAM_TZ = pytz.timezone('Europe/Amsterdam')
 
+# Tools that never change the calendar; calls to them can run concurrently in any order
+READ_ONLY_TOOLS = frozenset({"get_calendar_events", "get_calendar_event", "find_free_slots"})
+
+# Local calendar backend shared by all tool calls (ToolNode may run calls concurrently;
+# EventStore is thread-safe)
+_event_store = EventStore()
+
+
+def get_event_store() -> EventStore:
+    """Return the event store behind the calendar tools."""
+    return _event_store
+
+
+def set_event_store(store: EventStore) -> None:
+    """Replace the event store behind the calendar tools, e.g. with a pre-loaded one for load tests."""
+    global _event_store
+    _event_store = store
+
+
+def configure_calendar_backend(backend: str = "local", root_url: Optional[str] = None,
+                               mirror_path: Optional[str] = None) -> None:
+    """
+    Select the backend behind the tools. root_url points the Google backend at another server
+    implementing the Calendar API, e.g. fake_calendar_api.py; mirror_path is the SQLite file
+    used by the mirror backend.
+    """
+    if backend in ("google", "mirror"):
+        # Imported lazily so the local backend works without the Google client libraries
+        from google_calendar import GoogleCalendarBackend
+        google = GoogleCalendarBackend.connect(root_url=root_url)
+        if backend == "mirror":
+            from calendar_sync import DEFAULT_MIRROR_PATH, CalendarMirror
+            set_event_store(CalendarMirror(google, path=mirror_path or DEFAULT_MIRROR_PATH))
+        else:
+            set_event_store(google)
+    elif backend == "local":
+        set_event_store(EventStore())
+    else:
+        raise ValueError(f"Unknown calendar backend '{backend}', expected one of {CALENDAR_BACKENDS}.")
+
 
 def get_current_time() -> str:
     """Get the current time in Amsterdam timezone as a string."""
@@ -18,18 +61,27 @@ def create_calendar_event(
     start_datetime: str,
     end_datetime: str,
     summary: str,
-    timezone: str = "Europe/Amsterdam"
+    timezone: str = "Europe/Amsterdam",
+    recurrence: Optional[str] = None
 ) -> str:
-    """Create a calendar event in Google Calendar."""
-    
-    return "Event scheduled"
+    """Create a calendar event in Google Calendar.
+    For a repeating event, pass an RFC 5545 rule as recurrence, e.g. "RRULE:FREQ=WEEKLY;BYDAY=MO".
+    """
+    try:
+        start = parse_datetime(start_datetime, timezone)
+        end = parse_datetime(end_datetime, timezone)
+        event = get_event_store().create_event(summary, start, end, timezone=timezone, recurrence=recurrence)
+    except (ValueError, pytz.UnknownTimeZoneError) as e:
+        return f"Error creating event: {e}"
+    return json.dumps({"status": "Event scheduled", "event": event.to_dict()})
 
 
 @tool
 def delete_calendar_event(event_id: str) -> str:
     """Deletes a specific calendar event using its unique event_id."""
-    # In a real implementation, use event_id to delete the event via API
-    print(f"Attempting to delete event with ID: {event_id}") # Add print for stub visibility
+    event = get_event_store().delete_event(event_id)
+    if event is None:
+        return f"Event not found (ID: {event_id})"
     return f"Event deleted (ID: {event_id})"
 
 
@@ -53,9 +105,49 @@ def get_calendar_events(
     if end_datetime is None:
         end_datetime = (datetime.now(AMSTERDAM_TZ) + timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
 
-    # Add print for stub visibility
-    print(f"Searching events: Start='{start_datetime}', End='{end_datetime}', Summary='{summary}', MaxResults={max_results}")
-    return "Events retrieved"
+    try:
+        start = parse_datetime(start_datetime, time_zone)
+        end = parse_datetime(end_datetime, time_zone)
+    except (ValueError, pytz.UnknownTimeZoneError) as e:
+        return f"Error retrieving events: {e}"
+
+    # Events are always returned in start order, which is what order_by="startTime" asks for
+    events = get_event_store().list_events(start, end, calendar_id=calendar_id, summary=summary, max_results=max_results)
+    return json.dumps({"items": [event.to_dict() for event in events]})
+
+
+@tool
+def find_free_slots(
+    start_datetime: str,
+    end_datetime: str,
+    duration_minutes: int = 30,
+    calendar_ids: Optional[List[str]] = None,
+    working_hours_start: str = "09:00",
+    working_hours_end: str = "17:00",
+    include_weekends: bool = False,
+    max_results: int = 10,
+    time_zone: str = "Europe/Amsterdam",
+) -> str:
+    """Find free time slots of at least duration_minutes between start_datetime and end_datetime.
+    Only times within working hours (working_hours_start to working_hours_end, HH:MM) are offered.
+    A time is busy if any calendar in calendar_ids (default: the primary calendar) has an event then.
+    """
+    try:
+        start = parse_datetime(start_datetime, time_zone)
+        end = parse_datetime(end_datetime, time_zone)
+        work_start = dt_time.fromisoformat(working_hours_start)
+        work_end = dt_time.fromisoformat(working_hours_end)
+    except (ValueError, pytz.UnknownTimeZoneError) as e:
+        return f"Error finding free slots: {e}"
+    if duration_minutes <= 0:
+        # A zero-length slot fits anywhere, so every free moment would be offered
+        return f"Error finding free slots: duration_minutes must be positive, got {duration_minutes}"
+
+    slots = get_event_store().find_free_slots(
+        start, end, timedelta(minutes=duration_minutes), calendar_ids=calendar_ids,
+        work_start=work_start, work_end=work_end, timezone=time_zone, include_weekends=include_weekends,
+    )
+    return json.dumps({"slots": [{"start": s.isoformat(), "end": e.isoformat()} for s, e in slots[:max_results]]})
 
 
 @tool
@@ -65,4 +157,7 @@ def get_calendar_event(
     timezone: str = "Europe/Amsterdam"
 ) -> str:
     """Retrieves the details for a single calendar event based on its unique event_id."""
-    return "Event retrieved" 
\ No newline at end of file
+    event = get_event_store().get_event(event_id, calendar_id)
+    if event is None:
+        return f"Event not found (ID: {event_id})"
+    return json.dumps(event.to_dict())
@@ -0,0 +1,274 @@
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Same format and conventions as the evaluation prompt (eval.build_eval_messages)
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+END_OF_DAY = time(23, 59, 59)
+# (start, end) of a part of the day; an end before the start is on the following day
+PARTS_OF_DAY = {
+    "afternoon": (time(12), time(17)),
+    "evening": (time(17), time(21)),
+    "night": (time(21), time(6)),
+}
+# Appended to the user message; the mock provider strips it to find the recorded input
+NOTE_SEPARATOR = "\n\n[Resolved dates"
+
+_MONTH = (r"jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+          r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?")
+_MONTHS = {name: i for i, name in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), start=1)}
+_WEEKDAYS = {name: i for i, name in enumerate(("mon", "tues", "wednes", "thurs", "fri", "satur", "sun"))}
+_CLOCK24 = r"\d{1,2}:[0-5]\d(?::[0-5]\d)?"
+# A time of day: 15:30, 11:30 AM, 3pm, noon. Bare numbers are only times after "at" (see at_hour).
+_TIME = r"(?:[01]?\d|2[0-3]):[0-5]\d(?::[0-5]\d)?(?:\s*(?:[ap]m\b|[ap]\.m\.))?|(?:1[0-2]|0?[1-9])\s*(?:[ap]m\b|[ap]\.m\.)|noon|midnight"
+_TO = r"\s*(?:-|–|to|until|till|and)\s*"
+_TOKENS = re.compile(
+    rf"\b(?P<iso>\d{{4}}-\d{{2}}-\d{{2}})(?:[T ](?P<iso_t1>{_CLOCK24})(?:{_TO}(?P<iso_t2>{_CLOCK24}))?)?"
+    rf"|\b(?P<md_month>{_MONTH})\.?\s+(?P<md_day>\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(?P<md_year>\d{{4}})\b)?"
+    rf"|\b(?P<dm_day>\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?(?P<dm_month>{_MONTH})\b\.?(?:,?\s+(?P<dm_year>\d{{4}})\b)?"
+    r"|\b(?P<relday>day after tomorrow|today|tonight|tomorrow|yesterday)\b"
+    r"|\b(?:(?P<wd_mod>this|next|last|coming)\s+)?(?P<weekday>mon|tues|wednes|thurs|fri|satur|sun)day\b"
+    r"|\b(?:in\s+)?(?:the\s+)?(?:next|coming)\s+(?P<span_n>\d+)\s+(?P<span_unit>day|hour|week)s?\b"
+    r"|\b(?P<p_mod>this|next|last)\s+(?P<period>week|month)\b"
+    rf"|(?:\b(?:from|between)\s+)?(?P<t1>{_TIME}|\d{{1,2}}){_TO}(?P<t2>{_TIME})"
+    rf"|(?:\bat\s+)?(?P<time>{_TIME})"
+    r"|\bat\s+(?P<at_hour>\d{1,2})\b(?!\s*(?:%|[:.]\d|min|hour|hr))"
+    r"|\b(?:(?P<dur_n>\d+(?:\.\d+)?)[\s-]*|(?P<dur_word>half an|an?|one)[\s-]+)(?P<dur_unit>minute|min|hour|hr|h)s?\b"
+    r"(?!\s+(?:before|earlier|prior))"
+    r"|\b(?P<part>afternoon|evening|night|all[\s-]day|whole day|entire day)\b",
+    re.IGNORECASE,
+)
+_CLOCK = re.compile(r"(\d{1,2})(?::(\d{2}))?(?::(\d{2}))?\s*([ap])?", re.IGNORECASE)
+_CONNECTOR = re.compile(r"\s*,?\s*(?:-|–|to|and|until|till|through|thru)\s*", re.IGNORECASE)
+_STARTING_NOW = re.compile(r"\b(?:starting|from) now\b", re.IGNORECASE)
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+
+# Token kind of a _TOKENS match, by the group that is set
+_KIND_GROUPS = (("iso", "iso"), ("md", "md_month"), ("dm", "dm_month"), ("relday", "relday"), ("weekday", "weekday"),
+                ("span", "span_n"), ("period", "period"), ("trange", "t1"), ("time", "time"), ("time", "at_hour"),
+                ("dur", "dur_n"), ("dur", "dur_word"), ("part", "part"))
+_DAY_KINDS = ("iso", "md", "dm", "relday", "weekday")
+_RANGE_KINDS = ("span", "period")
+
+
+@dataclass
+class ResolvedRange:
+    """An absolute range for a date/time expression; end is None for a bare start time."""
+    phrase: str
+    start: datetime
+    end: Optional[datetime]
+
+    def __str__(self) -> str:
+        value = self.start.strftime(DATETIME_FORMAT)
+        if self.end is not None:
+            value += f" to {self.end.strftime(DATETIME_FORMAT)}"
+        return f'"{self.phrase}" = {value}'
+
+
+@dataclass
+class _Token:
+    kind: str
+    start: int
+    end: int
+    groups: Dict[str, Optional[str]]
+
+
+def _clock(text: str, meridiem: Optional[str] = None) -> time:
+    """time of "15:30", "11:30 AM", "3pm", "noon"; meridiem ("a"/"p") applies when text has none."""
+    text = text.lower()
+    if text == "noon":
+        return time(12)
+    if text == "midnight":
+        return time(0)
+    hour, minute, second, am_pm = _CLOCK.match(text).groups()
+    hour, am_pm = int(hour), am_pm or meridiem
+    if am_pm == "p" and hour < 12:
+        hour += 12
+    elif am_pm == "a" and hour == 12:
+        hour = 0
+    return time(hour, int(minute or 0), int(second or 0))
+
+
+def _meridiem(text: str) -> Optional[str]:
+    match = re.search(r"([ap])\.?m\.?$", text, re.IGNORECASE)
+    return match.group(1).lower() if match else None
+
+
+def _duration(groups: Dict[str, Optional[str]]) -> timedelta:
+    amount = (groups["dur_n"] or groups["dur_word"]).lower()
+    n = {"a": 1.0, "an": 1.0, "one": 1.0, "half an": 0.5}.get(amount) or float(amount)
+    return timedelta(minutes=n) if groups["dur_unit"].lower().startswith("m") else timedelta(hours=n)
+
+
+def _tokenize(text: str) -> List[_Token]:
+    tokens = []
+    for match in _TOKENS.finditer(text):
+        groups = match.groupdict()
+        kind = next(kind for kind, group in _KIND_GROUPS if groups[group])
+        if groups["at_hour"]:
+            groups["time"] = f"{groups['at_hour']}:00"
+        tokens.append(_Token(kind, match.start(), match.end(), groups))
+    # "Friday, July 19th 2024": the explicit date is the anchor, the weekday only repeats it
+    return [t for i, t in enumerate(tokens)
+            if not (t.kind == "weekday" and i + 1 < len(tokens) and tokens[i + 1].kind in ("iso", "md", "dm")
+                    and tokens[i + 1].start - t.end <= 3)]
+
+
+def _day(token: _Token, today: date) -> date:
+    g = token.groups
+    if token.kind == "iso":
+        return date.fromisoformat(g["iso"])
+    if token.kind in ("md", "dm"):
+        prefix = token.kind
+        year = g[f"{prefix}_year"]
+        return date(int(year) if year else today.year, _MONTHS[g[f"{prefix}_month"][:3].lower()], int(g[f"{prefix}_day"]))
+    if token.kind == "relday":
+        offset = {"today": 0, "tonight": 0, "tomorrow": 1, "yesterday": -1, "day after tomorrow": 2}
+        return today + timedelta(days=offset[g["relday"].lower()])
+    # Weekdays: the next occurrence from today on; "next <today's weekday>" is a week ahead
+    weekday, modifier = _WEEKDAYS[g["weekday"].lower()], (g["wd_mod"] or "").lower()
+    if modifier == "last":
+        return today - timedelta(days=(today.weekday() - weekday) % 7 or 7)
+    ahead = (weekday - today.weekday()) % 7
+    if ahead == 0 and modifier in ("next", "coming"):
+        ahead = 7
+    return today + timedelta(days=ahead)
+
+
+def _range_anchor(token: _Token, now: datetime, text: str) -> Tuple[datetime, datetime]:
+    g = token.groups
+    if token.kind == "span":
+        n = int(g["span_n"])
+        unit = g["span_unit"].lower()
+        return now, now + (timedelta(hours=n) if unit == "hour" else timedelta(days=n * (7 if unit == "week" else 1)))
+    today, modifier = now.date(), g["p_mod"].lower()
+    if g["period"].lower() == "week":
+        first = today - timedelta(days=today.weekday()) + timedelta(days={"this": 0, "next": 7, "last": -7}[modifier])
+        last = first + timedelta(days=6)
+    else:
+        month_start = today.replace(day=1)
+        if modifier == "next":
+            first = (month_start + timedelta(days=32)).replace(day=1)
+        elif modifier == "last":
+            first = (month_start - timedelta(days=1)).replace(day=1)
+        else:
+            first = month_start
+        last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    start = datetime.combine(first, time())
+    if modifier == "this" and _STARTING_NOW.search(text):
+        start = max(start, now)
+    return start, datetime.combine(last, END_OF_DAY)
+
+
+def _day_range(day: date, modifiers: List[_Token], tonight: bool) -> Tuple[datetime, Optional[datetime]]:
+    """Range on `day` from its time, time range, duration and part-of-day modifiers (first of each kind)."""
+    by_kind = {}
+    for m in modifiers:
+        by_kind.setdefault(m.kind, m)
+    anchor_times = by_kind.get("anchor")
+    if "trange" in by_kind or (anchor_times and anchor_times.groups.get("iso_t2")):
+        g = by_kind["trange"].groups if "trange" in by_kind else {"t1": anchor_times.groups["iso_t1"], "t2": anchor_times.groups["iso_t2"]}
+        start = datetime.combine(day, _clock(g["t1"], _meridiem(g["t2"])))
+        end = datetime.combine(day, _clock(g["t2"]))
+        return start, end + timedelta(days=1) if end <= start else end
+    clock = by_kind["time"].groups["time"] if "time" in by_kind else (anchor_times.groups.get("iso_t1") if anchor_times else None)
+    if clock:
+        start = datetime.combine(day, _clock(clock))
+        return start, start + _duration(by_kind["dur"].groups) if "dur" in by_kind else None
+    part = by_kind["part"].groups["part"].lower() if "part" in by_kind else ("night" if tonight else None)
+    if part in PARTS_OF_DAY:
+        first, last = PARTS_OF_DAY[part]
+        start, end = datetime.combine(day, first), datetime.combine(day, last)
+        return start, end + timedelta(days=1) if end <= start else end
+    # A day without times, or "all day"
+    return datetime.combine(day, time()), datetime.combine(day, END_OF_DAY)
+
+
+def resolve(text: str, now: datetime) -> List[ResolvedRange]:
+    """
+    Absolute ranges for the relative and natural-language date/time expressions in text,
+    resolved against now. Times, durations and parts of the day belong to the nearest date;
+    without any date they are today. Conventions are the evaluation prompt's: a day runs
+    00:00:00 to 23:59:59, afternoon 12-17, evening 17-21, night 21-06 the next day, weeks
+    Monday to Sunday.
+    """
+    tokens = _tokenize(text)
+    anchors = [t for t in tokens if t.kind in _DAY_KINDS + _RANGE_KINDS]
+    modifiers = [t for t in tokens if t.kind not in _DAY_KINDS + _RANGE_KINDS]
+    if not anchors:
+        if not any(m.kind in ("trange", "time", "part") for m in modifiers):
+            return []
+        anchors = [_Token("today", modifiers[0].start, modifiers[0].start, {})]
+    attached: Dict[int, List[_Token]] = {id(a): [] for a in anchors}
+    for m in modifiers:
+        nearest = min(anchors, key=lambda a: max(a.start - m.end, m.start - a.end, 0))
+        attached[id(nearest)].append(m)
+
+    # (phrase start, phrase end, start, end) per anchor, in text order
+    spans = []
+    for anchor in anchors:
+        group = [anchor] + attached[id(anchor)]
+        try:
+            if anchor.kind in _RANGE_KINDS:
+                start, end = _range_anchor(anchor, now, text)
+            else:
+                day = now.date() if anchor.kind == "today" else _day(anchor, now.date())
+                # An ISO date's own time (2024-07-20 14:00) counts as a time modifier
+                modifiers_of_day = attached[id(anchor)] + ([_Token("anchor", 0, 0, anchor.groups)] if anchor.groups.get("iso_t1") else [])
+                tonight = (anchor.groups.get("relday") or "").lower() == "tonight"
+                start, end = _day_range(day, modifiers_of_day, tonight)
+        except ValueError:
+            # "February 30th", "at 25": left to the model
+            continue
+        spans.append([min(t.start for t in group), max(t.end for t in group), start, end, anchor.kind])
+
+    # "from July 1st to July 5th", "between 2025-05-01 00:00:00 and 2025-05-07 23:59:59": one range
+    merged = []
+    for span in spans:
+        previous = merged[-1] if merged else None
+        if (previous and previous[4] in _DAY_KINDS and span[4] in _DAY_KINDS
+                and _CONNECTOR.fullmatch(text[previous[1]:span[0]])):
+            previous[1], previous[3] = span[1], span[3] or span[2]
+        else:
+            merged.append(span)
+    return [ResolvedRange(re.sub(r"^(?:from|between|at|on)\s+", "", text[s:e].strip(" ,."), flags=re.IGNORECASE), start, end)
+            for s, e, start, end, _ in merged]
+
+
+def resolution_note(text: str, now: datetime) -> Optional[str]:
+    """
+    "[Resolved dates (current time ...): "next Tuesday at 15:30 for 30 minutes" = 2024-07-23 15:30:00
+    to 2024-07-23 16:00:00]" for the expressions in text, or None when there is nothing to
+    resolve or every range is already written out in text.
+    """
+    ranges = [r for r in resolve(text, now)
+              if not (r.start.strftime(DATETIME_FORMAT) in text and (r.end is None or r.end.strftime(DATETIME_FORMAT) in text))]
+    if not ranges:
+        return None
+    return f"{NOTE_SEPARATOR.strip()} (current time {now.strftime(DATETIME_FORMAT)}): {'; '.join(str(r) for r in ranges)}]"
+
+
+def annotate(text: str, now: datetime) -> str:
+    """text with its resolution_note appended, or text itself when there is none."""
+    note = resolution_note(text, now)
+    return f"{text}\n\n{note}" if note else text
+
+
+def strip_note(text: str) -> str:
+    return text.split(NOTE_SEPARATOR, 1)[0]
+
+
+def reference_time(messages: Sequence[Any]) -> Optional[datetime]:
+    """The current time the system prompt gives the model ("... is 2024-07-16 09:00:00 ..."), if any."""
+    for message in messages:
+        if getattr(message, "type", None) != "system":
+            continue
+        content = message.content
+        if isinstance(content, list):
+            content = " ".join(block.get("text", "") for block in content if isinstance(block, dict))
+        match = _TIMESTAMP.search(str(content))
+        if match:
+            return datetime.strptime(match.group(0), DATETIME_FORMAT)
+    return None
@@ -4,356 +4,367 @@ import pandas as pd
 import pytz
 import time
 import json
+import csv
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta, time as dt_time
-from dateutil import parser as dateutil_parser
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langfuse.callback import CallbackHandler
+from langchain_core.messages import HumanMessage, AIMessage
 from typing import Optional, List, Dict, Any
-from main import build_graph, get_langfuse_handler
+from main import GRAPH_MODES, build_graph, get_provider, get_trace_handler
+from prompts import TOOL_SCHEMA_MODES, system_message
+from providers import configure_providers
+from instrumentation import MetricsCallbackHandler, make_exporter
+from llm_cache import CACHE_MODES, DEFAULT_CACHE_DIR
+from report import latency_summary
+from results_store import ResultsStore
+from tracing import TRACE_BACKENDS
+# TOOL_DEFAULTS is re-exported for callers that used eval.TOOL_DEFAULTS
+from scoring import TOOL_DEFAULTS, match_tool_calls, rescore_file
 
 # Define a fixed time for evaluation consistency
 FIXED_EVAL_TIME = "2024-07-16 09:00:00"
 AMSTERDAM_TZ_INFO = "Europe/Amsterdam"
 
-# --- Define Tool Default Arguments ---
-TOOL_DEFAULTS = {
-    "create_calendar_event": {
-        "timezone": "Europe/Amsterdam"
-    },
-    "get_calendar_events": {
-        "calendar_id": "primary",
-        "max_results": 10,
-        "order_by": "startTime",
-        "time_zone": "Europe/Amsterdam", # Note: Tool uses time_zone, not timezone
-    },
-    "get_calendar_event": {
-        "calendar_id": "primary",
-        "timezone": "Europe/Amsterdam"
-    },
-    "delete_calendar_event": {}
-}
-# ---
-
-def evaluate(input_csv: str, output_csv: str, model_identifier: str) -> None:
+def build_eval_messages(user_input: str, model_identifier: str = "") -> List[Any]:
+    """
+    Build the system + user messages sent to the graph for one test input. The system prompt
+    uses the fixed evaluation time, so all of it is a static, cacheable prefix.
+    """
+    # Use the fixed time for the system message
+    system_time = f"{FIXED_EVAL_TIME} ({AMSTERDAM_TZ_INFO})"
+    # Define time interpretations
+    time_definitions = (
+        "Interpret time ranges as follows unless specified otherwise: \n"
+        "- 'all day': 00:00:00 to 23:59:59 of the specified day. \n"
+        "- 'afternoon': 12:00:00 to 17:00:00. \n"
+        "- 'evening': 17:00:00 to 21:00:00. \n"
+        "- 'night': 21:00:00 to 06:00:00 the following day."
+    )
+
+    system_prompt = (
+        f"You are a helpful assistant. The current date and time for ALL calculations is EXACTLY {system_time}. "
+        f"Do NOT use any other time reference. Interpret all relative dates (like 'tomorrow', 'this Friday', "
+        f"'next week') based *only* on this provided date and time. \n"
+        f"{time_definitions}"
+    )
+    return [
+        system_message(system_prompt, model_identifier=model_identifier),
+        HumanMessage(content=str(user_input))
+    ]
+
+def run_graph(graph: Any, messages: List[Any], trace_handler: Optional[Any], user_input: str = "",
+              metrics: Optional[MetricsCallbackHandler] = None) -> Dict[str, Any]:
+    """
+    Stream one conversation through the compiled graph and collect the tool calls,
+    final response, token usage and latency. Latency is measured per call, so it
+    stays accurate when several rows run concurrently. The metrics handler (one per
+    call) adds time-to-first-token, per-node timings, loop iterations and token totals
+    over all model calls.
+    """
+    metrics = metrics or MetricsCallbackHandler("")
+    start_time = time.time()
+    response_chunks = []
+    token_usage = None
+    actual_tool_calls: List[Dict[str, Any]] = [] # Store actual tool calls here
+    full_response = ""
+    error = None
+    success = True # Represents successful execution, not evaluation pass/fail
+
+    try:
+        # "messages" mode makes the model stream its tokens, so time-to-first-token can be measured;
+        # only the "updates" events are needed to collect tool calls and the final response
+        events = graph.stream({"messages": messages}, config={"callbacks": [h for h in (trace_handler, metrics) if h is not None]},
+                              stream_mode=["updates", "messages"])
+        # Iterate through events robustly
+        for stream_mode, event in events:
+            if stream_mode != "updates":
+                continue
+            if isinstance(event, dict):
+                 # Process each key-value pair within the dictionary event
+                 for event_key, event_data in event.items():
+                    # --- Tool Call Interception ---
+                    # Check if the event is from the 'chatbot' node and contains an AIMessage with tool_calls
+                    if event_key == "chatbot" and isinstance(event_data, dict):
+                        messages_in_event = event_data.get("messages", [])
+                        if messages_in_event:
+                            last_message = messages_in_event[-1]
+                            if isinstance(last_message, AIMessage) and hasattr(last_message, 'tool_calls') and last_message.tool_calls:
+                                for tool_call in last_message.tool_calls:
+                                    # Ensure args is a dict, might be None or other types if parsing fails
+                                    args_dict = tool_call.get('args') if isinstance(tool_call.get('args'), dict) else {}
+                                    actual_tool_calls.append({
+                                        "name": tool_call.get('name'),
+                                        "args": args_dict
+                                    })
+                    # --- Existing Logic for response and metadata ---
+                    if isinstance(event_data, dict) and 'content' in event_data:
+                         # This might capture intermediate content, let's accumulate from AIMessage instead later
+                         pass # response_chunks.append(event_data['content']) # Original line commented out
+                    elif hasattr(event_data, 'content'):
+                         pass # response_chunks.append(event_data.content) # Original line commented out
+
+                    # Extract final response from the AIMessage if it's the final response
+                    # ("respond" is the templated answer node of the fast graph mode)
+                    if event_key in ("chatbot", "respond") and isinstance(event_data, dict):
+                        messages_in_event = event_data.get("messages", [])
+                        if messages_in_event:
+                            last_message = messages_in_event[-1]
+                            # Check if it's the final AI response (no tool calls)
+                            if isinstance(last_message, AIMessage) and not (hasattr(last_message, 'tool_calls') and last_message.tool_calls):
+                                 full_response = last_message.content.strip()
+
+
+                    metadata = None
+                    if isinstance(event_data, dict) and 'response_metadata' in event_data:
+                        metadata = event_data['response_metadata']
+                    elif hasattr(event_data, 'response_metadata'):
+                        metadata = event_data.response_metadata
+
+                    if metadata is not None:
+                        # Handle potential nested structure for token usage more robustly
+                        if isinstance(metadata, dict):
+                            usage_info = metadata.get('token_usage') or metadata.get('usage_metadata')
+                            if isinstance(usage_info, dict):
+                                token_usage = usage_info # Store the whole dict
+                            elif hasattr(metadata, 'token_usage'): # Fallback for direct attribute
+                                token_usage = metadata.token_usage
+                        elif hasattr(metadata, 'token_usage'):
+                             token_usage = metadata.token_usage
+
+
+    except Exception as e:
+        print(f"Error during graph execution for input: {str(user_input)[:50]}... - {e}")
+        full_response = ""
+        success = False
+        error = str(e)
+
+    end_time = time.time()
+    latency_ms = int((end_time - start_time) * 1000)
+
+    invocation = metrics.last
+    # Instrumented totals cover every model call of the run, not just the last message
+    if invocation is not None and invocation.token_usage():
+        token_usage = invocation.token_usage()
+
+    return {
+        'actual_tool_calls': actual_tool_calls,
+        'output': full_response,
+        'latency_ms': latency_ms,
+        'ttft_ms': round(invocation.ttft_ms) if invocation and invocation.ttft_ms is not None else None,
+        'chatbot_ms': round(invocation.chatbot_ms) if invocation else None,
+        'tools_ms': round(invocation.tools_ms) if invocation else None,
+        'loop_iterations': invocation.iterations if invocation else None,
+        'retries': invocation.retries if invocation else None,
+        'rate_limit_wait_ms': round(invocation.rate_limit_wait_ms) if invocation else None,
+        'fallback_model': invocation.fallback_model if invocation else None,
+        'token_usage': token_usage,
+        'execution_success': success,
+        'error': error,
+    }
+
+def evaluate_row(graph: Any, trace_handler: Optional[Any], user_input: str, expected_tool_name: str,
+                 expected_tool_args_str: str, expected_tool_args: Dict[str, Any],
+                 model_identifier: str = "", metrics_exporters: List[Any] = ()) -> Dict[str, Any]:
+    """Run a single test case through the graph and score it."""
+    messages = build_eval_messages(user_input, model_identifier)
+    metrics = MetricsCallbackHandler(model_identifier, metrics_exporters)
+    run = run_graph(graph, messages, trace_handler, user_input, metrics=metrics)
+    actual_tool_calls = run['actual_tool_calls']
+    token_usage = run['token_usage']
+
+    # --- Evaluation Logic ---
+    evaluation_result, matched_tool_call = match_tool_calls(actual_tool_calls, expected_tool_name, expected_tool_args)
+
+    result = {
+        'input': user_input,
+        'expected_tool_name': expected_tool_name,
+        'expected_tool_args': expected_tool_args_str, # Store original string
+        'actual_tool_calls': json.dumps(actual_tool_calls), # Store actual calls as JSON string
+        'matched_tool_call': json.dumps(matched_tool_call) if matched_tool_call else None, # Store matched call as JSON string
+        'evaluation_result': evaluation_result,
+        'output': run['output'], # Store final agent textual response
+        'latency_ms': run['latency_ms'],
+        'ttft_ms': run['ttft_ms'],
+        'chatbot_ms': run['chatbot_ms'],
+        'tools_ms': run['tools_ms'],
+        'loop_iterations': run['loop_iterations'],
+        'retries': run['retries'],
+        'rate_limit_wait_ms': run['rate_limit_wait_ms'],
+        'fallback_model': run['fallback_model'],
+        'token_usage': json.dumps(token_usage) if token_usage else None, # Store usage as JSON string
+        'execution_success': run['execution_success'] # Renamed to avoid confusion
+    }
+    if not run['execution_success']:
+        result['error'] = run['error']
+    return result
+
+# Column order of the results CSV
+RESULT_COLUMNS = [
+    'input', 'expected_tool_name', 'expected_tool_args', 'actual_tool_calls',
+    'matched_tool_call', 'evaluation_result', 'output', 'latency_ms', 'ttft_ms',
+    'chatbot_ms', 'tools_ms', 'loop_iterations', 'retries', 'rate_limit_wait_ms', 'fallback_model',
+    'token_usage', 'execution_success', 'error'
+]
+
+def iter_test_cases(input_csv: str, chunksize: int = 1000):
+    """
+    Stream test cases from the input CSV in chunks so large suites are never fully in memory.
+    Yields (row_number, job) where job is None for rows that had to be skipped, otherwise
+    (user_input, expected_tool_name, expected_tool_args_str, expected_tool_args).
+    """
+    for chunk in pd.read_csv(input_csv, engine='python', chunksize=chunksize):
+        for index, row in chunk.iterrows():
+            user_input = row.get('input')
+            expected_tool_name = row.get('expected_tool_name')
+            expected_tool_args_str = row.get('expected_tool_args')
+
+            if pd.isna(user_input) or pd.isna(expected_tool_name) or pd.isna(expected_tool_args_str):
+                print(f"Skipping row {index+2}: Missing required data.")
+                yield index + 2, None
+                continue
+
+            # Parse expected args
+            try:
+                expected_tool_args = json.loads(expected_tool_args_str)
+            except json.JSONDecodeError as e:
+                print(f"Skipping row {index+2}: Invalid JSON in expected_tool_args: {e}")
+                yield index + 2, None
+                continue
+
+            yield index + 2, (user_input, expected_tool_name, expected_tool_args_str, expected_tool_args)
+
+def result_key(user_input: Any, expected_tool_name: Any, expected_tool_args_str: Any) -> tuple:
+    """Identify a test case across runs, used to match input rows to stored results on --resume."""
+    return (str(user_input), str(expected_tool_name), str(expected_tool_args_str))
+
+def load_completed_results(output_csv: str) -> tuple:
+    """
+    Read an existing results CSV for --resume.
+    Rows that executed successfully are kept and returned as (keys, pass_count, fail_count);
+    rows that errored are dropped from the file so they are re-run instead of duplicated.
+    """
+    if not os.path.exists(output_csv) or os.path.getsize(output_csv) == 0:
+        return set(), 0, 0
+
+    done_df = pd.read_csv(output_csv, engine='python')
+    succeeded = done_df['execution_success'].astype(str) == 'True'
+    done_df = done_df[succeeded].reindex(columns=RESULT_COLUMNS)
+    # Rewrite atomically so an interrupted resume never loses the completed rows
+    tmp_path = f"{output_csv}.tmp"
+    done_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_csv)
+
+    keys = {
+        result_key(r.input, r.expected_tool_name, r.expected_tool_args)
+        for r in done_df.itertuples(index=False)
+    }
+    pass_count = int((done_df['evaluation_result'] == "PASS").sum())
+    return keys, pass_count, len(done_df) - pass_count
+
+def evaluate(input_csv: str, output_csv: str, model_identifier: str, concurrency: int = 1,
+             cache_mode: str = "off", cache_dir: str = DEFAULT_CACHE_DIR, resume: bool = False,
+             metrics_file: Optional[str] = None, graph_mode: str = "default", trace_backend: str = "auto",
+             trace_file: Optional[str] = None, results_db: Optional[str] = None, run_id: Optional[str] = None,
+             fallback_model: Optional[str] = None, tool_schema: str = "full", resolve_dates: bool = False) -> None:
     """
     Evaluate the chatbot across test inputs in a CSV, recording latency,
     token usage, and comparing actual tool calls against expected ones.
+    Results are appended to output_csv one row at a time, so an interrupted run
+    keeps every completed row and memory stays bounded for large suites.
     Args:
         input_csv: Path to CSV file with columns "input", "expected_tool_name",
                    and "expected_tool_args" (as JSON string).
         output_csv: Path where the results CSV will be written.
         model_identifier: Identifier for the LLM to use (e.g., "gpt-4o", "openrouter/mistralai/mistral-7b-instruct")
+        concurrency: Number of rows sent through the graph in parallel. Results are
+                     always written in input order.
+        cache_mode: LLM response cache mode ("off", "read", "write" or "readwrite").
+        cache_dir: Directory of the on-disk LLM response cache.
+        resume: Keep the successful rows already in output_csv and only run the
+                remaining inputs, appending their results.
+        metrics_file: Optional per-invocation metrics export (JSON lines, or Prometheus
+                      text for *.prom paths).
+        graph_mode: Agent graph variant, one of main.GRAPH_MODES.
+        trace_backend: Tracing backend, one of tracing.TRACE_BACKENDS ("off" disables tracing).
+        trace_file: JSON lines trace file for the "file" backend.
+        results_db: Optional SQLite results store (results_store.py) that also receives every row.
+        run_id: Run to store the rows under (default: a new run); reuse it with resume.
+        fallback_model: Model that answers calls still failing after retries; recorded per row.
+        tool_schema: "full" or "compact" tool schemas (prompts.TOOL_SCHEMA_MODES).
+        resolve_dates: Resolve relative dates against FIXED_EVAL_TIME before the model call (date_resolver.py).
     """
-    df = pd.read_csv(input_csv, engine='python')
-    results = []
-    # Use the fixed time for the system message
-    system_time = f"{FIXED_EVAL_TIME} ({AMSTERDAM_TZ_INFO})"
-    
     # The build_graph function (imported from main.py) will handle LLM initialization
     # and API key checks based on model_identifier.
-    graph = build_graph(model_identifier) # Pass model_identifier
-    langfuse_handler = get_langfuse_handler()
+    graph = build_graph(model_identifier, cache_mode=cache_mode, cache_dir=cache_dir, graph_mode=graph_mode,
+                        fallback_model=fallback_model, tool_schema=tool_schema,
+                        resolve_dates=resolve_dates) # Pass model_identifier
+    trace_handler = get_trace_handler(trace_backend, trace_file)
+    metrics_exporters = [make_exporter(metrics_file)] if metrics_file else []
 
     # Initialize counters
     correct_count = 0
     incorrect_count = 0
     total_count = 0
 
-    for index, row in df.iterrows():
-        total_count += 1
-        user_input = row.get('input')
-        expected_tool_name = row.get('expected_tool_name')
-        expected_tool_args_str = row.get('expected_tool_args')
-
-        if pd.isna(user_input) or pd.isna(expected_tool_name) or pd.isna(expected_tool_args_str):
-            print(f"Skipping row {index+2}: Missing required data.")
-            continue
-
-        # Parse expected args
-        try:
-            expected_tool_args = json.loads(expected_tool_args_str)
-        except json.JSONDecodeError as e:
-            print(f"Skipping row {index+2}: Invalid JSON in expected_tool_args: {e}")
-            continue
-
-        start_time = time.time()
-        # Define time interpretations
-        time_definitions = (
-            "Interpret time ranges as follows unless specified otherwise: \n"
-            "- 'all day': 00:00:00 to 23:59:59 of the specified day. \n"
-            "- 'afternoon': 12:00:00 to 17:00:00. \n"
-            "- 'evening': 17:00:00 to 21:00:00. \n"
-            "- 'night': 21:00:00 to 06:00:00 the following day."
-        )
-
-        system_prompt = (
-            f"You are a helpful assistant. The current date and time for ALL calculations is EXACTLY {system_time}. "
-            f"Do NOT use any other time reference. Interpret all relative dates (like 'tomorrow', 'this Friday', "
-            f"'next week') based *only* on this provided date and time. \n"
-            f"{time_definitions}"
-        )
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=str(user_input))
-        ]
-
-        response_chunks = []
-        token_usage = None
-        actual_tool_calls: List[Dict[str, Any]] = [] # Store actual tool calls here
-        full_response = ""
-        error = None
-        success = True # Represents successful execution, not evaluation pass/fail
-
+    completed_keys = set()
+    if resume:
+        completed_keys, correct_count, incorrect_count = load_completed_results(output_csv)
+        print(f"Resuming: {len(completed_keys)} completed rows found in {output_csv}")
+    write_header = not resume or not os.path.exists(output_csv) or os.path.getsize(output_csv) == 0
+    latencies = []
+    started = time.perf_counter()
+    store = ResultsStore(results_db) if results_db else None
+    if store is not None:
+        run_id = store.start_run(run_id, source=input_csv, models=[model_identifier], graph_mode=graph_mode)
+
+    with open(output_csv, 'a' if resume else 'w', newline='', encoding='utf-8') as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=RESULT_COLUMNS, extrasaction='ignore')
+        if write_header:
+            writer.writeheader()
+            out_file.flush()
+
+        def record(row_number: int, result: Dict[str, Any]) -> None:
+            nonlocal correct_count, incorrect_count
+            print(result, "\n\n")
+
+            # Increment counters based on evaluation result
+            if result['evaluation_result'] == "PASS":
+                correct_count += 1
+            else:
+                incorrect_count += 1
+            latencies.append(result['latency_ms'])
+
+            writer.writerow(result)
+            out_file.flush()
+            if store is not None:
+                store.add_result(run_id, model_identifier, row_number, result)
+
+        # The compiled graph is stateless between invocations, so rows can share it across threads.
+        # Futures are drained in submission order, which keeps the output CSV in input order, and
+        # at most a small window of them is pending so memory does not grow with the suite size.
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        pending = deque()
         try:
-            events = graph.stream({"messages": messages}, config={"callbacks": [langfuse_handler]})
-            # Iterate through events robustly
-            for event in events:
-                if isinstance(event, dict):
-                     # Process each key-value pair within the dictionary event
-                     for event_key, event_data in event.items():
-                        # --- Tool Call Interception ---
-                        # Check if the event is from the 'chatbot' node and contains an AIMessage with tool_calls
-                        if event_key == "chatbot" and isinstance(event_data, dict):
-                            messages_in_event = event_data.get("messages", [])
-                            if messages_in_event:
-                                last_message = messages_in_event[-1]
-                                if isinstance(last_message, AIMessage) and hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-                                    for tool_call in last_message.tool_calls:
-                                        # Ensure args is a dict, might be None or other types if parsing fails
-                                        args_dict = tool_call.get('args') if isinstance(tool_call.get('args'), dict) else {}
-                                        actual_tool_calls.append({
-                                            "name": tool_call.get('name'),
-                                            "args": args_dict
-                                        })
-                        # --- Existing Logic for response and metadata ---
-                        if isinstance(event_data, dict) and 'content' in event_data:
-                             # This might capture intermediate content, let's accumulate from AIMessage instead later
-                             pass # response_chunks.append(event_data['content']) # Original line commented out
-                        elif hasattr(event_data, 'content'):
-                             pass # response_chunks.append(event_data.content) # Original line commented out
-
-                        # Extract final response from the AIMessage if it's the final response
-                        if event_key == "chatbot" and isinstance(event_data, dict):
-                            messages_in_event = event_data.get("messages", [])
-                            if messages_in_event:
-                                last_message = messages_in_event[-1]
-                                # Check if it's the final AI response (no tool calls)
-                                if isinstance(last_message, AIMessage) and not (hasattr(last_message, 'tool_calls') and last_message.tool_calls):
-                                     full_response = last_message.content.strip()
-
-
-                        metadata = None
-                        if isinstance(event_data, dict) and 'response_metadata' in event_data:
-                            metadata = event_data['response_metadata']
-                        elif hasattr(event_data, 'response_metadata'):
-                            metadata = event_data.response_metadata
-
-                        if metadata is not None:
-                            # Handle potential nested structure for token usage more robustly
-                            if isinstance(metadata, dict):
-                                usage_info = metadata.get('token_usage') or metadata.get('usage_metadata')
-                                if isinstance(usage_info, dict):
-                                    token_usage = usage_info # Store the whole dict
-                                elif hasattr(metadata, 'token_usage'): # Fallback for direct attribute
-                                    token_usage = metadata.token_usage
-                            elif hasattr(metadata, 'token_usage'):
-                                 token_usage = metadata.token_usage
-
-
-        except Exception as e:
-            print(f"Error during graph execution for input: {user_input[:50]}... - {e}")
-            full_response = ""
-            success = False
-            error = str(e)
-
-        end_time = time.time()
-        latency_ms = int((end_time - start_time) * 1000)
-
-        # --- Evaluation Logic ---
-        evaluation_result = "FAIL"
-        matched_tool_call = None
-        for actual_call in actual_tool_calls:
-            actual_args = actual_call.get("args", {})
-            actual_name = actual_call.get("name")
-
-            # 1. Compare tool name
-            if actual_name != expected_tool_name:
-                continue # Try next actual call
-
-            # 2. Compare arguments flexibly
-            args_match = True
-            processed_keys = set()
-
-            # Compare keys present in expected_args
-            for key, expected_value in expected_tool_args.items():
-                processed_keys.add(key)
-                actual_value = actual_args.get(key)
-
-                # Check if the actual argument is missing
-                if actual_value is None and key in actual_args:
-                    # Handle case where arg exists but is explicitly None
-                    # Decide if None is acceptable based on tool/context, for now treat as mismatch if expected is not None
-                    if expected_value is not None:
-                         args_match = False
-                         break
-                    else:
-                         continue # Both are None, OK.
-                
-                if key not in actual_args:
-                    # Actual argument is missing. Check against defaults.
-                    tool_defaults_for_func = TOOL_DEFAULTS.get(actual_name, {})
-                    if key in tool_defaults_for_func:
-                        # Parameter has a default value defined
-                        default_value = tool_defaults_for_func[key]
-                        # Compare expected value with the tool's default value
-                        # Use flexible comparison if needed (e.g., for default dates/times if they existed)
-                        if key == "summary": # Example if default summary existed
-                             if str(expected_value).lower() != str(default_value).lower():
-                                  args_match = False
-                                  break # Expected non-default value, but agent omitted
-                        elif expected_value != default_value:
-                             # Add a fallback for potential type differences (e.g., int vs str)
-                             if str(expected_value) != str(default_value):
-                                 args_match = False
-                                 break # Expected non-default value, but agent omitted
-                        # If expected_value == default_value (or str representations match), it's OK, continue loop.
-                    else:
-                         # Parameter has no default, but was expected.
-                         args_match = False
-                         break # Agent omitted required parameter
-                    continue # Move to next key after handling missing arg
-                
-                # --- Argument exists in actual_args, perform comparison ---
-                if key in ["start_datetime", "end_datetime"]:
-                    # Flexible comparison logic
-                    try:
-                        # Attempt to parse both as datetimes
-                        dt_expected_raw = datetime.fromisoformat(str(expected_value).replace('Z', '+00:00'))
-                        dt_actual_raw = datetime.fromisoformat(str(actual_value).replace('Z', '+00:00'))
-
-                        # Make timezone naive for comparison
-                        dt_expected = dt_expected_raw.replace(tzinfo=None)
-                        dt_actual = dt_actual_raw.replace(tzinfo=None)
-
-                        # Assume match unless proven otherwise by checks below
-                        arg_matches = True 
-
-                        # 1. Exact match check (applies to all datetimes)
-                        if dt_expected == dt_actual:
-                            arg_matches = True # It's a match
-                        # 2. End-of-day equivalence check (only for end_datetime)
-                        elif key == "end_datetime":
-                            t_expected = dt_expected.time()
-                            t_actual = dt_actual.time()
-                            d_expected = dt_expected.date()
-                            d_actual = dt_actual.date()
-
-                            is_end_of_day_equivalent = False
-                            # Case 1: Expected is 23:59:59, Actual is 00:00:00 next day
-                            if t_expected == dt_time(23, 59, 59) and t_actual == dt_time(0, 0, 0) and d_actual == d_expected + timedelta(days=1):
-                                is_end_of_day_equivalent = True
-                            # Case 2: Actual is 23:59:59, Expected is 00:00:00 next day
-                            elif t_actual == dt_time(23, 59, 59) and t_expected == dt_time(0, 0, 0) and d_expected == d_actual + timedelta(days=1):
-                                is_end_of_day_equivalent = True
-
-                            if is_end_of_day_equivalent:
-                                arg_matches = True # Consider it a match
-                            else:
-                                arg_matches = False # Not exact, not equivalent end-of-day
-                        # 3. Not end_datetime and not an exact match
-                        else: # Must be start_datetime and not an exact match
-                            arg_matches = False 
-
-                        # If this specific datetime arg didn't match any criteria
-                        if not arg_matches:
-                            args_match = False
-                            break
-
-                    except ValueError:
-                        # Fallback to string comparison if parsing fails
-                        if str(expected_value) != str(actual_value):
-                            args_match = False
-                            break
-                elif key == "summary":
-                    # Flexible summary comparison (case-insensitive)
-                    # Passes if one string starts with the other.
-                    actual_lower = str(actual_value).lower()
-                    expected_lower = str(expected_value).lower()
-                    if not (actual_lower.startswith(expected_lower) or expected_lower.startswith(actual_lower)):
-                        args_match = False
-                        break
-                else:
-                    # Direct comparison for other keys (handle type differences if needed, e.g., int vs str)
-                    # Basic comparison might fail if types differ (e.g., expected 10, actual '10')
-                    # Add type casting if necessary: e.g. str(expected_value) != str(actual_value)
-                    if type(expected_value) != type(actual_value):
-                         # Attempt common type casting for comparison (e.g., int/float/str)
-                         try:
-                              if type(expected_value) is int and float(expected_value) != float(actual_value):
-                                   args_match = False; break
-                              elif type(expected_value) is float and float(expected_value) != float(actual_value):
-                                   args_match = False; break
-                              # Add other casting rules if needed (e.g., bool('True') vs True)
-                              elif str(expected_value) != str(actual_value): # General fallback
-                                   args_match = False; break
-                         except (ValueError, TypeError):
-                              args_match = False; break # Cannot cast/compare types
-                    elif expected_value != actual_value:
-                         args_match = False
-                         break
-
-            if not args_match:
-                continue # Argument mismatch for this call, try next actual call
-
-            # 3. (Optional Check) Check if actual_args has extra keys not in expected_args
-            # Since we updated expected_args to include defaults, this check might not be needed
-            # If needed, uncomment the following:
-            # for key in actual_args:
-            #     if key not in processed_keys:
-            #         # Decide how to handle extra keys (e.g., ignore if default, fail otherwise)
-            #         # For now, we assume if expected keys match, it's a pass
-            #         pass 
-
-            # If we reach here, all expected args matched this actual call
-            evaluation_result = "PASS"
-            matched_tool_call = actual_call
-            break # Stop searching once a match is found
-
-        # Increment counters based on evaluation result
-        if evaluation_result == "PASS":
-            correct_count += 1
-        else:
-            incorrect_count += 1
-
-        result = {
-            'input': user_input,
-            'expected_tool_name': expected_tool_name,
-            'expected_tool_args': expected_tool_args_str, # Store original string
-            'actual_tool_calls': json.dumps(actual_tool_calls), # Store actual calls as JSON string
-            'matched_tool_call': json.dumps(matched_tool_call) if matched_tool_call else None, # Store matched call as JSON string
-            'evaluation_result': evaluation_result,
-            'output': full_response, # Store final agent textual response
-            'latency_ms': latency_ms,
-            'token_usage': json.dumps(token_usage) if token_usage else None, # Store usage as JSON string
-            'execution_success': success # Renamed to avoid confusion
-        }
-        if not success:
-            result['error'] = error
-
-        print(result, "\n\n")
-
-        results.append(result)
-
-    out_df = pd.DataFrame(results)
-    # Define column order for clarity
-    column_order = [
-        'input', 'expected_tool_name', 'expected_tool_args', 'actual_tool_calls',
-        'matched_tool_call', 'evaluation_result', 'output', 'latency_ms',
-        'token_usage', 'execution_success', 'error'
-    ]
-    # Ensure all columns exist, fill missing ones like 'error' with NaN if needed
-    out_df = out_df.reindex(columns=column_order)
-    out_df.to_csv(output_csv, index=False)
+            for row_number, job in iter_test_cases(input_csv):
+                total_count += 1
+                if job is None:
+                    continue
+                if result_key(*job[:3]) in completed_keys:
+                    continue
+                pending.append((row_number, executor.submit(evaluate_row, graph, trace_handler, *job,
+                                                            model_identifier=model_identifier,
+                                                            metrics_exporters=metrics_exporters)))
+                while len(pending) >= 2 * max(1, concurrency):
+                    row, future = pending.popleft()
+                    record(row, future.result())
+            while pending:
+                row, future = pending.popleft()
+                record(row, future.result())
+        finally:
+            # On Ctrl-C, drop queued rows instead of waiting for them; written rows are already on disk
+            executor.shutdown(wait=True, cancel_futures=True)
+            if store is not None:
+                store.close()
 
     # --- Print Summary Statistics ---
     print("\n--- Evaluation Summary ---")
@@ -361,29 +372,259 @@ def evaluate(input_csv: str, output_csv: str, model_identifier: str) -> None:
     print(f"Correct (PASS):   {correct_count}")
     print(f"Incorrect (FAIL): {incorrect_count}")
     print(f"Accuracy:         {correct_count / total_count:.2%}")
+    if latencies:
+        elapsed = time.perf_counter() - started
+        print(f"Latency:          {latency_summary(latencies)}")
+        print(f"Throughput:       {len(latencies) / elapsed:.2f} rows/s at concurrency {concurrency}")
     print(f"Results saved to: {output_csv}")
+    if store is not None:
+        print(f"Results stored in {results_db} as run {run_id}")
+    # ---
+
+def model_results_path(output_csv: str, model_identifier: str) -> str:
+    """Per-model results file written next to the combined matrix table, e.g. results_qwen_qwen3-32b.csv."""
+    slug = model_identifier.replace("/", "_").replace(":", "_")
+    return os.path.join(os.path.dirname(output_csv), f"results_{slug}.csv")
+
+def parse_provider_limits(spec: Optional[str]) -> Dict[str, int]:
+    """Parse a provider limit spec like "openrouter=4,openai=8" into a dict."""
+    limits = {}
+    if spec:
+        for item in spec.split(","):
+            provider, _, limit = item.partition("=")
+            limits[provider.strip()] = int(limit)
+    return limits
+
+def evaluate_matrix(input_csv: str, output_csv: str, model_identifiers: List[str], concurrency: int = 4,
+                    provider_limits: Optional[Dict[str, int]] = None,
+                    cache_mode: str = "off", cache_dir: str = DEFAULT_CACHE_DIR, metrics_file: Optional[str] = None,
+                    graph_mode: str = "default", trace_backend: str = "auto",
+                    trace_file: Optional[str] = None, results_db: Optional[str] = None,
+                    run_id: Optional[str] = None, fallback_model: Optional[str] = None,
+                    tool_schema: str = "full", resolve_dates: bool = False) -> None:
+    """
+    Evaluate several models in one process with a single pass over the test suite.
+    One graph is built per model and every (row, model) pair is run on its provider's thread pool.
+    Args:
+        input_csv: Path to the test inputs CSV (same format as for evaluate).
+        output_csv: Path of the combined long-format table (one row per model and input,
+                    with a leading "model" column). Per-model files are written next to it.
+        model_identifiers: Models to evaluate.
+        concurrency: Default number of in-flight requests per provider.
+        provider_limits: Optional per-provider override of concurrency, e.g. {"openrouter": 4}.
+        cache_mode: LLM response cache mode ("off", "read", "write" or "readwrite").
+        cache_dir: Directory of the on-disk LLM response cache.
+        metrics_file: Optional per-invocation metrics export, labelled by model.
+        graph_mode: Agent graph variant, one of main.GRAPH_MODES.
+        trace_backend: Tracing backend, one of tracing.TRACE_BACKENDS ("off" disables tracing).
+        trace_file: JSON lines trace file for the "file" backend.
+        results_db: Optional SQLite results store; all models are stored under one run.
+        run_id: Run to store the rows under (default: a new run).
+        fallback_model: Model that answers calls still failing after retries (not used for itself).
+        tool_schema: "full" or "compact" tool schemas (prompts.TOOL_SCHEMA_MODES).
+        resolve_dates: Resolve relative dates against FIXED_EVAL_TIME before the model call (date_resolver.py).
+    """
+    provider_limits = provider_limits or {}
+    graphs = {m: build_graph(m, cache_mode=cache_mode, cache_dir=cache_dir, graph_mode=graph_mode,
+                             fallback_model=fallback_model, tool_schema=tool_schema, resolve_dates=resolve_dates)
+              for m in model_identifiers}
+    trace_handler = get_trace_handler(trace_backend, trace_file)
+    metrics_exporters = [make_exporter(metrics_file)] if metrics_file else []
+
+    # Each provider gets its own thread pool, so calls waiting on one slow or rate-limited
+    # provider never hold the worker threads of the others
+    providers = {m: get_provider(m) for m in model_identifiers}
+    limits = {p: max(1, provider_limits.get(p, concurrency)) for p in set(providers.values())}
+
+    # Parse the suite once and share it between all models
+    jobs = []
+    total_count = 0
+    for row_number, job in iter_test_cases(input_csv):
+        total_count += 1
+        if job is not None:
+            jobs.append((row_number, job))
+    counts = {m: {"PASS": 0, "FAIL": 0} for m in model_identifiers}
+    latencies = {m: [] for m in model_identifiers}
+    started = time.perf_counter()
+
+    store = ResultsStore(results_db) if results_db else None
+    if store is not None:
+        run_id = store.start_run(run_id, source=input_csv, models=model_identifiers, graph_mode=graph_mode)
+
+    def run(model_identifier: str, job: tuple) -> Dict[str, Any]:
+        result = evaluate_row(graphs[model_identifier], trace_handler, *job,
+                              model_identifier=model_identifier, metrics_exporters=metrics_exporters)
+        result['model'] = model_identifier
+        return result
+
+    os.makedirs(os.path.dirname(output_csv) or '.', exist_ok=True)
+    model_files = {m: open(model_results_path(output_csv, m), 'w', newline='', encoding='utf-8') for m in model_identifiers}
+    try:
+        with open(output_csv, 'w', newline='', encoding='utf-8') as combined_file:
+            combined_writer = csv.DictWriter(combined_file, fieldnames=['model'] + RESULT_COLUMNS, extrasaction='ignore')
+            combined_writer.writeheader()
+            model_writers = {}
+            for m, f in model_files.items():
+                model_writers[m] = csv.DictWriter(f, fieldnames=RESULT_COLUMNS, extrasaction='ignore')
+                model_writers[m].writeheader()
+
+            def record(row_number: int, result: Dict[str, Any]) -> None:
+                model_identifier = result['model']
+                counts[model_identifier][result['evaluation_result']] += 1
+                latencies[model_identifier].append(result['latency_ms'])
+                print(result, "\n\n")
+                model_writers[model_identifier].writerow(result)
+                model_files[model_identifier].flush()
+                combined_writer.writerow(result)
+                combined_file.flush()
+                if store is not None:
+                    store.add_result(run_id, model_identifier, row_number, result)
+
+            # Submit row-major so all models progress through the suite together; draining
+            # in submission order keeps every per-model file in input order
+            max_workers = sum(limits.values())
+            executors = {p: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"eval-{p}")
+                         for p, limit in limits.items()}
+            pending = deque()
+            try:
+                for row_number, job in jobs:
+                    for model_identifier in model_identifiers:
+                        executor = executors[providers[model_identifier]]
+                        pending.append((row_number, executor.submit(run, model_identifier, job)))
+                    while len(pending) >= 2 * max_workers:
+                        row, future = pending.popleft()
+                        record(row, future.result())
+                while pending:
+                    row, future = pending.popleft()
+                    record(row, future.result())
+            finally:
+                for executor in executors.values():
+                    executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        for f in model_files.values():
+            f.close()
+        if store is not None:
+            store.close()
+
+    # --- Print Summary Statistics ---
+    print("\n--- Evaluation Matrix Summary ---")
+    print(f"Total Test Cases: {total_count}")
+    for model_identifier in model_identifiers:
+        correct_count = counts[model_identifier]["PASS"]
+        accuracy = correct_count / total_count if total_count else 0.0
+        print(f"{model_identifier:<45} PASS {correct_count:>4}  FAIL {counts[model_identifier]['FAIL']:>4}  Accuracy {accuracy:.2%}")
+        print(f"  Latency: {latency_summary(latencies[model_identifier])}")
+        print(f"  Results saved to: {model_results_path(output_csv, model_identifier)}")
+    elapsed = time.perf_counter() - started
+    print(f"Throughput: {sum(len(v) for v in latencies.values()) / elapsed:.2f} rows/s over all models")
+    print(f"Combined results saved to: {output_csv}")
+    if store is not None:
+        print(f"Results stored in {results_db} as run {run_id}")
     # ---
 
+def rescored_path(input_path: str, output_dir: Optional[str] = None) -> str:
+    """Output path for a rescored results file, e.g. results_gpt4o.csv -> results_gpt4o.rescored.csv."""
+    stem, ext = os.path.splitext(os.path.basename(input_path))
+    return os.path.join(output_dir or os.path.dirname(input_path), f"{stem}.rescored{ext or '.csv'}")
+
+def rescore(input_paths: List[str], output_dir: Optional[str] = None, summary_csv: Optional[str] = None,
+            workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Re-score stored results files with the current matching rules, without calling any model.
+    Files are processed in parallel worker processes; each one is streamed in chunks.
+    Args:
+        input_paths: Results CSVs with expected_tool_name, expected_tool_args and actual_tool_calls.
+        output_dir: Directory for the rescored files (default: next to each input file).
+        summary_csv: Optional path for a per-file summary table.
+        workers: Number of worker processes (default: one per CPU, at most one per file).
+    Returns:
+        The per-file summary as a DataFrame.
+    """
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    workers = workers or min(len(input_paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(rescore_file, path, rescored_path(path, output_dir)) for path in input_paths]
+        summaries = [future.result() for future in futures]
+    summary_df = pd.DataFrame(summaries)
+
+    # --- Print Summary Statistics ---
+    print("\n--- Rescore Summary ---")
+    for s in summaries:
+        print(f"{s['file']:<40} rows {s['rows']:>6}  PASS {s['pass_before']:>5} -> {s['pass_after']:>5}  "
+              f"Accuracy {s['accuracy_before']:.2%} -> {s['accuracy_after']:.2%}  changed {s['changed']}")
+        print(f"  Results saved to: {s['output']}")
+    if summary_csv:
+        summary_df.to_csv(summary_csv, index=False)
+        print(f"Summary saved to: {summary_csv}")
+    # ---
+    return summary_df
+
 def main():
     parser = argparse.ArgumentParser(
         description='Evaluate chatbot tool usage against expected calls.'
     )
+    subparsers = parser.add_subparsers(dest='command')
+    rescore_parser = subparsers.add_parser('rescore', help='Re-score stored results CSVs with the current matching rules, without calling any model.')
+    rescore_parser.add_argument('results_csv', nargs='+', help='Results CSV files to re-score.')
+    rescore_parser.add_argument('--output_dir', type=str, default=None, help='Directory for the rescored files. Defaults to next to each input as <name>.rescored.csv.')
+    rescore_parser.add_argument('--summary_csv', type=str, default=None, help='Optional path for a per-file summary CSV.')
+    rescore_parser.add_argument('--workers', type=int, default=None, help='Number of worker processes. Defaults to the CPU count.')
     parser.add_argument('--input_csv', type=str, default='calendarthesis/test_inputs.csv', help='Path to CSV file with inputs and expected tool calls.')
     parser.add_argument('--output_csv', type=str, default='calendarthesis/evaluation_results.csv', help='Path where the evaluation results CSV will be written.')
     parser.add_argument(
         '--model',
         type=str,
         default="qwen/qwen3-32b",
-        help='LLM to use. Examples: "gpt-4o", or an OpenRouter model like "mistralai/mistral-7b-instruct", "meta-llama/llama-3.1-8b-instruct:free"'
+        help='LLM to use. Examples: "gpt-4o", or an OpenRouter model like "mistralai/mistral-7b-instruct", "meta-llama/llama-3.1-8b-instruct:free", or "mock/results_gpt4o.csv" to replay a results file offline'
     )
+    parser.add_argument('--concurrency', type=int, default=1, help='Number of test rows to run through the graph in parallel.')
+    parser.add_argument('--cache', type=str, choices=CACHE_MODES, default="off", help='On-disk LLM response cache mode. "readwrite" replays identical requests without calling the provider.')
+    parser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='Directory for the LLM response cache.')
+    parser.add_argument('--resume', action='store_true', help='Skip inputs that already have a successful result in --output_csv and append the rest.')
+    parser.add_argument('--models', type=str, default=None, help='Comma-separated list of models to evaluate in one pass (matrix mode). --output_csv then receives the combined long-format table and per-model files are written next to it.')
+    parser.add_argument('--provider_concurrency', type=str, default=None, help='Per-provider in-flight request limits for matrix mode, e.g. "openrouter=4,openai=8". Defaults to --concurrency.')
+    parser.add_argument('--fallback_model', type=str, default=None, help='Model (or comma-separated chain) that answers when a model call still fails after retries, e.g. with OpenRouter\'s 404 "No endpoints found that support tool use".')
+    parser.add_argument('--rate_limits', type=str, default=None, help='Per-provider request rate limits in requests per second[:burst], e.g. "openrouter=4,openai=10:20". Unlimited by default.')
+    parser.add_argument('--max_retries', type=int, default=3, help='Retries of a model call on 429/5xx/connection errors, with jittered exponential backoff.')
+    parser.add_argument('--metrics_file', type=str, default=None, help='Write per-invocation metrics (node timings, loop iterations, TTFT, tokens) as JSON lines, or as Prometheus text for *.prom paths.')
+    parser.add_argument('--results_db', type=str, default=None, help='Also store every row in this SQLite results database (see results_store.py), with tool calls and token usage as columns.')
+    parser.add_argument('--run_id', type=str, default=None, help='Run id for --results_db (default: a new timestamped run). Pass the same id with --resume to complete a run.')
+    parser.add_argument('--no_trace', '--no-trace', action='store_true', help='Disable tracing (same as --trace_backend off).')
+    parser.add_argument('--trace_backend', type=str, choices=TRACE_BACKENDS, default="auto", help='Where traces go: "auto" uses Langfuse when LANGFUSE_PUBLIC_KEY/LANGFUSE_SECRET_KEY are set, else --trace_file if given, else none.')
+    parser.add_argument('--trace_file', type=str, default=None, help='JSON lines trace file for the file backend (default: traces.jsonl).')
+    parser.add_argument('--graph_mode', type=str, choices=GRAPH_MODES, default="default", help='"fast" runs read-only tools concurrently and answers pure retrieval turns from a template instead of a second model call.')
+    parser.add_argument('--tool_schema', type=str, choices=TOOL_SCHEMA_MODES, default="full", help='"compact" sends trimmed tool schemas (first-sentence descriptions, no defaults) to cut prompt tokens.')
+    parser.add_argument('--resolve_dates', action='store_true', help='Resolve relative dates and times against the evaluation time locally and add the absolute ranges to each input before the model call.')
     args = parser.parse_args()
 
+    trace_backend = "off" if args.no_trace else args.trace_backend
+    configure_providers(args.rate_limits, args.max_retries)
+
+    if args.command == 'rescore':
+        rescore(args.results_csv, output_dir=args.output_dir, summary_csv=args.summary_csv, workers=args.workers)
+        return
+
+    if args.models:
+        model_identifiers = [m.strip() for m in args.models.split(",") if m.strip()]
+        evaluate_matrix(args.input_csv, args.output_csv, model_identifiers, concurrency=args.concurrency,
+                        provider_limits=parse_provider_limits(args.provider_concurrency),
+                        cache_mode=args.cache, cache_dir=args.cache_dir, metrics_file=args.metrics_file,
+                        graph_mode=args.graph_mode, trace_backend=trace_backend, trace_file=args.trace_file,
+                        results_db=args.results_db, run_id=args.run_id, fallback_model=args.fallback_model,
+                        tool_schema=args.tool_schema, resolve_dates=args.resolve_dates)
+        return
+
     # Warning for OpenRouter models if API key is missing
-    if args.model != "gpt-4o" and not os.getenv("OPENROUTER_API_KEY"):
+    if get_provider(args.model) == "openrouter" and not os.getenv("OPENROUTER_API_KEY"):
         print(f"Warning: Attempting to use OpenRouter model '{args.model}' for evaluation, but OPENROUTER_API_KEY environment variable is not set.")
         print("The evaluation will likely fail during graph initialization if the key is required and not found.")
 
-    evaluate(args.input_csv, args.output_csv, args.model)
+    evaluate(args.input_csv, args.output_csv, args.model, concurrency=args.concurrency,
+             cache_mode=args.cache, cache_dir=args.cache_dir, resume=args.resume, metrics_file=args.metrics_file,
+             graph_mode=args.graph_mode, trace_backend=trace_backend, trace_file=args.trace_file,
+             results_db=args.results_db, run_id=args.run_id, fallback_model=args.fallback_model,
+             tool_schema=args.tool_schema, resolve_dates=args.resolve_dates)
 
 if __name__ == '__main__':
     main()
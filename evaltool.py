@@ -1,38 +1,44 @@
-import pandas as pd, json
-
-df = pd.read_csv("results_mistral8b.csv")  # Changed to mistral results
-tool_name_match = []
-arg_syntax_ok   = []
-
-for _, row in df.iterrows():
-    expected = row.expected_tool_name
-    actual_calls = json.loads(row.actual_tool_calls or "[]")
-    if not actual_calls:           # model made no call
-        tool_name_match.append(False)
-        arg_syntax_ok.append(False)
-        continue
-
-    actual = actual_calls[0]       # we evaluate only the first call
-    tool_name_match.append(actual["name"] == expected)
-
-    # --- minimal "syntactically valid args" check ---
-    try:
-        ok = isinstance(actual["args"], dict)          # JSON object
-        ok &= all(k in actual["args"] for k in
-                  json.loads(row.expected_tool_args).keys())  # required keys present
-    except Exception:
-        ok = False
-    arg_syntax_ok.append(ok)
-
-df["tool_name_ok"] = tool_name_match
-df["arg_syntax_ok"] = arg_syntax_ok
-
-# Convert 'evaluation_result' to numeric (1 for PASS, 0 for FAIL)
-df["evaluation_result_numeric"] = df["evaluation_result"].apply(lambda x: 1 if x == "PASS" else 0)
-
-summary = df.agg({
-    "tool_name_ok":  "mean",
-    "arg_syntax_ok": "mean",
-    "evaluation_result_numeric": "mean" # Use the new numeric column
-}) * 100
-print(summary)
+import argparse
+
+import pandas as pd
+from results_store import DEFAULT_RESULTS_DB, ResultsStore, model_from_path
+from scoring import score_results
+
+
+def summarize(df: pd.DataFrame) -> pd.Series:
+    # tool_name_ok:  the first tool call used the expected tool (we evaluate only the first call)
+    # arg_syntax_ok: minimal "syntactically valid args" check - the first call's args are a
+    #                JSON object that contains every expected key
+    scored = score_results(df)
+    summary = pd.Series({
+        "tool_name_ok": scored["first_call_name_match"].mean(),
+        "arg_syntax_ok": scored["first_call_args_complete"].mean(),
+        # 1 for PASS, 0 for FAIL, as recorded by the evaluation run
+        "evaluation_result_numeric": (df["evaluation_result"] == "PASS").mean(),
+    }) * 100
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="First-call tool name / argument checks and accuracy per results file or stored model.")
+    parser.add_argument('results_csv', nargs='*', default=["results_mistral8b.csv"], help='Results CSV files (default: results_mistral8b.csv).')
+    parser.add_argument('--results_db', type=str, default=None, help=f'Read from this results store (e.g. {DEFAULT_RESULTS_DB}) instead of CSV files.')
+    parser.add_argument('--run_id', action='append', default=None, help='With --results_db: restrict to these runs (repeatable).')
+    parser.add_argument('--model', action='append', default=None, help='With --results_db: restrict to these models (repeatable).')
+    args = parser.parse_args()
+
+    if args.results_db:
+        store = ResultsStore(args.results_db)
+        try:
+            df = store.results(run_ids=args.run_id, models=args.model)
+        finally:
+            store.close()
+        groups = df.groupby(["run_id", "model"], sort=False)
+        table = pd.DataFrame({f"{run_id}/{model}": summarize(group) for (run_id, model), group in groups}).T
+    else:
+        table = pd.DataFrame({model_from_path(path): summarize(pd.read_csv(path)) for path in args.results_csv}).T
+    print(table.round(2).to_string())
+
+
+if __name__ == "__main__":
+    main()
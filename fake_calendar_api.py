@@ -0,0 +1,272 @@
+import argparse
+import json
+import re
+import threading
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from calendar_store import DEFAULT_TIMEZONE, EventStore, StoredEvent, instance_id, parse_datetime
+from google_calendar import parse_google_time
+
+API_PREFIX = "/calendar/v3"
+BATCH_PATH = "/batch/calendar/v3"
+BOUNDARY = "batch_fake_calendar_api"
+
+
+class FakeCalendarAPI:
+    """
+    Minimal stand-in for the Google Calendar v3 REST API, backed by an EventStore.
+    Supports events list/get/insert/delete, freeBusy and multipart batch requests, and counts
+    HTTP requests and API calls so callers can check how well their requests are batched.
+
+    Writes made through the API are kept in a change log, so events.list also supports full
+    syncs (no timeMin/timeMax, singleEvents unset) and incremental syncs with syncToken.
+    """
+
+    def __init__(self, store: Optional[EventStore] = None):
+        self.store = store or EventStore()
+        self.http_requests = 0
+        self.api_calls = 0
+        self._lock = threading.Lock()
+        # (sequence number, calendar_id, event resource); a syncToken is the last sequence number seen
+        self._changes: List[Tuple[int, str, Dict[str, Any]]] = []
+        self._seq = 0
+        # Tokens below this were expired by expire_sync_tokens()
+        self._expired_before = 0
+
+    def _record(self, calendar_id: str, item: Dict[str, Any]) -> None:
+        item["updated"] = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        with self._lock:
+            self._seq += 1
+            self._changes.append((self._seq, calendar_id, item))
+
+    def expire_sync_tokens(self) -> None:
+        """Make every outstanding syncToken invalid, as Google does from time to time."""
+        with self._lock:
+            self._changes.clear()
+            # A new sequence number, so the next full sync hands out a token that is still valid
+            self._seq += 1
+            self._expired_before = self._seq
+
+    def stats(self) -> Dict[str, int]:
+        return {"http_requests": self.http_requests, "api_calls": self.api_calls}
+
+    def handle(self, method: str, target: str, body: bytes) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Dispatch one API call and return (status, JSON payload)."""
+        with self._lock:
+            self.api_calls += 1
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path[len(API_PREFIX):].strip("/").split("/")] if url.path.startswith(API_PREFIX) else []
+        try:
+            data = json.loads(body) if body else {}
+            if parts == ["freeBusy"] and method == "POST":
+                return self._free_busy(data)
+            if len(parts) == 3 and parts[0] == "calendars" and parts[2] == "events":
+                if method == "GET":
+                    return self._list(parts[1], query)
+                if method == "POST":
+                    return self._insert(parts[1], data)
+            if len(parts) == 4 and parts[0] == "calendars" and parts[2] == "events":
+                if method == "GET":
+                    return self._get(parts[1], parts[3])
+                if method == "DELETE":
+                    return self._delete(parts[1], parts[3])
+        except (ValueError, KeyError) as e:
+            return 400, _error(400, f"Bad request: {e}")
+        return 404, _error(404, f"Unknown endpoint {method} {url.path}")
+
+    def _list(self, calendar_id: str, query: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+        if "syncToken" in query:
+            return self._list_changes(calendar_id, int(query["syncToken"]))
+        if query.get("singleEvents") != "true" and "timeMin" not in query and "timeMax" not in query:
+            return self._list_all(calendar_id)
+        time_zone = query.get("timeZone", DEFAULT_TIMEZONE)
+        start = parse_datetime(query.get("timeMin", "1970-01-01T00:00:00+00:00"), time_zone)
+        end = parse_datetime(query.get("timeMax", "9999-01-01T00:00:00+00:00"), time_zone)
+        max_results = int(query["maxResults"]) if "maxResults" in query else None
+        events = self.store.list_events(start, end, calendar_id=calendar_id, summary=query.get("q"),
+                                        max_results=max_results)
+        return 200, {"kind": "calendar#events", "timeZone": time_zone, "items": [e.to_dict() for e in events]}
+
+    def _list_all(self, calendar_id: str) -> Tuple[int, Dict[str, Any]]:
+        items = []
+        for event in self.store.events(calendar_id):
+            items.append(event.to_dict())
+            # Cancelled occurrences of a series are reported as cancelled instance stubs
+            items.extend(_cancelled(event, start_ts) for start_ts in sorted(event.exdates))
+        with self._lock:
+            seq = self._seq
+        return 200, {"kind": "calendar#events", "items": items, "nextSyncToken": str(seq)}
+
+    def _list_changes(self, calendar_id: str, token: int) -> Tuple[int, Dict[str, Any]]:
+        with self._lock:
+            if token > self._seq or token < self._expired_before:
+                return 410, _error(410, "Sync token is no longer valid, a full sync is required.")
+            latest: Dict[str, Dict[str, Any]] = {}
+            for seq, change_calendar, item in self._changes:
+                if seq > token and change_calendar == calendar_id:
+                    latest.pop(item["id"], None)
+                    latest[item["id"]] = item
+            seq = self._seq
+        return 200, {"kind": "calendar#events", "items": list(latest.values()), "nextSyncToken": str(seq)}
+
+    def _insert(self, calendar_id: str, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        time_zone = data["start"].get("timeZone") or DEFAULT_TIMEZONE
+        event = self.store.create_event(
+            data.get("summary", ""),
+            parse_google_time(data["start"], time_zone),
+            parse_google_time(data["end"], time_zone),
+            timezone=time_zone,
+            calendar_id=calendar_id,
+            event_id=data.get("id"),
+            recurrence=(data.get("recurrence") or [None])[0],
+        )
+        item = event.to_dict()
+        self._record(calendar_id, item)
+        return 200, item
+
+    def _get(self, calendar_id: str, event_id: str) -> Tuple[int, Dict[str, Any]]:
+        event = self.store.get_event(event_id, calendar_id)
+        if event is None:
+            return 404, _error(404, "Not Found")
+        return 200, event.to_dict()
+
+    def _delete(self, calendar_id: str, event_id: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+        event = self.store.delete_event(event_id, calendar_id)
+        if event is None:
+            return 404, _error(404, "Not Found")
+        if event.recurring_event_id:
+            self._record(calendar_id, _cancelled(self.store.get_event(event.recurring_event_id, calendar_id) or event,
+                                                 event.start_ts))
+        else:
+            self._record(calendar_id, {"id": event.id, "status": "cancelled"})
+        return 204, None
+
+    def _free_busy(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        start = parse_datetime(data["timeMin"])
+        end = parse_datetime(data["timeMax"])
+        calendars = {}
+        for item in data.get("items", []):
+            events = self.store.list_events(start, end, calendar_id=item["id"])
+            calendars[item["id"]] = {"busy": [{"start": e.start.isoformat(), "end": e.end.isoformat()} for e in events]}
+        return 200, {"kind": "calendar#freeBusy", "timeMin": data["timeMin"], "timeMax": data["timeMax"],
+                     "calendars": calendars}
+
+    def handle_batch(self, content_type: str, body: bytes) -> bytes:
+        """Answer a multipart/mixed batch request with a multipart/mixed batch response."""
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        parts: List[str] = []
+        for part in message.iter_parts():
+            method, target, inner_body = _parse_http_request(part.get_payload(decode=True))
+            status, payload = self.handle(method, target, inner_body)
+            content = json.dumps(payload) if payload is not None else ""
+            content_id = part.get("Content-ID", "").strip("<>")
+            parts.append(
+                f"--{BOUNDARY}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\nContent-Length: {len(content)}\r\n\r\n{content}\r\n"
+            )
+        return ("".join(parts) + f"--{BOUNDARY}--\r\n").encode("utf-8")
+
+
+def _parse_http_request(message: bytes) -> Tuple[str, str, bytes]:
+    """(method, target, body) of a batch part; googleapiclient writes these with "\n" line endings, others with "\r\n"."""
+    head, *body = re.split(rb"\r?\n\r?\n", message, maxsplit=1)
+    request_line = re.split(rb"\r?\n", head, maxsplit=1)[0]
+    method, target, _ = request_line.decode().split(" ", 2)
+    return method, target, body[0] if body else b""
+
+
+def _cancelled(series: StoredEvent, start_ts: float) -> Dict[str, Any]:
+    series_id = series.recurring_event_id or series.id
+    start = datetime.fromtimestamp(start_ts, timezone.utc)
+    return {
+        "id": instance_id(series_id, start),
+        "status": "cancelled",
+        "recurringEventId": series_id,
+        "originalStartTime": {"dateTime": start.isoformat(), "timeZone": series.timezone},
+    }
+
+
+def _error(code: int, message: str) -> Dict[str, Any]:
+    return {"error": {"code": code, "message": message, "errors": [{"reason": message}]}}
+
+
+class FakeCalendarRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json; charset=UTF-8") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method: str) -> None:
+        api: FakeCalendarAPI = self.server.api
+        with api._lock:
+            api.http_requests += 1
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/_stats":
+            self._send(200, json.dumps(api.stats()).encode())
+        elif self.path == BATCH_PATH and method == "POST":
+            response = api.handle_batch(self.headers.get("Content-Type", ""), body)
+            self._send(200, response, f"multipart/mixed; boundary={BOUNDARY}")
+        else:
+            status, payload = api.handle(method, self.path, body)
+            self._send(status, json.dumps(payload).encode() if payload is not None else b"")
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def do_DELETE(self) -> None:
+        self._dispatch("DELETE")
+
+
+class FakeCalendarServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Any, api: Optional[FakeCalendarAPI] = None):
+        self.api = api or FakeCalendarAPI()
+        super().__init__(address, FakeCalendarRequestHandler)
+
+    @property
+    def root_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "FakeCalendarServer":
+        """Serve on a daemon thread, e.g. from a test or benchmark."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local fake of the Google Calendar v3 API.")
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='Host to bind to.')
+    parser.add_argument('--port', type=int, default=8085, help='Port to bind to.')
+    args = parser.parse_args()
+
+    server = FakeCalendarServer((args.host, args.port))
+    print(f"Fake Calendar API on {server.root_url} (use --calendar_root_url {server.root_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httplib2
+import pytz
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+from calendar_store import DEFAULT_TIMEZONE, StoredEvent, free_slots_in_working_hours
+
+# Same scope as quickstart.py; changing it invalidates token.json
+SCOPES = ["https://www.googleapis.com/auth/calendar"]
+# Refresh access tokens this many seconds before they expire
+DEFAULT_REFRESH_MARGIN = 300.0
+# Google accepts at most 50 calls per Calendar batch request
+MAX_BATCH_SIZE = 50
+# How long the dispatcher waits for more calls after the first one arrives
+DEFAULT_BATCH_WINDOW_MS = 5.0
+# Fields copied from Google events into StoredEvent.extra
+EXTRA_FIELDS = ("htmlLink", "status", "location", "description", "updated")
+
+
+class CalendarAPIError(ValueError):
+    """A Calendar API call failed; a ValueError so the tools report it like any other bad input."""
+
+
+class SyncTokenExpired(CalendarAPIError):
+    """The server no longer accepts a syncToken (HTTP 410); the caller must do a full sync."""
+
+
+class CredentialManager:
+    """
+    Process-wide OAuth credentials for the Calendar API, loaded once from token_file.
+
+    Tokens are refreshed proactively: a background timer refreshes refresh_margin seconds before
+    expiry, and get() refreshes synchronously if that has not happened yet. Refreshes are
+    serialised by a lock, so concurrent tool calls never refresh the same token twice.
+    """
+
+    def __init__(self, token_file: str = "token.json", client_secrets_file: str = "credentials.json",
+                 refresh_margin: float = DEFAULT_REFRESH_MARGIN):
+        self.token_file = token_file
+        self.client_secrets_file = client_secrets_file
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._creds: Optional[Credentials] = None
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def get(self) -> Credentials:
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load()
+                self._schedule()
+            elif self._needs_refresh():
+                self._refresh()
+            return self._creds
+
+    def _load(self) -> Credentials:
+        # Same flow as quickstart.py
+        creds = None
+        if os.path.exists(self.token_file):
+            creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+        if creds and creds.refresh_token and (not creds.valid or self._expires_soon(creds)):
+            creds.refresh(Request())
+            self._save(creds)
+        elif not creds or not creds.valid:
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            flow = InstalledAppFlow.from_client_secrets_file(self.client_secrets_file, SCOPES)
+            creds = flow.run_local_server(port=0)
+            self._save(creds)
+        return creds
+
+    def _save(self, creds: Credentials) -> None:
+        with open(self.token_file, "w") as token:
+            token.write(creds.to_json())
+
+    def _expires_soon(self, creds: Credentials) -> bool:
+        return creds.expiry is not None and creds.expiry - _utcnow() < self.refresh_margin
+
+    def _needs_refresh(self) -> bool:
+        return self._creds.refresh_token is not None and (not self._creds.valid or self._expires_soon(self._creds))
+
+    def _refresh(self) -> None:
+        self._creds.refresh(Request())
+        self._save(self._creds)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._creds.expiry is None or self._creds.refresh_token is None:
+            return
+        delay = (self._creds.expiry - _utcnow() - self.refresh_margin).total_seconds()
+        self._timer = threading.Timer(max(delay, 0.0), self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_in_background(self) -> None:
+        try:
+            with self._lock:
+                if self._needs_refresh():
+                    self._refresh()
+        except Exception as e:
+            # get() retries synchronously on the next call
+            print(f"Warning: background refresh of Google credentials failed: {e}")
+
+
+def _utcnow() -> datetime:
+    # google-auth keeps expiry as a naive UTC datetime
+    return datetime.now(dt_timezone.utc).replace(tzinfo=None)
+
+
+_credential_manager: Optional[CredentialManager] = None
+_backends: Dict[Optional[str], "GoogleCalendarBackend"] = {}
+_client_lock = threading.RLock()
+
+
+def get_credential_manager() -> CredentialManager:
+    """The process-wide credential manager, created on first use."""
+    global _credential_manager
+    with _client_lock:
+        if _credential_manager is None:
+            _credential_manager = CredentialManager()
+        return _credential_manager
+
+
+@lru_cache(maxsize=1)
+def _discovery_document() -> Dict[str, Any]:
+    # The Calendar v3 discovery document ships with google-api-python-client; parse it once
+    return json.loads(get_static_doc("calendar", "v3"))
+
+
+def build_service(credentials: Optional[Credentials] = None, root_url: Optional[str] = None) -> Any:
+    """
+    Build the Calendar v3 service from the bundled discovery document, without network access.
+    With root_url (e.g. "http://127.0.0.1:8085/") requests go to a fake or proxy server instead
+    of Google, unauthenticated.
+    """
+    if root_url:
+        return build_from_document(_discovery_document(), http=httplib2.Http(),
+                                   client_options={"api_endpoint": root_url.rstrip("/") + "/calendar/v3/"})
+    return build_from_document(_discovery_document(), credentials=credentials or get_credential_manager().get())
+
+
+def parse_google_time(value: Dict[str, str], timezone: str) -> datetime:
+    """Parse a Calendar API {"dateTime"|"date", "timeZone"} value into an aware datetime."""
+    tz = pytz.timezone(value.get("timeZone") or timezone)
+    if "dateTime" in value:
+        dt = datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+        return dt if dt.tzinfo is not None else tz.localize(dt)
+    # All-day events only carry a date
+    return tz.localize(datetime.combine(datetime.fromisoformat(value["date"]).date(), dt_time()))
+
+
+def event_from_google(item: Dict[str, Any], calendar_id: str = "primary",
+                      timezone: str = DEFAULT_TIMEZONE) -> StoredEvent:
+    """Convert a Calendar API event resource into a StoredEvent."""
+    event_tz = item.get("start", {}).get("timeZone") or timezone
+    return StoredEvent(
+        id=item["id"],
+        summary=item.get("summary", ""),
+        start=parse_google_time(item["start"], event_tz),
+        end=parse_google_time(item["end"], event_tz),
+        timezone=event_tz,
+        calendar_id=calendar_id,
+        extra={k: item[k] for k in EXTRA_FIELDS if k in item},
+        recurrence=(item.get("recurrence") or [None])[0],
+        recurring_event_id=item.get("recurringEventId"),
+    )
+
+
+class BatchDispatcher:
+    """
+    Coalesces API calls submitted from many threads into BatchHttpRequests.
+
+    The first call to arrive opens a short window (batch_window_ms); every call submitted before
+    it closes, up to MAX_BATCH_SIZE, goes out in the same HTTP round trip. A lone call is sent
+    as a plain request. All HTTP happens on the dispatcher thread, so the (not thread-safe)
+    httplib2 connection behind the service object is never shared across threads.
+    """
+
+    def __init__(self, new_batch: Callable[..., BatchHttpRequest], batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS,
+                 max_batch_size: int = MAX_BATCH_SIZE):
+        self.new_batch = new_batch
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        # Round trips and calls sent so far; calls / round_trips is the achieved batching factor
+        self.round_trips = 0
+        self.calls = 0
+        self._queue: "queue.Queue[Optional[Tuple[Any, Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="calendar-batch-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, request: Any) -> Future:
+        """Queue an HttpRequest; the returned future resolves to its deserialized response."""
+        future: Future = Future()
+        self._queue.put((request, future))
+        return future
+
+    def execute(self, request: Any) -> Any:
+        return self.submit(request).result()
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first: Tuple[Any, Future]) -> Tuple[List[Tuple[Any, Future]], bool]:
+        pending = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(pending) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return pending, True
+            pending.append(item)
+        return pending, False
+
+    def _run(self) -> None:
+        closing = False
+        while not closing:
+            first = self._queue.get()
+            if first is None:
+                break
+            pending, closing = self._collect(first)
+            self._send(pending)
+
+    def _send(self, pending: List[Tuple[Any, Future]]) -> None:
+        self.round_trips += 1
+        self.calls += len(pending)
+        if len(pending) == 1:
+            request, future = pending[0]
+            try:
+                future.set_result(request.execute())
+            except Exception as e:
+                future.set_exception(e)
+            return
+
+        futures = {str(i): future for i, (_, future) in enumerate(pending)}
+
+        def on_response(request_id: str, response: Any, exception: Optional[Exception]) -> None:
+            if exception is not None:
+                futures[request_id].set_exception(exception)
+            else:
+                futures[request_id].set_result(response)
+
+        batch = self.new_batch(callback=on_response)
+        for i, (request, _) in enumerate(pending):
+            batch.add(request, request_id=str(i))
+        try:
+            batch.execute()
+        except Exception as e:
+            # Transport-level failure: nothing in the batch got a response
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+
+
+class GoogleCalendarBackend:
+    """
+    Google Calendar backend for calendar_tools with the same interface as EventStore, so it can
+    be installed with calendar_tools.set_event_store(). One service object is shared by all
+    calls, and concurrent tool calls (ToolNode runs them in parallel) are batched together.
+    """
+
+    def __init__(self, service: Any, batch_uri: Optional[str] = None,
+                 batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS, timezone: str = DEFAULT_TIMEZONE):
+        self.service = service
+        self.timezone = timezone
+        if batch_uri:
+            new_batch = lambda callback=None: BatchHttpRequest(callback=callback, batch_uri=batch_uri)
+        else:
+            new_batch = service.new_batch_http_request
+        self.dispatcher = BatchDispatcher(new_batch, batch_window_ms=batch_window_ms)
+
+    @classmethod
+    def connect(cls, root_url: Optional[str] = None, **kwargs: Any) -> "GoogleCalendarBackend":
+        """
+        The process-wide backend for Google (default) or for a fake/proxy API at root_url. It is
+        created once, so every caller shares one service object, one set of credentials and one
+        dispatcher (the service's httplib2 connection is only ever used from that thread).
+        """
+        with _client_lock:
+            backend = _backends.get(root_url)
+            if backend is None:
+                # The batch endpoint comes from the discovery document's rootUrl, so point it at root_url too
+                batch_uri = root_url.rstrip("/") + "/batch/calendar/v3" if root_url else None
+                backend = _backends[root_url] = cls(build_service(root_url=root_url), batch_uri=batch_uri, **kwargs)
+        return backend
+
+    def close(self) -> None:
+        self.dispatcher.close()
+
+    def _execute(self, request: Any, action: str) -> Any:
+        try:
+            return self.dispatcher.execute(request)
+        except HttpError as e:
+            raise CalendarAPIError(f"Google Calendar API error while {action}: {e.status_code} {e.reason}") from e
+
+    def create_event(self, summary: str, start: datetime, end: datetime, timezone: str = DEFAULT_TIMEZONE,
+                     calendar_id: str = "primary", event_id: Optional[str] = None,
+                     recurrence: Optional[str] = None, **extra: Any) -> StoredEvent:
+        if end < start:
+            raise ValueError(f"Event end {end.isoformat()} is before its start {start.isoformat()}.")
+        body: Dict[str, Any] = {
+            "summary": summary,
+            "start": {"dateTime": start.isoformat(), "timeZone": timezone},
+            "end": {"dateTime": end.isoformat(), "timeZone": timezone},
+            **extra,
+        }
+        if event_id:
+            body["id"] = event_id
+        if recurrence:
+            body["recurrence"] = [recurrence]
+        item = self._execute(self.service.events().insert(calendarId=calendar_id, body=body), "creating an event")
+        return event_from_google(item, calendar_id, timezone)
+
+    def get_event(self, event_id: str, calendar_id: Optional[str] = None) -> Optional[StoredEvent]:
+        calendar_id = calendar_id or "primary"
+        try:
+            item = self.dispatcher.execute(self.service.events().get(calendarId=calendar_id, eventId=event_id))
+        except HttpError as e:
+            if e.status_code in (404, 410):
+                return None
+            raise CalendarAPIError(f"Google Calendar API error while getting an event: {e.status_code} {e.reason}") from e
+        if item.get("status") == "cancelled":
+            return None
+        return event_from_google(item, calendar_id, self.timezone)
+
+    def delete_event(self, event_id: str, calendar_id: Optional[str] = None) -> Optional[StoredEvent]:
+        # Fetch first so callers get the deleted event back, as with EventStore
+        event = self.get_event(event_id, calendar_id)
+        if event is None:
+            return None
+        try:
+            self.dispatcher.execute(self.service.events().delete(calendarId=event.calendar_id, eventId=event_id))
+        except HttpError as e:
+            if e.status_code in (404, 410):
+                return None
+            raise CalendarAPIError(f"Google Calendar API error while deleting an event: {e.status_code} {e.reason}") from e
+        return event
+
+    def list_events(self, start: datetime, end: datetime, calendar_id: str = "primary",
+                    summary: Optional[str] = None, max_results: Optional[int] = None) -> List[StoredEvent]:
+        """Events overlapping [start, end) in start order; recurring events are expanded by Google."""
+        params: Dict[str, Any] = {
+            "calendarId": calendar_id,
+            "timeMin": start.isoformat(),
+            "timeMax": end.isoformat(),
+            "singleEvents": True,
+            "orderBy": "startTime",
+        }
+        if summary:
+            params["q"] = summary
+        if max_results is not None:
+            params["maxResults"] = max_results
+        result = self._execute(self.service.events().list(**params), "listing events")
+        return [event_from_google(item, calendar_id, result.get("timeZone") or self.timezone)
+                for item in result.get("items", [])]
+
+    def list_changes(self, calendar_id: str = "primary", sync_token: Optional[str] = None,
+                     page_token: Optional[str] = None) -> Dict[str, Any]:
+        """
+        One page of a full (sync_token=None) or incremental listing of raw event resources.
+        Recurring series come back unexpanded, and cancelled events and occurrences are included.
+        The last page carries nextSyncToken for the next incremental call.
+        """
+        params: Dict[str, Any] = {"calendarId": calendar_id, "showDeleted": True, "singleEvents": False}
+        if sync_token:
+            params["syncToken"] = sync_token
+        if page_token:
+            params["pageToken"] = page_token
+        try:
+            return self.dispatcher.execute(self.service.events().list(**params))
+        except HttpError as e:
+            if e.status_code == 410:
+                raise SyncTokenExpired(f"Sync token for calendar '{calendar_id}' expired") from e
+            raise CalendarAPIError(f"Google Calendar API error while syncing events: {e.status_code} {e.reason}") from e
+
+    def find_free_slots(self, start: datetime, end: datetime, duration: timedelta,
+                        calendar_ids: Optional[List[str]] = None, work_start: dt_time = dt_time(9, 0),
+                        work_end: dt_time = dt_time(17, 0), timezone: str = DEFAULT_TIMEZONE,
+                        include_weekends: bool = False) -> List[Tuple[datetime, datetime]]:
+        """Same as EventStore.find_free_slots, with busy times from one freeBusy query for all calendars."""
+        body = {
+            "timeMin": start.isoformat(),
+            "timeMax": end.isoformat(),
+            "items": [{"id": calendar_id} for calendar_id in calendar_ids or ["primary"]],
+        }
+        result = self._execute(self.service.freebusy().query(body=body), "querying free/busy")
+        busy = [
+            (datetime.fromisoformat(b["start"].replace("Z", "+00:00")).timestamp(),
+             datetime.fromisoformat(b["end"].replace("Z", "+00:00")).timestamp())
+            for calendar in result.get("calendars", {}).values()
+            for b in calendar.get("busy", [])
+        ]
+        return free_slots_in_working_hours(busy, start, end, duration, work_start, work_end, timezone, include_weekends)
@@ -0,0 +1,344 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from providers import FALLBACK_EVENT, RATE_LIMIT_EVENT, RETRY_EVENT
+
+# Graph nodes whose wall time is recorded separately
+NODES = ("chatbot", "tools")
+# Histogram buckets (seconds) for latency metrics, and for agent loop iterations
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ITERATION_BUCKETS = (1, 2, 3, 4, 6, 8, 12)
+
+
+@dataclass
+class InvocationMetrics:
+    """Where the time and tokens of one graph invocation went."""
+    model: str
+    started_at: float
+    total_ms: float = 0.0
+    chatbot_ms: float = 0.0
+    tools_ms: float = 0.0
+    # Number of times the chatbot node ran (agent loop iterations)
+    iterations: int = 0
+    tool_calls: int = 0
+    llm_calls: int = 0
+    # Time from invocation start to the first model token; without streaming the first
+    # token only becomes visible with the first complete model response
+    ttft_ms: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Prompt tokens the provider served from its prompt cache (part of prompt_tokens)
+    cached_prompt_tokens: int = 0
+    # Provider layer (providers.py): retried model calls, time spent waiting for the rate
+    # limiter, and the model that answered instead when the requested one failed
+    retries: int = 0
+    rate_limit_wait_ms: float = 0.0
+    fallback_model: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def token_usage(self) -> Optional[Dict[str, int]]:
+        if not self.llm_calls:
+            return None
+        return {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "total_tokens": self.total_tokens, "cached_prompt_tokens": self.cached_prompt_tokens}
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["total_tokens"] = self.total_tokens
+        return data
+
+
+def usage_from_result(response: Any) -> Tuple[int, int]:
+    """(prompt, completion) tokens of an LLMResult, from usage_metadata or the provider's token_usage."""
+    for generations in response.generations or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0) or 0, usage.get("completion_tokens", 0) or 0
+
+
+def cached_tokens_from_result(response: Any) -> int:
+    """Prompt tokens of an LLMResult that were read from the provider's prompt cache."""
+    for generations in response.generations or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    details = ((response.llm_output or {}).get("token_usage") or {}).get("prompt_tokens_details") or {}
+    return details.get("cached_tokens", 0) or 0
+
+
+@dataclass
+class _Invocation:
+    metrics: InvocationMetrics
+    start: float
+    runs: Set[UUID] = field(default_factory=set)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler that turns the callbacks of a LangGraph run into one
+    InvocationMetrics per top-level invocation and hands it to each exporter.
+    Safe to share between concurrent invocations: runs are attributed to their root run.
+    """
+
+    def __init__(self, model_identifier: str, exporters: Sequence[Any] = ()):
+        self.model_identifier = model_identifier
+        self.exporters = list(exporters)
+        # Metrics of the most recently finished invocation
+        self.last: Optional[InvocationMetrics] = None
+        self._invocations: Dict[UUID, _Invocation] = {}
+        self._root_of: Dict[UUID, UUID] = {}
+        # run_id -> (root run id, node name, start time)
+        self._nodes: Dict[UUID, Tuple[UUID, str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _track(self, run_id: UUID, parent_run_id: Optional[UUID]) -> Optional[_Invocation]:
+        root = self._root_of.get(parent_run_id) if parent_run_id is not None else None
+        if root is None:
+            return None
+        self._root_of[run_id] = root
+        invocation = self._invocations[root]
+        invocation.runs.add(run_id)
+        return invocation
+
+    def _invocation(self, run_id: UUID) -> Optional[_Invocation]:
+        root = self._root_of.get(run_id)
+        return self._invocations.get(root) if root is not None else None
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None,
+                       **kwargs: Any) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            if parent_run_id is None:
+                self._invocations[run_id] = _Invocation(InvocationMetrics(self.model_identifier, time.time()), now)
+                self._root_of[run_id] = run_id
+                return
+            invocation = self._track(run_id, parent_run_id)
+            if invocation is None:
+                return
+            # Node runs carry their own name in langgraph_node; runnables inside a node share it
+            node = (metadata or {}).get("langgraph_node")
+            if node in NODES and kwargs.get("name") == node:
+                self._nodes[run_id] = (self._root_of[run_id], node, now)
+                if node == "chatbot":
+                    invocation.metrics.iterations += 1
+
+    def _finish_node(self, run_id: UUID, now: float) -> None:
+        node = self._nodes.pop(run_id, None)
+        if node is None:
+            return
+        root, name, start = node
+        invocation = self._invocations.get(root)
+        if invocation is not None:
+            elapsed = (now - start) * 1000
+            if name == "chatbot":
+                invocation.metrics.chatbot_ms += elapsed
+            else:
+                invocation.metrics.tools_ms += elapsed
+
+    def _finish_root(self, run_id: UUID, now: float, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            invocation = self._invocations.pop(run_id, None)
+            if invocation is None:
+                return
+            for child in invocation.runs:
+                self._root_of.pop(child, None)
+                self._nodes.pop(child, None)
+            self._root_of.pop(run_id, None)
+            metrics = invocation.metrics
+            metrics.total_ms = (now - invocation.start) * 1000
+            if error is not None:
+                metrics.error = str(error)
+            self.last = metrics
+        for exporter in self.exporters:
+            exporter.export(metrics)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        if parent_run_id is None:
+            self._finish_root(run_id, now)
+            return
+        with self._lock:
+            self._finish_node(run_id, now)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       **kwargs: Any) -> None:
+        now = time.perf_counter()
+        if parent_run_id is None:
+            self._finish_root(run_id, now, error)
+            return
+        with self._lock:
+            self._finish_node(run_id, now)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        with self._lock:
+            invocation = self._track(run_id, parent_run_id)
+            if invocation is not None:
+                invocation.metrics.llm_calls += 1
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            invocation = self._invocation(run_id)
+            if invocation is not None and invocation.metrics.ttft_ms is None:
+                invocation.metrics.ttft_ms = (now - invocation.start) * 1000
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        prompt_tokens, completion_tokens = usage_from_result(response)
+        cached_tokens = cached_tokens_from_result(response)
+        with self._lock:
+            invocation = self._invocation(run_id)
+            if invocation is None:
+                return
+            metrics = invocation.metrics
+            metrics.prompt_tokens += prompt_tokens
+            metrics.completion_tokens += completion_tokens
+            metrics.cached_prompt_tokens += cached_tokens
+            if metrics.ttft_ms is None:
+                metrics.ttft_ms = (now - invocation.start) * 1000
+
+    def on_custom_event(self, name: str, data: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if name not in (RETRY_EVENT, RATE_LIMIT_EVENT, FALLBACK_EVENT):
+            return
+        with self._lock:
+            invocation = self._invocation(run_id)
+            if invocation is None:
+                return
+            metrics = invocation.metrics
+            if name == RETRY_EVENT:
+                metrics.retries += 1
+            elif name == RATE_LIMIT_EVENT:
+                metrics.rate_limit_wait_ms += data["wait_ms"]
+            else:
+                metrics.fallback_model = data["fallback_model"]
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        with self._lock:
+            invocation = self._track(run_id, parent_run_id)
+            if invocation is not None:
+                invocation.metrics.tool_calls += 1
+
+
+class JsonlMetricsExporter:
+    """Appends one JSON object per invocation to a local metrics file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, metrics: InvocationMetrics) -> None:
+        line = json.dumps(metrics.to_dict())
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class PrometheusExporter:
+    """
+    Aggregates invocation metrics per model into Prometheus counters and histograms.
+    render() returns the text exposition format; with a path, the file is rewritten
+    atomically after every invocation (for node_exporter's textfile collector).
+    """
+
+    def __init__(self, path: Optional[str] = None, prefix: str = "calendar_agent"):
+        self.path = path
+        self.prefix = prefix
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], _Histogram] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _observe(self, name: str, labels: Dict[str, str], value: float, buckets: Sequence[float]) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+    def export(self, metrics: InvocationMetrics) -> None:
+        model = {"model": metrics.model}
+        with self._lock:
+            self._counters[("invocations_total", tuple(model.items()))] += 1
+            if metrics.error:
+                self._counters[("invocation_errors_total", tuple(model.items()))] += 1
+            self._counters[("tool_calls_total", tuple(model.items()))] += metrics.tool_calls
+            self._counters[("llm_retries_total", tuple(model.items()))] += metrics.retries
+            self._counters[("rate_limit_wait_seconds_total", tuple(model.items()))] += metrics.rate_limit_wait_ms / 1000
+            if metrics.fallback_model:
+                self._counters[("fallbacks_total", tuple(sorted({**model, "fallback": metrics.fallback_model}.items())))] += 1
+            for kind, tokens in (("prompt", metrics.prompt_tokens), ("completion", metrics.completion_tokens),
+                                 ("cached_prompt", metrics.cached_prompt_tokens)):
+                self._counters[("tokens_total", tuple(sorted({**model, "kind": kind}.items())))] += tokens
+            self._observe("invocation_seconds", model, metrics.total_ms / 1000, LATENCY_BUCKETS)
+            self._observe("node_seconds", {**model, "node": "chatbot"}, metrics.chatbot_ms / 1000, LATENCY_BUCKETS)
+            self._observe("node_seconds", {**model, "node": "tools"}, metrics.tools_ms / 1000, LATENCY_BUCKETS)
+            self._observe("loop_iterations", model, metrics.iterations, ITERATION_BUCKETS)
+            if metrics.ttft_ms is not None:
+                self._observe("ttft_seconds", model, metrics.ttft_ms / 1000, LATENCY_BUCKETS)
+        if self.path:
+            with self._write_lock:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(self.render())
+                os.replace(tmp_path, self.path)
+
+    def render(self) -> str:
+        def fmt(labels: Sequence[Tuple[str, str]]) -> str:
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted({n for n, _ in self._counters}):
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{self.prefix}_{name}{fmt(labels)} {value:g}")
+            for name in sorted({n for n, _ in self._histograms}):
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+                for (n, labels), histogram in sorted(self._histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{self.prefix}_{name}_bucket{fmt(labels + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{self.prefix}_{name}_bucket{fmt(labels + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{self.prefix}_{name}_sum{fmt(labels)} {histogram.sum:g}")
+                    lines.append(f"{self.prefix}_{name}_count{fmt(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def make_exporter(path: str) -> Any:
+    """Prometheus text exporter for *.prom paths, JSON-lines exporter otherwise."""
+    return PrometheusExporter(path) if path.endswith(".prom") else JsonlMetricsExporter(path)
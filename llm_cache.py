@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# Modes accepted by the --cache switch in main.py and eval.py
+CACHE_MODES = ("off", "read", "write", "readwrite")
+DEFAULT_CACHE_DIR = ".llm_cache"
+# Eviction defaults: entries older than this are ignored and pruned ...
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 3600
+# ... and only the most recently written entries are kept
+DEFAULT_MAX_ENTRIES = 20000
+
+
+def _message_key(message: BaseMessage) -> Dict[str, Any]:
+    """
+    Reduce a message to the fields that determine the model's answer.
+    Message ids and tool call ids are random per run, so they are left out of the key.
+    """
+    key: Dict[str, Any] = {"type": message.type, "content": message.content}
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        key["tool_calls"] = [{"name": tc.get("name"), "args": tc.get("args")} for tc in tool_calls]
+    if getattr(message, "name", None):
+        key["name"] = message.name
+    return key
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache for chat model responses.
+
+    Each response is stored as one JSON file named after the SHA-256 of the request
+    (model identifier, bound tool schemas and messages). Writes go through a temp file
+    and os.replace so concurrent evaluation threads never see partial entries.
+    """
+
+    def __init__(
+        self,
+        model_identifier: str,
+        tools: list,
+        mode: str = "readwrite",
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_age_seconds: Optional[float] = DEFAULT_MAX_AGE_SECONDS,
+        max_entries: Optional[int] = DEFAULT_MAX_ENTRIES,
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode '{mode}'. Expected one of {CACHE_MODES}.")
+        self.mode = mode
+        self.cache_dir = cache_dir
+        self.max_age_seconds = max_age_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The tool schemas are part of every key; serialise them once
+        self._prefix = json.dumps(
+            {"model": model_identifier, "tools": [convert_to_openai_tool(t) for t in tools]},
+            sort_keys=True,
+        )
+        if self.can_write:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.prune()
+
+    @property
+    def can_read(self) -> bool:
+        return self.mode in ("read", "readwrite")
+
+    @property
+    def can_write(self) -> bool:
+        return self.mode in ("write", "readwrite")
+
+    def key(self, messages: List[BaseMessage]) -> str:
+        payload = json.dumps([_message_key(m) for m in messages], sort_keys=True, default=str)
+        return hashlib.sha256((self._prefix + payload).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, messages: List[BaseMessage]) -> Optional[AIMessage]:
+        """Return the cached response for these messages, or None on a miss."""
+        if not self.can_read:
+            return None
+        path = self._path(self.key(messages))
+        try:
+            if self.max_age_seconds is not None and time.time() - os.path.getmtime(path) > self.max_age_seconds:
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            # Imported on use: langchain_core.messages.utils loads langsmith, over half a second of startup
+            from langchain_core.messages import messages_from_dict
+            message = messages_from_dict([entry["response"]])[0]
+        except (OSError, ValueError, KeyError, IndexError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return message
+
+    def put(self, messages: List[BaseMessage], response: BaseMessage) -> None:
+        """Store a response. No-op unless the cache mode allows writing."""
+        if not self.can_write:
+            return
+        path = self._path(self.key(messages))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Drop the message id so replayed responses get a fresh id from add_messages
+        stored = response.model_copy(update={"id": None})
+        from langchain_core.messages import messages_to_dict
+        entry = {"created_at": time.time(), "response": messages_to_dict([stored])[0]}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def prune(self) -> int:
+        """Evict expired entries and, beyond max_entries, the oldest ones. Returns the number removed."""
+        entries = []
+        now = time.time()
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                # Temp files younger than an hour may belong to a writer in another process
+                stale_tmp = name.endswith(".tmp") and now - mtime > 3600
+                expired = self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+                if stale_tmp or (expired and not name.endswith(".tmp")):
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+                    continue
+                if not name.endswith(".tmp"):
+                    entries.append((mtime, path))
+        if self.max_entries is not None and len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
@@ -1,24 +1,21 @@
 import argparse
+import json
 import os
+import re
+import sys
 from datetime import datetime
-import pytz
-from langchain_core.messages import SystemMessage, HumanMessage
-from langfuse.callback import CallbackHandler
-from langchain_openai import ChatOpenAI
-from langgraph.graph import StateGraph
-from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
-from typing_extensions import TypedDict
-from typing import Annotated, List, Dict, Any
-
-# Import calendar tools
-from calendar_tools import (
-    create_calendar_event,
-    delete_calendar_event,
-    get_calendar_events,
-    get_calendar_event,
-    get_current_time
-)
+from typing import List, Dict, Any, Optional, Tuple
+
+from calendar_store import CALENDAR_BACKENDS
+from answer_templates import format_tool_results
+from date_resolver import annotate, reference_time, strip_note
+from instrumentation import MetricsCallbackHandler, make_exporter
+from llm_cache import CACHE_MODES, DEFAULT_CACHE_DIR, ResponseCache
+from mock_llm_server import MOCK_PREFIX, get_mock_base_url
+from prompts import TOOL_SCHEMA_MODES, system_message, tool_schemas
+from providers import ResilientChatModel, configure_providers
+from streaming import stream_events
+from tracing import TRACE_BACKENDS, TracingCallbackHandler, make_trace_handler
 
 # Environment variables for OpenRouter
 # Ensure OPENROUTER_API_KEY is set in your environment if using OpenRouter models
@@ -28,31 +25,77 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OPENROUTER_SITE_URL = os.getenv("OPENROUTER_SITE_URL", "https://openrouter.ai/api/v1") # Changed default
 OPENROUTER_SITE_NAME = os.getenv("OPENROUTER_SITE_NAME", "CalendarThesisApp") # Example default
 
-def get_langfuse_handler() -> CallbackHandler:
-    """Create a Langfuse callback handler from environment variables."""
-    return CallbackHandler(
-        public_key="",
-        secret_key="",
-        host="https://cloud.langfuse.com"
-    )
+def get_trace_handler(backend: str = "auto", trace_file: Optional[str] = None,
+                      enabled: bool = True) -> Optional[TracingCallbackHandler]:
+    """
+    Tracing callback handler (see tracing.py), or None when tracing is disabled or not configured.
+    Spans are exported in the background, so tracing never blocks or fails a turn.
+    """
+    return make_trace_handler(backend if enabled else "off", trace_file)
+
+def trace_config(trace_handler: Optional[Any]) -> Dict[str, Any]:
+    """Invocation config attaching the trace handler, if tracing is on."""
+    return {"callbacks": [trace_handler]} if trace_handler is not None else {}
 
 os.environ["OPENAI_API_KEY"] = ""
 
-class State(TypedDict):
-    messages: Annotated[list, add_messages]
+# "default": chatbot -> tools -> chatbot for every turn.
+# "fast": read-only tool calls run concurrently (writes still run one by one, in order), and a
+# turn that only retrieved data is answered from a template instead of a second model call.
+GRAPH_MODES = ("default", "fast")
 
-def _get_llm_with_tools(model_identifier: str, tools: list) -> Any:
+# A user message asking for any of these may need a write after the lookup, so fast mode never answers it from a
+# template. Quoted titles are ignored ("Find 'Planning' meetings"), and so is the noun in "show my schedule".
+WRITE_INTENT_RE = re.compile(
+    r"\b(cancel|delete|remove|clear|drop|(?<!my )(?<!the )schedule|reschedule|create|book|add|put|plan|set up|"
+    r"arrange|move|shift|postpone|change|update|rename|block|reserve|mark|make)\b", re.IGNORECASE)
+_QUOTED_RE = re.compile(r"'[^']*'|\"[^\"]*\"")
+
+def get_tools() -> List[Any]:
+    """Tools of the agent, in the order their schemas are sent (a stable order keeps the prompt prefix cacheable)."""
+    # Imported here: defining the tools loads langchain_core's callback machinery, over half a second
+    from calendar_tools import (
+        create_calendar_event,
+        delete_calendar_event,
+        get_calendar_events,
+        get_calendar_event,
+        find_free_slots,
+    )
+    return [create_calendar_event, delete_calendar_event, get_calendar_events, get_calendar_event, find_free_slots]
+
+def get_provider(model_identifier: str) -> str:
+    """Return the API provider that serves a model identifier ("openai", "openrouter" or "mock")."""
+    if model_identifier.startswith(MOCK_PREFIX):
+        return "mock"
+    return "openai" if model_identifier == "gpt-4o" else "openrouter"
+
+def _get_llm_with_tools(model_identifier: str, tools: list, http_client: Optional[Any] = None) -> Any:
     """
     Creates and configures an LLM instance based on the model identifier
     and binds the provided tools to it.
     Uses ChatOpenAI for both OpenAI and OpenRouter (by setting api_base).
+    An optional httpx.Client can be passed to share one connection pool between models.
+    "mock/<results-file>" replays a results CSV through the local mock server (mock_llm_server.py).
+    The SDK's own retries are off (max_retries=0); ResilientChatModel retries with the provider's limits.
     """
-    llm_instance: ChatOpenAI
+    # Imported here: langchain_openai pulls in the openai SDK, about a second of startup
+    from langchain_openai import ChatOpenAI
     
-    if model_identifier == "gpt-4o":
+    if model_identifier.startswith(MOCK_PREFIX):
+        llm_instance = ChatOpenAI(
+            model=model_identifier[len(MOCK_PREFIX):],
+            temperature=0,
+            base_url=get_mock_base_url(),
+            api_key="mock",
+            http_client=http_client,
+            stream_usage=True,
+            max_retries=0,
+        )
+    elif model_identifier == "gpt-4o":
         # Assumes OPENAI_API_KEY is set in the environment (either by script or shell)
         print(f"Initializing LLM: OpenAI model '{model_identifier}'")
-        llm_instance = ChatOpenAI(model=model_identifier, temperature=0)
+        llm_instance = ChatOpenAI(model=model_identifier, temperature=0, http_client=http_client, stream_usage=True,
+                                  max_retries=0)
     else: # Assume it's an OpenRouter model (e.g., "mistralai/mistral-7b-instruct", "meta-llama/llama-3.1-8b-instruct:free")
         if not OPENROUTER_API_KEY:
             raise ValueError(
@@ -68,29 +111,189 @@ def _get_llm_with_tools(model_identifier: str, tools: list) -> Any:
             temperature=0, # Good default for tool use
             openai_api_base="https://openrouter.ai/api/v1",
             openai_api_key=OPENROUTER_API_KEY,
+            http_client=http_client,
+            stream_usage=True, # Token usage is also reported when responses are streamed
+            max_retries=0,
         )
         # If model_identifier is invalid for OpenRouter, the API call will fail,
         # which is the desired behavior. No need for a specific "Unsupported model" error here.
         
     return llm_instance.bind_tools(tools)
 
-def build_graph(model_identifier: str) -> Any:
-    """Build and compile the LangGraph chatbot graph using the specified LLM."""
+def get_chat_model(model_identifier: str, tools: list, http_client: Optional[Any] = None,
+                   fallback_model: Optional[str] = None) -> ResilientChatModel:
+    """
+    Tool-bound model behind the provider layer (providers.py): rate limited and retried per
+    provider, failing over to fallback_model (comma-separated for a chain) on provider errors.
+    """
+    fallback = None
+    chain = [m.strip() for m in (fallback_model or "").split(",") if m.strip() and m.strip() != model_identifier]
+    if chain:
+        fallback = get_chat_model(chain[0], tools, http_client, ",".join(chain[1:]) or None)
+    return ResilientChatModel(_get_llm_with_tools(model_identifier, tools, http_client=http_client),
+                              model_identifier, get_provider(model_identifier), fallback=fallback)
+
+def _last_tool_results(messages: List[Any]) -> List[tuple]:
+    """(tool_call, result content) pairs of the most recent tool-calling AIMessage."""
+    results = {m.tool_call_id: m.content for m in messages if m.type == "tool"}
+    for message in reversed(messages):
+        if message.type == "ai" and message.tool_calls:
+            return [(call, results.get(call.get("id"))) for call in message.tool_calls]
+    return []
+
+def _is_pure_lookup(messages: List[Any]) -> bool:
+    """
+    True when the tool calls just made were the model's first of this turn and the user only asked
+    to look something up. Otherwise (e.g. "cancel my dentist appointment" looks the event up first)
+    the model has to see the results to decide what to do next.
+    """
+    tool_turns = 0
+    for message in reversed(messages):
+        if message.type == "human":
+            return tool_turns == 1 and not WRITE_INTENT_RE.search(_QUOTED_RE.sub("", strip_note(str(message.content))))
+        if message.type == "ai" and message.tool_calls:
+            tool_turns += 1
+    return False
+
+def build_graph(model_identifier: str, cache_mode: str = "off", cache_dir: str = DEFAULT_CACHE_DIR,
+                http_client: Optional[Any] = None, metrics: Optional[MetricsCallbackHandler] = None,
+                graph_mode: str = "default", llm_with_tools: Optional[Any] = None,
+                fallback_model: Optional[str] = None, tool_schema: str = "full", resolve_dates: bool = False) -> Any:
+    """
+    Build and compile the LangGraph chatbot graph using the specified LLM.
+    With cache_mode other than "off", model responses are read from / written to
+    an on-disk ResponseCache keyed by model, tool schemas and messages.
+    With metrics, every invocation records per-node latency, loop iterations, TTFT and tokens.
+    graph_mode is one of GRAPH_MODES.
+    llm_with_tools replaces the model built for model_identifier, e.g. with a stub in benchmarks.
+    fallback_model takes over model calls that still fail after the provider layer's retries.
+    tool_schema is one of prompts.TOOL_SCHEMA_MODES; "compact" binds trimmed tool schemas.
+    With resolve_dates, a resolve_dates node ahead of the chatbot appends the absolute ranges of
+    relative date/time expressions ("next Tuesday afternoon") to the user message (see date_resolver).
+    """
+    if graph_mode not in GRAPH_MODES:
+        raise ValueError(f"Unknown graph mode '{graph_mode}', expected one of {GRAPH_MODES}.")
+    # Imported here, like langchain_openai: langgraph alone is most of a second of startup
+    from typing import Annotated
+    from langchain_core.messages import AIMessage, HumanMessage
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.graph import END, StateGraph
+    from langgraph.graph.message import add_messages
+    from langgraph.prebuilt import ToolNode, tools_condition
+    from typing_extensions import TypedDict
+    from calendar_tools import READ_ONLY_TOOLS, get_current_time
+
+    class State(TypedDict):
+        messages: Annotated[list, add_messages]
+
     graph_builder = StateGraph(State)
-    tools = [create_calendar_event, delete_calendar_event, get_calendar_events, get_calendar_event]
+    tools = get_tools()
     
-    llm_with_tools = _get_llm_with_tools(model_identifier, tools)
+    # The tools the model sees; ToolNode below always runs the real ones
+    bound_tools = tool_schemas(tools, tool_schema)
+    if llm_with_tools is None:
+        llm_with_tools = get_chat_model(model_identifier, bound_tools, http_client=http_client, fallback_model=fallback_model)
+    response_cache = ResponseCache(model_identifier, bound_tools, cache_mode, cache_dir) if cache_mode != "off" else None
 
     def chatbot(state: State) -> Dict[str, List[Any]]:
-        return {"messages": [llm_with_tools.invoke(state["messages"])]}
+        if response_cache is not None:
+            cached = response_cache.get(state["messages"])
+            if cached is not None:
+                return {"messages": [cached]}
+        response = llm_with_tools.invoke(state["messages"])
+        if response_cache is not None and "fallback_model" not in response.response_metadata:
+            response_cache.put(state["messages"], response)
+        return {"messages": [response]}
 
     graph_builder.add_node("chatbot", chatbot)
     tool_node = ToolNode(tools=tools)
-    graph_builder.add_node("tools", tool_node)
     graph_builder.add_conditional_edges("chatbot", tools_condition)
-    graph_builder.add_edge("tools", "chatbot")
-    graph_builder.set_entry_point("chatbot")
-    return graph_builder.compile()
+
+    if resolve_dates:
+        def resolve_dates_node(state: State) -> Dict[str, List[Any]]:
+            last = state["messages"][-1]
+            if not isinstance(last, HumanMessage) or not isinstance(last.content, str):
+                return {"messages": []}
+            # The time the system prompt gives the model: FIXED_EVAL_TIME in evaluations
+            now = reference_time(state["messages"]) or datetime.strptime(get_current_time(), "%Y-%m-%d %H:%M:%S")
+            content = annotate(last.content, now)
+            if content == last.content:
+                return {"messages": []}
+            # Same id: replaces the user message instead of adding one
+            return {"messages": [HumanMessage(content=content, id=last.id)]}
+
+        graph_builder.add_node("resolve_dates", resolve_dates_node)
+        graph_builder.add_edge("resolve_dates", "chatbot")
+        graph_builder.set_entry_point("resolve_dates")
+    else:
+        graph_builder.set_entry_point("chatbot")
+
+    if graph_mode == "default":
+        graph_builder.add_node("tools", tool_node)
+        graph_builder.add_edge("tools", "chatbot")
+    else:
+        def run_tools(state: State, config: RunnableConfig) -> Dict[str, List[Any]]:
+            last = state["messages"][-1]
+            reads = [c for c in last.tool_calls if c["name"] in READ_ONLY_TOOLS]
+            writes = [c for c in last.tool_calls if c["name"] not in READ_ONLY_TOOLS]
+            outputs: List[Any] = []
+            if reads:
+                # ToolNode runs the calls of one message concurrently
+                outputs += tool_node.invoke({"messages": [AIMessage(content="", tool_calls=reads)]}, config)["messages"]
+            for call in writes:
+                outputs += tool_node.invoke({"messages": [AIMessage(content="", tool_calls=[call])]}, config)["messages"]
+            order = {c["id"]: i for i, c in enumerate(last.tool_calls)}
+            return {"messages": sorted(outputs, key=lambda m: order.get(m.tool_call_id, len(order)))}
+
+        def route_after_tools(state: State) -> str:
+            messages = state["messages"]
+            if _is_pure_lookup(messages) and format_tool_results(_last_tool_results(messages)) is not None:
+                return "respond"
+            return "chatbot"
+
+        def respond(state: State) -> Dict[str, List[Any]]:
+            return {"messages": [AIMessage(content=format_tool_results(_last_tool_results(state["messages"])))]}
+
+        graph_builder.add_node("tools", run_tools)
+        graph_builder.add_node("respond", respond)
+        graph_builder.add_conditional_edges("tools", route_after_tools, {"respond": "respond", "chatbot": "chatbot"})
+        graph_builder.add_edge("respond", END)
+    graph = graph_builder.compile()
+    if metrics is not None:
+        # Bound callbacks are merged with the ones passed per call (e.g. Langfuse)
+        graph = graph.with_config(callbacks=[metrics])
+    return graph
+
+# Argument formatting rules for small Llama models. They do not depend on the turn, so they go
+# ahead of the current time and stay part of the cacheable prompt prefix.
+LLAMA_FORMAT_RULES = (
+    "IMPORTANT: When you use a tool, you MUST provide complete and valid JSON arguments. "
+    "FORMAT REQUIREMENTS:\n"
+    "1. For any date/time fields, ALWAYS use ISO format like '2024-07-17T10:00:00' (not natural language like 'tomorrow' or 'next Monday').\n"
+    "2. For timezone fields, ALWAYS use the complete string 'Europe/Amsterdam'.\n"
+    "3. All string values in JSON must be properly quoted and all JSON objects must have closing braces.\n"
+    "4. Argument example for create_calendar_event: {\"summary\": \"Meeting\", \"start_datetime\": \"2024-07-17T10:00:00\", \"end_datetime\": \"2024-07-17T11:00:00\", \"timezone\": \"Europe/Amsterdam\"}\n"
+    "5. Argument example for get_calendar_events: {\"start_datetime\": \"2024-07-17T00:00:00\", \"end_datetime\": \"2024-07-17T23:59:59\", \"time_zone\": \"Europe/Amsterdam\"}"
+)
+
+def build_system_prompt_parts(model_identifier: str, system_time: str) -> Tuple[str, str]:
+    """(static, per-turn) parts of the interactive system prompt; small Llama models get explicit argument formatting rules."""
+    static = LLAMA_FORMAT_RULES if "llama-3.2-3b" in model_identifier else ""
+    return static, f"The current date and time is {system_time} (Europe/Amsterdam)."
+
+def build_system_prompt(model_identifier: str, system_time: str) -> str:
+    """System prompt for interactive use, static rules first."""
+    return "\n".join(part for part in build_system_prompt_parts(model_identifier, system_time) if part)
+
+def build_initial_messages(model_identifier: str, message: str) -> List[Any]:
+    """System + user messages for one chat turn at the current Amsterdam time."""
+    from langchain_core.messages import HumanMessage
+    from calendar_tools import get_current_time
+    static, dynamic = build_system_prompt_parts(model_identifier, get_current_time())
+    return [
+        system_message(static, dynamic, model_identifier),
+        HumanMessage(content=message)
+    ]
 
 def main():
     parser = argparse.ArgumentParser(description="Run LangGraph chatbot with a custom message.")
@@ -101,41 +304,64 @@ def main():
         default="qwen/qwen3-32b",
         help='LLM to use. Examples: "gpt-4o", or an OpenRouter model like "mistralai/mistral-7b-instruct", "meta-llama/llama-3.1-8b-instruct:free"'
     )
+    parser.add_argument('--cache', type=str, choices=CACHE_MODES, default="off", help='On-disk LLM response cache mode.')
+    parser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='Directory for the LLM response cache.')
+    parser.add_argument('--no_trace', '--no-trace', action='store_true', help='Disable tracing (same as --trace_backend off).')
+    parser.add_argument('--trace_backend', type=str, choices=TRACE_BACKENDS, default="auto", help='Where traces go: "auto" uses Langfuse when LANGFUSE_PUBLIC_KEY/LANGFUSE_SECRET_KEY are set, else --trace_file if given, else none.')
+    parser.add_argument('--trace_file', type=str, default=None, help='JSON lines trace file for the file backend (default: traces.jsonl).')
+    parser.add_argument('--graph_mode', type=str, choices=GRAPH_MODES, default="default", help='"fast" runs read-only tools concurrently and answers pure retrieval turns from a template.')
+    parser.add_argument('--fallback_model', type=str, default=None, help='Model (or comma-separated chain) that answers when a model call still fails after retries, e.g. with OpenRouter\'s 404 "No endpoints found that support tool use".')
+    parser.add_argument('--rate_limits', type=str, default=None, help='Per-provider request rate limits in requests per second[:burst], e.g. "openrouter=4,openai=10:20". Unlimited by default.')
+    parser.add_argument('--max_retries', type=int, default=3, help='Retries of a model call on 429/5xx/connection errors, with jittered exponential backoff.')
+    parser.add_argument('--tool_schema', type=str, choices=TOOL_SCHEMA_MODES, default="full", help='"compact" sends trimmed tool schemas (first-sentence descriptions, no defaults) to cut prompt tokens.')
+    parser.add_argument('--resolve_dates', action='store_true', help='Resolve relative dates and times ("next Tuesday afternoon") locally and add the absolute ranges to the message.')
+    parser.add_argument('--stream', action='store_true', help='Stream tokens and tool-call arguments as they are generated.')
+    parser.add_argument('--metrics_file', type=str, default=None, help='Write per-invocation metrics here (JSON lines, or Prometheus text for *.prom).')
+    parser.add_argument('--calendar_backend', type=str, choices=CALENDAR_BACKENDS, default="local", help='Backend behind the calendar tools.')
+    parser.add_argument('--calendar_root_url', type=str, default=None, help='Calendar API root URL for the google backend (e.g. a local fake API).')
+    parser.add_argument('--calendar_mirror_path', type=str, default=None, help='SQLite file for the mirror backend (default: .calendar_mirror.sqlite).')
     args = parser.parse_args()
 
+    from calendar_tools import configure_calendar_backend
+    configure_calendar_backend(args.calendar_backend, root_url=args.calendar_root_url, mirror_path=args.calendar_mirror_path)
+    configure_providers(args.rate_limits, args.max_retries)
+
     # Warning for OpenRouter models if API key is missing
-    if args.model != "gpt-4o" and not OPENROUTER_API_KEY:
+    if get_provider(args.model) == "openrouter" and not OPENROUTER_API_KEY:
         print(f"Warning: Attempting to use OpenRouter model '{args.model}' but OPENROUTER_API_KEY environment variable is not set.")
         print("The application will likely fail if this model requires an API key and it's not found by other means.")
 
-    system_time = get_current_time()
-    
-    # Enhanced system prompt for better tool usage with the Llama model
-    if "llama-3.2-3b" in args.model:
-        system_prompt = (
-            f"The current date and time is {system_time} (Europe/Amsterdam). "
-            f"IMPORTANT: When you use a tool, you MUST provide complete and valid JSON arguments. "
-            f"FORMAT REQUIREMENTS:\n"
-            f"1. For any date/time fields, ALWAYS use ISO format like '2024-07-17T10:00:00' (not natural language like 'tomorrow' or 'next Monday').\n"
-            f"2. For timezone fields, ALWAYS use the complete string 'Europe/Amsterdam'.\n"
-            f"3. All string values in JSON must be properly quoted and all JSON objects must have closing braces.\n"
-            f"4. Argument example for create_calendar_event: {{\"summary\": \"Meeting\", \"start_datetime\": \"2024-07-17T10:00:00\", \"end_datetime\": \"2024-07-17T11:00:00\", \"timezone\": \"Europe/Amsterdam\"}}\n"
-            f"5. Argument example for get_calendar_events: {{\"start_datetime\": \"2024-07-17T00:00:00\", \"end_datetime\": \"2024-07-17T23:59:59\", \"time_zone\": \"Europe/Amsterdam\"}}"
-        )
-    else:
-        system_prompt = f"The current date and time is {system_time} (Europe/Amsterdam)."
-    
-    initial_messages = [
-        SystemMessage(content=system_prompt),
-        HumanMessage(content=args.message)
-    ]
+    initial_messages = build_initial_messages(args.model, args.message)
 
-    graph = build_graph(args.model)
-    langfuse_handler = get_langfuse_handler()
-    events = graph.stream({"messages": initial_messages}, config={"callbacks": [langfuse_handler]})
+    metrics = MetricsCallbackHandler(args.model, [make_exporter(args.metrics_file)]) if args.metrics_file else None
+    graph = build_graph(args.model, cache_mode=args.cache, cache_dir=args.cache_dir, metrics=metrics,
+                        graph_mode=args.graph_mode, fallback_model=args.fallback_model, tool_schema=args.tool_schema,
+                        resolve_dates=args.resolve_dates)
+    trace_handler = get_trace_handler(args.trace_backend, args.trace_file, enabled=not args.no_trace)
+    if args.stream:
+        print_stream(graph, initial_messages, trace_handler)
+        return
+    events = graph.stream({"messages": initial_messages}, config=trace_config(trace_handler))
     for event in events:
         print(event)
 
+def print_stream(graph: Any, initial_messages: List[Any], trace_handler: Optional[Any]) -> None:
+    """Print text as it is generated and tool-call arguments as they are parsed."""
+    for event in stream_events(graph, {"messages": initial_messages}, config=trace_config(trace_handler)):
+        if event["type"] == "token":
+            sys.stdout.write(event["text"])
+        elif event["type"] == "tool_call_delta":
+            # Redraw the call in place while its arguments arrive
+            sys.stdout.write(f"\r[tool] {event['name']}({json.dumps(event['args'])})")
+        elif event["type"] == "tool_call":
+            sys.stdout.write(f"\r[tool] {event['name']}({json.dumps(event['args'])})\n")
+        elif event["type"] == "tool_result":
+            sys.stdout.write(f"[result] {event['content']}\n")
+        elif event["type"] == "done":
+            ttft = f"{event['ttft_ms']} ms" if event['ttft_ms'] is not None else "n/a"
+            sys.stdout.write(f"\n\n(time to first token: {ttft}, total: {event['latency_ms']} ms)\n")
+        sys.stdout.flush()
+
 if __name__ == "__main__":
     main()
 
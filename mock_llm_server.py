@@ -0,0 +1,342 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from date_resolver import strip_note
+
+# Model identifiers "mock/<results-file>" are served by this server, e.g. "mock/results_gpt4o.csv"
+MOCK_PREFIX = "mock/"
+DEFAULT_PORT = 8086
+# Base URL of an already running mock server; without it an in-process server is started on first use
+MOCK_LLM_URL = os.getenv("MOCK_LLM_URL", "")
+FALLBACK_REPLY = "I'm sorry, I can't help with that request."
+
+_ERROR_CODE = re.compile(r"Error code: (\d{3})")
+
+
+@dataclass
+class Recording:
+    """One recorded results row: the tool calls of the first model turn and the final answer."""
+    tool_calls: List[Dict[str, Any]] = field(default_factory=list)
+    output: str = ""
+    latency_ms: Optional[float] = None
+    error: str = ""
+
+    @property
+    def model_calls(self) -> int:
+        # A row with tool calls took two model round trips: the call and the answer
+        return 2 if self.tool_calls else 1
+
+
+def load_recordings(path: str) -> Dict[str, Recording]:
+    """Recordings of a results_*.csv file, keyed by the normalized input message."""
+    recordings: Dict[str, Recording] = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                tool_calls = json.loads(row.get("actual_tool_calls") or "[]")
+            except ValueError:
+                tool_calls = []
+            try:
+                latency_ms = float(row["latency_ms"]) if row.get("latency_ms") else None
+            except ValueError:
+                latency_ms = None
+            recordings[_normalize(row.get("input", ""))] = Recording(
+                tool_calls=[c for c in tool_calls if isinstance(c, dict) and c.get("name")],
+                output=row.get("output") or "",
+                latency_ms=latency_ms,
+                error=row.get("error") or "",
+            )
+    return recordings
+
+
+def _normalize(text: str) -> str:
+    return " ".join(str(text).split()).lower()
+
+
+class LatencyModel:
+    """
+    Response delay per model call, from a spec string:
+      "0"                    no delay (default)
+      "fixed:MS"             constant delay
+      "uniform:LO,HI"        uniform between LO and HI ms
+      "normal:MEAN,STD"      normal, clamped at 0
+      "lognormal:MEDIAN,SIGMA"  long-tailed, like real provider latencies
+      "recorded[:SCALE]"     the row's recorded latency_ms split over its model calls, times SCALE
+    Samples come from one seeded generator, so a sequential run is reproducible.
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal", "recorded")
+
+    def __init__(self, spec: str = "0", seed: int = 0):
+        self.spec = spec or "0"
+        kind, _, params = self.spec.partition(":")
+        if kind == "0":
+            kind, params = "fixed", "0"
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency spec '{spec}', expected one of {self.KINDS}.")
+        try:
+            self.params = [float(p) for p in params.split(",")] if params else []
+        except ValueError:
+            raise ValueError(f"Invalid latency parameters in '{spec}'.")
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}.get(kind)
+        if expected is not None and len(self.params) != expected:
+            raise ValueError(f"Latency spec '{spec}' needs {expected} parameter(s).")
+        self.kind = kind
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_ms(self, recording: Optional[Recording] = None) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "recorded":
+            if recording is None or recording.latency_ms is None:
+                return 0.0
+            scale = self.params[0] if self.params else 1.0
+            return recording.latency_ms / recording.model_calls * scale
+        with self._lock:
+            if self.kind == "uniform":
+                return self._rng.uniform(*self.params)
+            if self.kind == "normal":
+                return max(0.0, self._rng.gauss(*self.params))
+            median, sigma = self.params
+            return self._rng.lognormvariate(0.0, sigma) * median
+
+
+class MockLLM:
+    """
+    Deterministic OpenAI-compatible chat completions, replayed from results_*.csv files.
+
+    The request's model names the results file (relative to data_dir). The recording is looked
+    up by the last user message: the first model turn returns the recorded tool calls, and any
+    turn after tool results returns the recorded final answer. Unknown inputs get a fixed reply.
+    """
+
+    def __init__(self, data_dir: str = ".", latency: str = "0", seed: int = 0, replay_errors: bool = False):
+        self.data_dir = os.path.realpath(data_dir)
+        self.latency = LatencyModel(latency, seed)
+        self.replay_errors = replay_errors
+        self.requests = 0
+        self._books: Dict[str, Dict[str, Recording]] = {}
+        self._lock = threading.Lock()
+
+    def recordings(self, model: str) -> Optional[Dict[str, Recording]]:
+        book = self._books.get(model)
+        if book is None:
+            path = os.path.realpath(os.path.join(self.data_dir, model))
+            # Only CSV files below data_dir can be replayed
+            if not path.endswith(".csv") or os.path.commonpath([self.data_dir, path]) != self.data_dir \
+                    or not os.path.isfile(path):
+                return None
+            book = load_recordings(path)
+            with self._lock:
+                self._books[model] = book
+        return book
+
+    def complete(self, request: Dict[str, Any]) -> Tuple[int, Dict[str, Any], float]:
+        """Answer one chat completion request; returns (status, response body, delay in seconds)."""
+        with self._lock:
+            self.requests += 1
+        model = request.get("model", "")
+        book = self.recordings(model)
+        if book is None:
+            return 404, _error(404, f"The model '{model}' does not exist (no results file {model} in the mock data dir)."), 0.0
+        messages = request.get("messages", [])
+        user_index = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=-1)
+        user_text = _content_text(messages[user_index].get("content")) if user_index >= 0 else ""
+        answered_tools = any(m.get("role") == "tool" for m in messages[user_index + 1:])
+        # Inputs are recorded without the date resolver's note (main.build_graph with resolve_dates)
+        recording = book.get(_normalize(strip_note(user_text)))
+        delay = self.latency.sample_ms(recording) / 1000
+
+        if recording is not None and recording.error and self.replay_errors:
+            match = _ERROR_CODE.search(recording.error)
+            status = int(match.group(1)) if match else 500
+            return status, _error(status, recording.error), delay
+
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        if recording is None:
+            message["content"] = FALLBACK_REPLY
+        elif recording.tool_calls and not answered_tools:
+            digest = hashlib.sha1(user_text.encode("utf-8")).hexdigest()[:12]
+            message["tool_calls"] = [
+                {"id": f"call_{digest}_{i}", "type": "function",
+                 "function": {"name": call["name"], "arguments": json.dumps(call.get("args") or {})}}
+                for i, call in enumerate(recording.tool_calls)
+            ]
+        else:
+            message["content"] = recording.output
+        return 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "logprobs": None,
+                         "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"}],
+            "usage": _usage(request, message),
+        }, delay
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _usage(request: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, int]:
+    # Rough 4-characters-per-token estimate; enough for throughput and token accounting tests
+    prompt_chars = sum(len(_content_text(m.get("content"))) for m in request.get("messages", []))
+    prompt_chars += len(json.dumps(request.get("tools", [])))
+    completion_chars = len(message.get("content") or "") + len(json.dumps(message.get("tool_calls", [])))
+    prompt_tokens, completion_tokens = prompt_chars // 4 + 1, completion_chars // 4 + 1
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _error(code: int, message: str) -> Dict[str, Any]:
+    return {"error": {"message": message, "type": "invalid_request_error", "code": code}}
+
+
+def stream_chunks(response: Dict[str, Any], include_usage: bool) -> List[Dict[str, Any]]:
+    """A chat.completion response as chat.completion.chunk objects, as OpenAI streams it."""
+    choice = response["choices"][0]
+    message = choice["message"]
+    base = {"id": response["id"], "object": "chat.completion.chunk", "created": response["created"],
+            "model": response["model"]}
+    chunks = [{**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}]
+    if message.get("content"):
+        # Word-sized text deltas
+        for word in re.findall(r"\S+\s*|\s+", message["content"]):
+            chunks.append({**base, "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]})
+    for index, call in enumerate(message.get("tool_calls", [])):
+        arguments = call["function"]["arguments"]
+        chunks.append({**base, "choices": [{"index": 0, "finish_reason": None, "delta": {"tool_calls": [
+            {"index": index, "id": call["id"], "type": "function",
+             "function": {"name": call["function"]["name"], "arguments": ""}}]}}]})
+        for i in range(0, len(arguments), 16):
+            chunks.append({**base, "choices": [{"index": 0, "finish_reason": None, "delta": {"tool_calls": [
+                {"index": index, "function": {"arguments": arguments[i:i + 16]}}]}}]})
+    chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}]})
+    if include_usage:
+        chunks.append({**base, "choices": [], "usage": response["usage"]})
+    return chunks
+
+
+class MockLLMRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY every keep-alive response
+    # waits out the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        llm: MockLLM = self.server.llm
+        if self.path.rstrip("/") == "/v1/models":
+            models = sorted(f for f in os.listdir(llm.data_dir) if f.endswith(".csv"))
+            self._send(200, json.dumps({"object": "list", "data": [{"id": m, "object": "model"} for m in models]}).encode())
+        elif self.path == "/health":
+            self._send(200, json.dumps({"status": "ok", "requests": llm.requests}).encode())
+        else:
+            self._send(404, json.dumps(_error(404, f"Unknown endpoint GET {self.path}")).encode())
+
+    def do_POST(self) -> None:
+        llm: MockLLM = self.server.llm
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send(404, json.dumps(_error(404, f"Unknown endpoint POST {self.path}")).encode())
+            return
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self._send(400, json.dumps(_error(400, "Request body is not valid JSON.")).encode())
+            return
+        status, response, delay = llm.complete(request)
+        if delay > 0:
+            time.sleep(delay)
+        if status != 200 or not request.get("stream"):
+            self._send(status, json.dumps(response).encode())
+            return
+        include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+        events = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in stream_chunks(response, include_usage))
+        self._send(200, (events + "data: [DONE]\n\n").encode(), "text/event-stream")
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Any, llm: Optional[MockLLM] = None):
+        self.llm = llm or MockLLM()
+        super().__init__(address, MockLLMRequestHandler)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        """Serve on a daemon thread, e.g. from a benchmark."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+_local_server: Optional[MockLLMServer] = None
+_local_lock = threading.Lock()
+
+
+def get_mock_base_url() -> str:
+    """
+    OpenAI base URL for "mock/..." models: MOCK_LLM_URL if set, otherwise an in-process server
+    replaying files from the working directory, started on first use on a free port.
+    """
+    global _local_server
+    if MOCK_LLM_URL:
+        return MOCK_LLM_URL
+    with _local_lock:
+        if _local_server is None:
+            _local_server = MockLLMServer(("127.0.0.1", 0), MockLLM(
+                latency=os.getenv("MOCK_LLM_LATENCY", "0"), seed=int(os.getenv("MOCK_LLM_SEED", "0")),
+            )).start()
+        return _local_server.base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an OpenAI-compatible mock LLM that replays results_*.csv files.")
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='Host to bind to.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to bind to.')
+    parser.add_argument('--data_dir', type=str, default=".", help='Directory containing the results_*.csv files to replay.')
+    parser.add_argument('--latency', type=str, default="0", help='Latency per model call: 0, fixed:MS, uniform:LO,HI, normal:MEAN,STD, lognormal:MEDIAN,SIGMA or recorded[:SCALE].')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for sampled latencies.')
+    parser.add_argument('--replay_errors', action='store_true', help='Answer rows that recorded a provider error with that error status instead of their output.')
+    args = parser.parse_args()
+
+    server = MockLLMServer((args.host, args.port), MockLLM(args.data_dir, args.latency, args.seed, args.replay_errors))
+    print(f"Mock LLM on {server.base_url} (set MOCK_LLM_URL={server.base_url} and use --model mock/<results-file>)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
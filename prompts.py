@@ -0,0 +1,104 @@
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# "full": the tools' own schemas and docstrings. "compact": first-sentence descriptions and
+# bare parameter types, for models billed per prompt token.
+TOOL_SCHEMA_MODES = ("full", "compact")
+# OpenRouter models that only cache a prompt prefix up to an explicit cache_control breakpoint.
+# OpenAI (and most other providers) cache stable prefixes automatically.
+CACHE_CONTROL_PREFIXES = ("anthropic/", "google/gemini")
+
+
+def supports_cache_control(model_identifier: str) -> bool:
+    return model_identifier.startswith(CACHE_CONTROL_PREFIXES)
+
+
+def system_message(static: str, dynamic: str = "", model_identifier: str = "") -> SystemMessage:
+    """
+    System message with the static instructions first and the per-turn part (the current
+    time) last. Together with the tool schemas, which providers put in front of the messages,
+    the static part is then the same prompt prefix on every call and can be served from the
+    provider's prompt cache. For models needing explicit breakpoints it is marked with cache_control.
+    """
+    if static and supports_cache_control(model_identifier):
+        blocks = [{"type": "text", "text": static, "cache_control": {"type": "ephemeral"}}]
+        if dynamic:
+            blocks.append({"type": "text", "text": dynamic})
+        return SystemMessage(content=blocks)
+    return SystemMessage(content="\n".join(part for part in (static, dynamic) if part))
+
+
+def _first_sentence(text: str) -> str:
+    text = " ".join(text.split())
+    return re.split(r"(?<=\.)\s", text, maxsplit=1)[0]
+
+
+def compact_tool_schema(tool: Any) -> Dict[str, Any]:
+    """
+    OpenAI tool schema with the description cut to its first sentence and each parameter reduced
+    to its type: optional parameters lose their null variant and defaults, which the tool
+    applies anyway when an argument is left out.
+    """
+    function = convert_to_openai_tool(tool)["function"]
+    parameters = function.get("parameters", {})
+    properties = {}
+    for name, prop in parameters.get("properties", {}).items():
+        variants = [p for p in prop.get("anyOf", []) if p.get("type") != "null"]
+        prop = dict(variants[0]) if len(variants) == 1 else dict(prop)
+        prop.pop("default", None)
+        properties[name] = prop
+    compact = {"type": "object", "properties": properties}
+    if parameters.get("required"):
+        compact["required"] = parameters["required"]
+    return {"type": "function", "function": {
+        "name": function["name"], "description": _first_sentence(function.get("description", "")), "parameters": compact,
+    }}
+
+
+def tool_schemas(tools: Sequence[Any], mode: str = "full") -> List[Any]:
+    """What to bind for a TOOL_SCHEMA_MODES mode: the tools themselves, or their compact schemas."""
+    if mode not in TOOL_SCHEMA_MODES:
+        raise ValueError(f"Unknown tool schema mode '{mode}', expected one of {TOOL_SCHEMA_MODES}.")
+    return list(tools) if mode == "full" else [compact_tool_schema(t) for t in tools]
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Optional[Any]:
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # tiktoken missing, or its encoding is not cached and cannot be downloaded
+        return None
+
+
+def tokenizer_name() -> str:
+    return "o200k_base" if _encoding() is not None else "estimate (4 characters per token)"
+
+
+def count_tokens(text: str) -> int:
+    """Tokens of text with GPT-4o's tokenizer when available, else the 4-characters-per-token estimate."""
+    encoding = _encoding()
+    return len(encoding.encode(text)) if encoding is not None else len(text) // 4 + 1
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return str(content or "")
+
+
+def prompt_tokens(messages: Sequence[Any], tools: Sequence[Any] = ()) -> Dict[str, int]:
+    """Approximate prompt tokens of one model call, split into tool schemas, system messages and the rest."""
+    schemas = [convert_to_openai_tool(t) for t in tools]
+    counts = {"tools": count_tokens(json.dumps(schemas)) if schemas else 0, "system": 0, "messages": 0}
+    for message in messages:
+        # A few tokens of framing per message, as in OpenAI's accounting
+        counts["system" if message.type == "system" else "messages"] += count_tokens(_text(message.content)) + 4
+    counts["total"] = counts["tools"] + counts["system"] + counts["messages"]
+    return counts
@@ -0,0 +1,188 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+# HTTP statuses worth retrying on the same provider: timeouts, rate limits and server errors
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+# Custom callback events emitted by ResilientChatModel (see MetricsCallbackHandler.on_custom_event)
+RETRY_EVENT = "provider_retry"
+RATE_LIMIT_EVENT = "provider_rate_limit_wait"
+FALLBACK_EVENT = "provider_fallback"
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter; a Retry-After from the provider takes precedence."""
+    max_retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` requests per second with bursts of up to `burst`.
+    Callers reserve a token and sleep outside the lock, so waiting threads are served in
+    arrival order. pause() empties the bucket, e.g. after a 429, so every caller backs off.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}.")
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until it is available; returns the seconds waited."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all callers for about `seconds`."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+def parse_rate_limits(spec: Optional[str]) -> Dict[str, Tuple[float, Optional[int]]]:
+    """Parse "openrouter=4,openai=10:20" (requests per second[:burst]) into {provider: (rate, burst)}."""
+    limits = {}
+    if spec:
+        for item in spec.split(","):
+            provider, _, limit = item.partition("=")
+            rate, _, burst = limit.partition(":")
+            limits[provider.strip()] = (float(rate), int(burst) if burst else None)
+    return limits
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_retry_policy = RetryPolicy()
+
+
+def configure_providers(rate_limits: Optional[str] = None, max_retries: Optional[int] = None) -> None:
+    """
+    Process-wide provider settings: per-provider token buckets (shared by every model and
+    graph of that provider) from a parse_rate_limits spec, and the number of retries.
+    Providers without a rate limit are not throttled.
+    """
+    global _retry_policy
+    _buckets.clear()
+    for provider, (rate, burst) in parse_rate_limits(rate_limits).items():
+        _buckets[provider] = TokenBucket(rate, burst)
+    if max_retries is not None:
+        _retry_policy = RetryPolicy(max_retries=max_retries)
+
+
+def failure_status(error: BaseException) -> Optional[int]:
+    """HTTP status of a provider error (openai.APIStatusError and the like), if any."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds from the Retry-After header of a provider error response."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_connection_error(error: BaseException) -> bool:
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # openai.APIConnectionError / APITimeoutError, matched by name so this module does not import openai
+    return any(cls.__name__ in ("APIConnectionError", "APITimeoutError") for cls in type(error).__mro__)
+
+
+def is_retryable(error: BaseException) -> bool:
+    return failure_status(error) in RETRY_STATUSES or is_connection_error(error)
+
+
+def is_provider_error(error: BaseException) -> bool:
+    """Errors another model or endpoint may not have, e.g. OpenRouter's 404 "No endpoints found that support tool use"."""
+    return failure_status(error) is not None or is_connection_error(error)
+
+
+def _emit(name: str, data: Dict[str, Any]) -> None:
+    # Attached to the current graph node's run; outside a run (e.g. a bare invoke) there is nobody to tell
+    from langchain_core.callbacks import dispatch_custom_event
+    try:
+        dispatch_custom_event(name, data)
+    except RuntimeError:
+        pass
+
+
+class ResilientChatModel:
+    """
+    Wraps a tool-bound chat model with its provider's rate limiter and jittered retries on
+    429/5xx/connection errors. When the provider still fails, the call goes to `fallback`
+    (another ResilientChatModel) if one is configured. Retries, limiter waits and fallbacks
+    are reported as custom callback events, so MetricsCallbackHandler records them per row.
+    """
+
+    def __init__(self, model: Any, model_identifier: str, provider: str,
+                 fallback: Optional["ResilientChatModel"] = None):
+        self.model = model
+        self.model_identifier = model_identifier
+        self.provider = provider
+        self.fallback = fallback
+
+    def _invoke_with_retries(self, messages: List[Any], config: Optional[Dict[str, Any]], **kwargs: Any) -> Any:
+        policy = _retry_policy
+        attempt = 0
+        while True:
+            bucket = _buckets.get(self.provider)
+            if bucket is not None:
+                waited = bucket.acquire()
+                if waited:
+                    _emit(RATE_LIMIT_EVENT, {"provider": self.provider, "wait_ms": waited * 1000})
+            try:
+                return self.model.invoke(messages, config, **kwargs)
+            except Exception as e:
+                if attempt >= policy.max_retries or not is_retryable(e):
+                    raise
+                status = failure_status(e)
+                delay = policy.delay(attempt, retry_after(e))
+                _emit(RETRY_EVENT, {"provider": self.provider, "model": self.model_identifier,
+                                    "status": status, "attempt": attempt + 1, "delay_ms": delay * 1000})
+                if status == 429 and bucket is not None:
+                    # Every caller of this provider backs off; the next acquire() waits it out
+                    bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+
+    def invoke(self, messages: List[Any], config: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+        try:
+            return self._invoke_with_retries(messages, config, **kwargs)
+        except Exception as e:
+            if self.fallback is None or not is_provider_error(e):
+                raise
+            print(f"Model '{self.model_identifier}' failed ({str(e)[:120]}); falling back to '{self.fallback.model_identifier}'")
+            _emit(FALLBACK_EVENT, {"model": self.model_identifier, "fallback_model": self.fallback.model_identifier,
+                                   "status": failure_status(e), "error": str(e)})
+            response = self.fallback.invoke(messages, config, **kwargs)
+            # Marked so callers can tell (e.g. the response cache does not store it under this model)
+            response.response_metadata.setdefault("fallback_model", self.fallback.model_identifier)
+            return response
@@ -0,0 +1,148 @@
+import argparse
+import glob
+import json
+import math
+from typing import Dict, Optional, Sequence, Tuple
+
+import pandas as pd
+from mock_llm_server import MOCK_PREFIX
+from results_store import ResultsStore, model_from_path
+
+# USD per 1M (prompt, completion) tokens, list prices when these were added; override with --prices
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "mistralai/mistral-7b-instruct": (0.028, 0.054),
+    "mistralai/ministral-8b": (0.10, 0.10),
+    "meta-llama/llama-3.3-70b-instruct": (0.12, 0.30),
+    "qwen/qwen3-32b": (0.10, 0.30),
+    "nousresearch/hermes-3-llama-3.1-70b": (0.12, 0.30),
+}
+# Labels of the checked-in results_<label>.csv files
+MODEL_ALIASES = {
+    "gpt4o": "gpt-4o",
+    "mistral": "mistralai/mistral-7b-instruct",
+    "mistral8b": "mistralai/ministral-8b",
+    "llama70b": "meta-llama/llama-3.3-70b-instruct",
+    "qwen32b": "qwen/qwen3-32b",
+    "hermes_70b": "nousresearch/hermes-3-llama-3.1-70b",
+}
+PERCENTILES = (50, 90, 99)
+
+
+def nearest_rank(values: Sequence[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, the same definition ResultsStore.percentiles uses in SQL."""
+    ordered = sorted(v for v in values if v is not None and not math.isnan(v))
+    if not ordered:
+        return None
+    return ordered[max(1, math.ceil(p * len(ordered) / 100)) - 1]
+
+
+def latency_summary(latencies: Sequence[float]) -> str:
+    """"p50 410 ms  p90 1230 ms  p99 2210 ms" for the end-of-run summaries."""
+    points = [(p, nearest_rank(latencies, p)) for p in PERCENTILES]
+    return "  ".join(f"p{p} {value:.0f} ms" for p, value in points if value is not None) or "no latencies"
+
+
+def load_prices(path: Optional[str] = None) -> Dict[str, Tuple[float, float]]:
+    """MODEL_PRICES updated from a JSON file of {"model": [prompt_usd_per_1m, completion_usd_per_1m]}."""
+    prices = dict(MODEL_PRICES)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            prices.update({model: tuple(price) for model, price in json.load(f).items()})
+    return prices
+
+
+def price_for(model: str, prices: Dict[str, Tuple[float, float]]) -> Optional[Tuple[float, float]]:
+    """Price of a model identifier or results label; mock models are priced as the model they replay."""
+    if model.startswith(MOCK_PREFIX):
+        model = model_from_path(model[len(MOCK_PREFIX):])
+    for name in (model, MODEL_ALIASES.get(model), model.split(":")[0]):
+        if name in prices:
+            return prices[name]
+    return None
+
+
+def build_report(store: ResultsStore, run_ids: Optional[Sequence[str]] = None, models: Optional[Sequence[str]] = None,
+                 concurrency: int = 1, prices: Optional[Dict[str, Tuple[float, float]]] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Per-model and per-(model, expected tool) comparison tables over the stored results.
+
+    The per-model table has accuracy, error rate, latency percentiles, TTFT p50, mean tokens
+    per row, estimated cost per 1k requests and the throughput expected at `concurrency`
+    in-flight requests (concurrency / mean latency, i.e. assuming the provider keeps up).
+    """
+    prices = prices if prices is not None else MODEL_PRICES
+    where, params = store.filter_clause(run_ids, models)
+    where = f"WHERE {where}" if where else ""
+    by_model = store.query(
+        "SELECT model, COUNT(*) AS rows, AVG(passed) AS accuracy, 1.0 - AVG(execution_success) AS error_rate, "
+        "AVG(retries) AS retries_per_row, AVG(fallback_model IS NOT NULL) AS fallback_rate, "
+        "AVG(latency_ms) AS mean_ms, AVG(prompt_tokens) AS prompt_tokens, AVG(completion_tokens) AS completion_tokens, "
+        f"AVG(total_tokens) AS tokens_per_row FROM results {where} GROUP BY model ORDER BY model", params)
+    latency = store.percentiles("latency_ms", ("model",), PERCENTILES, run_ids, models)
+    ttft = store.percentiles("ttft_ms", ("model",), (50,), run_ids, models).rename(columns={"p50": "ttft_p50"})
+    by_model = by_model.merge(latency[["model"] + [f"p{p}" for p in PERCENTILES]], on="model", how="left")
+    by_model = by_model.merge(ttft[["model", "ttft_p50"]], on="model", how="left")
+
+    def cost_per_1k(row) -> Optional[float]:
+        price = price_for(row.model, prices)
+        if price is None or pd.isna(row.prompt_tokens):
+            return None
+        completion = 0.0 if pd.isna(row.completion_tokens) else row.completion_tokens
+        return 1000 * (row.prompt_tokens * price[0] + completion * price[1]) / 1e6
+
+    # Averages of columns that are all NULL (files without usage or retries) come back as objects
+    token_columns = ["prompt_tokens", "completion_tokens", "tokens_per_row", "retries_per_row"]
+    by_model[token_columns] = by_model[token_columns].astype(float)
+    by_model["usd_per_1k"] = pd.Series([cost_per_1k(row) for row in by_model.itertuples(index=False)], dtype=float)
+    by_model["rps_at_c"] = concurrency * 1000.0 / by_model["mean_ms"]
+    by_model = by_model[["model", "rows", "accuracy", "error_rate", "retries_per_row", "fallback_rate"] + [f"p{p}" for p in PERCENTILES]
+                        + ["mean_ms", "ttft_p50", "tokens_per_row", "prompt_tokens", "completion_tokens", "usd_per_1k", "rps_at_c"]]
+
+    accuracy = store.query(
+        "SELECT model, expected_tool_name, COUNT(*) AS rows, AVG(passed) AS accuracy "
+        f"FROM results {where} GROUP BY model, expected_tool_name", params)
+    by_tool = store.percentiles("latency_ms", ("model", "expected_tool_name"), PERCENTILES, run_ids, models)
+    by_tool = accuracy.merge(by_tool.drop(columns=["rows", "mean"]), on=["model", "expected_tool_name"], how="left")
+    return by_model, by_tool.sort_values(["expected_tool_name", "model"]).reset_index(drop=True)
+
+
+def format_table(df: pd.DataFrame) -> str:
+    return df.to_string(index=False, na_rep="n/a", float_format=lambda v: f"{v:,.3f}" if abs(v) < 10 else f"{v:,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency percentile, token and cost comparison of evaluation results.")
+    parser.add_argument('results_csv', nargs='*', help='Results CSV files, per-model or combined (default: results_*.csv).')
+    parser.add_argument('--results_db', type=str, default=None, help='Report on this results store instead of CSV files.')
+    parser.add_argument('--run_id', action='append', default=None, help='With --results_db: restrict to these runs (repeatable).')
+    parser.add_argument('--model', action='append', default=None, help='Restrict to these models (repeatable).')
+    parser.add_argument('--concurrency', type=int, default=1, help='In-flight requests assumed for the throughput estimate.')
+    parser.add_argument('--prices', type=str, default=None, help='JSON file of {"model": [prompt, completion]} USD per 1M tokens, merged over the built-in prices.')
+    parser.add_argument('--output_csv', type=str, default=None, help='Also write the per-model table to this CSV.')
+    args = parser.parse_args()
+
+    if args.results_db:
+        store = ResultsStore(args.results_db)
+    else:
+        # CSVs are loaded into an in-memory store so both sources share the same SQL aggregates
+        store = ResultsStore(":memory:")
+        for path in args.results_csv or sorted(glob.glob("results_*.csv")):
+            store.import_csv(path)
+    try:
+        by_model, by_tool = build_report(store, args.run_id, args.model, args.concurrency, load_prices(args.prices))
+    finally:
+        store.close()
+
+    print(f"--- Per model (latency in ms, throughput at concurrency {args.concurrency}) ---")
+    print(format_table(by_model))
+    print("\n--- Per expected tool ---")
+    print(format_table(by_tool))
+    if args.output_csv:
+        by_model.to_csv(args.output_csv, index=False)
+        print(f"\nReport saved to: {args.output_csv}")
+
+
+if __name__ == "__main__":
+    main()
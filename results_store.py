@@ -0,0 +1,331 @@
+import argparse
+import json
+import math
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+DEFAULT_RESULTS_DB = "results.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    source TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    input TEXT,
+    expected_tool_name TEXT,
+    expected_tool_args TEXT,
+    evaluation_result TEXT,
+    passed INTEGER,
+    matched_tool_name TEXT,
+    matched_tool_args TEXT,
+    tool_call_count INTEGER,
+    output TEXT,
+    latency_ms REAL,
+    ttft_ms REAL,
+    chatbot_ms REAL,
+    tools_ms REAL,
+    loop_iterations INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    execution_success INTEGER,
+    error TEXT,
+    retries INTEGER,
+    rate_limit_wait_ms REAL,
+    fallback_model TEXT,
+    PRIMARY KEY (run_id, model, row_index)
+);
+CREATE INDEX IF NOT EXISTS results_by_model ON results (model, expected_tool_name);
+CREATE INDEX IF NOT EXISTS results_by_tool ON results (expected_tool_name);
+CREATE TABLE IF NOT EXISTS tool_calls (
+    run_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    call_idx INTEGER NOT NULL,
+    name TEXT,
+    args TEXT,
+    matched INTEGER,
+    PRIMARY KEY (run_id, model, row_index, call_idx)
+);
+CREATE INDEX IF NOT EXISTS tool_calls_by_name ON tool_calls (name);
+"""
+
+RESULT_FIELDS = (
+    "run_id", "model", "row_index", "input", "expected_tool_name", "expected_tool_args", "evaluation_result",
+    "passed", "matched_tool_name", "matched_tool_args", "tool_call_count", "output", "latency_ms", "ttft_ms",
+    "chatbot_ms", "tools_ms", "loop_iterations", "prompt_tokens", "completion_tokens", "total_tokens",
+    "execution_success", "error", "retries", "rate_limit_wait_ms", "fallback_model",
+)
+# Columns added to results after its first version, with their types, for existing databases
+ADDED_COLUMNS = (("retries", "INTEGER"), ("rate_limit_wait_ms", "REAL"), ("fallback_model", "TEXT"))
+# Columns that may be used to group or measure in the aggregate queries
+GROUP_COLUMNS = ("run_id", "model", "expected_tool_name", "evaluation_result", "execution_success", "fallback_model")
+MEASURE_COLUMNS = ("latency_ms", "ttft_ms", "chatbot_ms", "tools_ms", "loop_iterations",
+                   "prompt_tokens", "completion_tokens", "total_tokens", "retries", "rate_limit_wait_ms")
+
+
+def _missing(value: Any) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value)) or value == ""
+
+
+def _json(value: Any, default: Any) -> Any:
+    """Decode a JSON cell; lists and dicts (live results) pass through unchanged."""
+    if isinstance(value, (list, dict)):
+        return value
+    if _missing(value):
+        return default
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _number(value: Any) -> Optional[float]:
+    if _missing(value):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _flag(value: Any) -> Optional[int]:
+    if _missing(value):
+        return None
+    return int(str(value).lower() in ("true", "1"))
+
+
+def normalize_result(run_id: str, model: str, row_index: int, result: Dict[str, Any]) -> Tuple[tuple, List[tuple]]:
+    """
+    Split one result row (as evaluate writes it, JSON strings or decoded) into a typed results
+    row and its tool_calls rows.
+    """
+    calls = _json(result.get("actual_tool_calls"), [])
+    calls = calls if isinstance(calls, list) else []
+    matched = _json(result.get("matched_tool_call"), None)
+    matched = matched if isinstance(matched, dict) else None
+    usage = _json(result.get("token_usage"), None) or {}
+    prompt_tokens = _number(usage.get("prompt_tokens")) if isinstance(usage, dict) else None
+    completion_tokens = _number(usage.get("completion_tokens")) if isinstance(usage, dict) else None
+    total_tokens = _number(usage.get("total_tokens")) if isinstance(usage, dict) else None
+    matched_idx = None
+    if matched is not None:
+        for idx, call in enumerate(calls):
+            if isinstance(call, dict) and call.get("name") == matched.get("name") and call.get("args") == matched.get("args"):
+                matched_idx = idx
+                break
+    evaluation_result = result.get("evaluation_result")
+    iterations = _number(result.get("loop_iterations"))
+    retries = _number(result.get("retries"))
+    row = (
+        run_id, model, row_index,
+        None if _missing(result.get("input")) else str(result.get("input")),
+        None if _missing(result.get("expected_tool_name")) else str(result.get("expected_tool_name")),
+        None if _missing(result.get("expected_tool_args")) else
+        (result["expected_tool_args"] if isinstance(result["expected_tool_args"], str) else json.dumps(result["expected_tool_args"])),
+        evaluation_result,
+        None if _missing(evaluation_result) else int(evaluation_result == "PASS"),
+        matched.get("name") if matched else None,
+        json.dumps(matched.get("args")) if matched else None,
+        len(calls),
+        None if _missing(result.get("output")) else str(result.get("output")),
+        _number(result.get("latency_ms")),
+        _number(result.get("ttft_ms")),
+        _number(result.get("chatbot_ms")),
+        _number(result.get("tools_ms")),
+        int(iterations) if iterations is not None else None,
+        int(prompt_tokens) if prompt_tokens is not None else None,
+        int(completion_tokens) if completion_tokens is not None else None,
+        int(total_tokens) if total_tokens is not None else None,
+        _flag(result.get("execution_success")),
+        None if _missing(result.get("error")) else str(result.get("error")),
+        int(retries) if retries is not None else None,
+        _number(result.get("rate_limit_wait_ms")),
+        None if _missing(result.get("fallback_model")) else str(result.get("fallback_model")),
+    )
+    call_rows = [
+        (run_id, model, row_index, idx, call.get("name") if isinstance(call, dict) else None,
+         json.dumps(call.get("args")) if isinstance(call, dict) else json.dumps(call), int(idx == matched_idx))
+        for idx, call in enumerate(calls)
+    ]
+    return row, call_rows
+
+
+def model_from_path(path: str) -> str:
+    """Model label of a per-model results file: results_gpt4o.csv -> gpt4o."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem[len("results_"):] if stem.startswith("results_") else stem
+
+
+class ResultsStore:
+    """
+    Evaluation results in an indexed SQLite database, one row per (run, model, input).
+
+    Tool calls and token usage are stored as typed columns (results) and one row per call
+    (tool_calls, arguments as JSON for json_extract), so cross-model and cross-run aggregates
+    are single queries. Rows are committed as they are added, like the results CSVs.
+    """
+
+    def __init__(self, path: str = DEFAULT_RESULTS_DB):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        with self._conn:
+            for column, kind in ADDED_COLUMNS:
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE results ADD COLUMN {column} {kind}")
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def start_run(self, run_id: Optional[str] = None, source: Optional[str] = None, **config: Any) -> str:
+        """Register a run (or continue an existing run_id) and return its id."""
+        run_id = run_id or datetime.now().strftime("%Y%m%dT%H%M%S-") + uuid.uuid4().hex[:6]
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO runs (run_id, created_at, source, config) VALUES (?, ?, ?, ?)",
+                               (run_id, datetime.now().isoformat(timespec="seconds"), source, json.dumps(config)))
+        return run_id
+
+    def add_results(self, run_id: str, model: str, rows: Iterable[Tuple[int, Dict[str, Any]]]) -> int:
+        """Store (row_index, result) pairs of one model; a row stored again replaces the old one."""
+        results, calls = [], []
+        for row_index, result in rows:
+            row, call_rows = normalize_result(run_id, model, row_index, result)
+            results.append(row)
+            calls.extend(call_rows)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM tool_calls WHERE run_id = ? AND model = ? AND row_index = ?",
+                [(run_id, model, row[2]) for row in results])
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO results ({', '.join(RESULT_FIELDS)}) VALUES ({', '.join('?' * len(RESULT_FIELDS))})",
+                results)
+            self._conn.executemany("INSERT INTO tool_calls VALUES (?, ?, ?, ?, ?, ?, ?)", calls)
+        return len(results)
+
+    def add_result(self, run_id: str, model: str, row_index: int, result: Dict[str, Any]) -> None:
+        self.add_results(run_id, model, [(row_index, result)])
+
+    def import_csv(self, path: str, model: Optional[str] = None, run_id: Optional[str] = None) -> str:
+        """
+        Load a results CSV into a new run. Combined matrix tables keep their "model" column;
+        otherwise the model defaults to the file name (results_gpt4o.csv -> gpt4o).
+        """
+        df = pd.read_csv(path, engine="python")
+        run_id = self.start_run(run_id, source=os.path.abspath(path))
+        if "model" in df.columns and model is None:
+            for model_name, group in df.groupby("model", sort=False):
+                self.add_results(run_id, str(model_name), enumerate(group.to_dict("records")))
+        else:
+            self.add_results(run_id, model or model_from_path(path), enumerate(df.to_dict("records")))
+        return run_id
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=list(params))
+
+    def runs(self) -> pd.DataFrame:
+        return self.query(
+            "SELECT r.run_id, r.created_at, r.source, GROUP_CONCAT(DISTINCT x.model) AS models, COUNT(x.row_index) AS rows "
+            "FROM runs r LEFT JOIN results x ON x.run_id = r.run_id GROUP BY r.run_id ORDER BY r.created_at")
+
+    @staticmethod
+    def filter_clause(run_ids: Optional[Sequence[str]], models: Optional[Sequence[str]]) -> Tuple[str, List[Any]]:
+        """SQL condition (without WHERE) and parameters selecting the given runs and models."""
+        clauses, params = [], []
+        if run_ids:
+            clauses.append(f"run_id IN ({', '.join('?' * len(run_ids))})")
+            params.extend(run_ids)
+        if models:
+            clauses.append(f"model IN ({', '.join('?' * len(models))})")
+            params.extend(models)
+        return (" AND ".join(clauses), params)
+
+    def results(self, run_ids: Optional[Sequence[str]] = None, models: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Result rows with their tool calls decoded into an actual_tool_calls list, for score_results."""
+        where, params = self.filter_clause(run_ids, models)
+        df = self.query(f"SELECT * FROM results {'WHERE ' + where if where else ''} ORDER BY run_id, model, row_index", params)
+        calls = self.query(f"SELECT run_id, model, row_index, name, args FROM tool_calls {'WHERE ' + where if where else ''} "
+                           "ORDER BY run_id, model, row_index, call_idx", params)
+        by_row: Dict[tuple, List[Dict[str, Any]]] = {}
+        for call in calls.itertuples(index=False):
+            by_row.setdefault((call.run_id, call.model, call.row_index), []).append(
+                {"name": call.name, "args": json.loads(call.args) if call.args else None})
+        df["actual_tool_calls"] = [by_row.get(key, []) for key in zip(df["run_id"], df["model"], df["row_index"])]
+        return df
+
+    def accuracy_by_tool(self, run_ids: Optional[Sequence[str]] = None, models: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Rows, passes and accuracy per model and expected tool."""
+        where, params = self.filter_clause(run_ids, models)
+        return self.query(
+            "SELECT model, expected_tool_name, COUNT(*) AS rows, SUM(passed) AS passed, AVG(passed) AS accuracy "
+            f"FROM results {'WHERE ' + where if where else ''} "
+            "GROUP BY model, expected_tool_name ORDER BY model, expected_tool_name", params)
+
+    def percentiles(self, column: str = "latency_ms", group_by: Sequence[str] = ("model",),
+                    percentiles: Sequence[int] = (50, 90, 99), run_ids: Optional[Sequence[str]] = None,
+                    models: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Nearest-rank percentiles (plus count and mean) of a measure column per group, in one query."""
+        if column not in MEASURE_COLUMNS:
+            raise ValueError(f"Unknown measure column '{column}', expected one of {MEASURE_COLUMNS}.")
+        unknown = set(group_by) - set(GROUP_COLUMNS)
+        if unknown:
+            raise ValueError(f"Cannot group by {sorted(unknown)}, expected columns from {GROUP_COLUMNS}.")
+        groups = ", ".join(group_by)
+        where, params = self.filter_clause(run_ids, models)
+        partition = f"PARTITION BY {groups}" if groups else ""
+        selected = f"{groups}, " if groups else ""
+        points = ", ".join(
+            f"MAX(CASE WHEN rn = MAX(1, ({int(p)} * n + 99) / 100) THEN {column} END) AS p{int(p)}" for p in percentiles)
+        return self.query(
+            f"WITH ranked AS (SELECT {selected}{column}, "
+            f"ROW_NUMBER() OVER ({partition} ORDER BY {column}) AS rn, COUNT(*) OVER ({partition}) AS n "
+            f"FROM results WHERE {column} IS NOT NULL{' AND ' + where if where else ''}) "
+            f"SELECT {selected}COUNT(*) AS rows, AVG({column}) AS mean, {points} FROM ranked "
+            f"{'GROUP BY ' + groups + ' ORDER BY ' + groups if groups else ''}", params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import results CSVs into the SQLite results store and query it.")
+    parser.add_argument('--db', type=str, default=DEFAULT_RESULTS_DB, help='Results database path.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='Import results CSVs, one run per file.')
+    import_parser.add_argument('results_csv', nargs='+', help='Results CSV files (per-model or combined matrix tables).')
+    import_parser.add_argument('--model', type=str, default=None, help='Model label for all files (default: from the file name).')
+    subparsers.add_parser('runs', help='List the stored runs.')
+    summary_parser = subparsers.add_parser('summary', help='Accuracy per tool and latency percentiles per model.')
+    summary_parser.add_argument('--run_id', action='append', default=None, help='Restrict to these runs (repeatable).')
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    try:
+        if args.command == 'import':
+            for path in args.results_csv:
+                run_id = store.import_csv(path, model=args.model)
+                print(f"Imported {path} as run {run_id}")
+        elif args.command == 'runs':
+            print(store.runs().to_string(index=False))
+        else:
+            print(store.accuracy_by_tool(run_ids=args.run_id).to_string(index=False))
+            print()
+            print(store.percentiles("latency_ms", run_ids=args.run_id).to_string(index=False))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
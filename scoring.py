@@ -0,0 +1,353 @@
+import json
+import math
+import os
+import re
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# --- Define Tool Default Arguments ---
+TOOL_DEFAULTS = {
+    "create_calendar_event": {
+        "timezone": "Europe/Amsterdam"
+    },
+    "get_calendar_events": {
+        "calendar_id": "primary",
+        "max_results": 10,
+        "order_by": "startTime",
+        "time_zone": "Europe/Amsterdam", # Note: Tool uses time_zone, not timezone
+    },
+    "get_calendar_event": {
+        "calendar_id": "primary",
+        "timezone": "Europe/Amsterdam"
+    },
+    "delete_calendar_event": {},
+    "find_free_slots": {
+        "duration_minutes": 30,
+        "working_hours_start": "09:00",
+        "working_hours_end": "17:00",
+        "include_weekends": False,
+        "max_results": 10,
+        "time_zone": "Europe/Amsterdam",
+    }
+}
+# ---
+
+DATETIME_KEYS = ("start_datetime", "end_datetime")
+END_OF_DAY = timedelta(hours=23, minutes=59, seconds=59)
+# Matches a trailing UTC offset after the time part ("Z", "+02:00", "-0500"); offsets are
+# dropped so datetimes compare on wall-clock time, like the original fromisoformat matcher
+_TZ_SUFFIX_RE = re.compile(r'([T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)(?:Z|[+-]\d{2}:?\d{2})$')
+_NUMBER_TYPES = ("int", "float", "bool")
+_SCALAR_TYPES = ("str", "int", "float", "bool")
+
+_MISSING = object()
+
+ARGUMENT_COLUMNS = ["row", "call_idx", "key", "expected_value", "actual_value", "present", "arg_match"]
+
+
+def _load_json(value: Any, default: Any) -> Any:
+    """Decode a JSON cell. Lists and dicts (e.g. live tool calls) are passed through unchanged."""
+    if isinstance(value, (list, dict)):
+        return value
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value == "":
+        return default
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _factorize_json(values: pd.Series, default: Any) -> tuple:
+    """
+    Decode a column of JSON cells, parsing each distinct cell only once (archived results
+    repeat the same expected args and tool calls many times).
+    Returns (codes, decoded) where decoded[codes[i]] is the value of row i.
+    """
+    try:
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    except TypeError:
+        # Already-decoded lists/dicts (live tool calls) are unhashable; decode row by row
+        return np.arange(len(values)), [_load_json(v, default) for v in values]
+    return codes, [_load_json(u, default) for u in uniques]
+
+
+def _canonical_json(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def normalize_tool_calls(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Explode the actual_tool_calls column into one row per tool call.
+    Returns columns: row (position in df), call_idx, name, args (dict), call (original dict).
+    """
+    codes, decoded = _factorize_json(df["actual_tool_calls"], [])
+    records = []
+    for code, calls in enumerate(decoded):
+        if not isinstance(calls, list):
+            continue
+        for call_idx, call in enumerate(c for c in calls if isinstance(c, dict)):
+            args = call.get("args") if isinstance(call.get("args"), dict) else {}
+            records.append((code, call_idx, call.get("name"), args, call))
+    unique_calls = pd.DataFrame(records, columns=["code", "call_idx", "name", "args", "call"])
+    rows = pd.DataFrame({"row": np.arange(len(df), dtype=np.int64), "code": codes})
+    return rows.merge(unique_calls, on="code", how="inner").drop(columns="code")
+
+
+def normalize_expected_args(df: pd.DataFrame) -> pd.DataFrame:
+    """Explode expected_tool_args into one row per expected (row, key, expected_value)."""
+    codes, decoded = _factorize_json(df["expected_tool_args"], None)
+    records = [
+        (code, key, value)
+        for code, args in enumerate(decoded) if isinstance(args, dict)
+        for key, value in args.items()
+    ]
+    unique_args = pd.DataFrame(records, columns=["code", "key", "expected_value"]).astype({"expected_value": object})
+    rows = pd.DataFrame({"row": np.arange(len(df), dtype=np.int64), "code": codes})
+    return rows.merge(unique_args, on="code", how="inner").drop(columns="code")
+
+
+def _parse_datetime(text: str) -> Optional[datetime]:
+    """Naive wall-clock datetime of an ISO string (None if unparseable)."""
+    try:
+        parsed = datetime.fromisoformat(_TZ_SUFFIX_RE.sub(r'\1', text))
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=None)
+
+
+def _value_matches(key: str, expected: Any, actual: Any) -> bool:
+    """Match for an argument the model provided."""
+    # Explicit None: only matches an expected None
+    if actual is None:
+        return expected is None
+    # Datetimes: exact wall-clock match, or 23:59:59 vs 00:00:00 next day for end_datetime
+    if key in DATETIME_KEYS:
+        exp_str, act_str = str(expected), str(actual)
+        dt_exp, dt_act = _parse_datetime(exp_str), _parse_datetime(act_str)
+        if dt_exp is None or dt_act is None:
+            # Fall back to string comparison when either side is not a datetime
+            return exp_str == act_str
+        if dt_exp == dt_act:
+            return True
+        if key != "end_datetime":
+            return False
+        d_exp, d_act = dt_exp.date(), dt_act.date()
+        t_exp, t_act = dt_exp - datetime.combine(d_exp, time()), dt_act - datetime.combine(d_act, time())
+        one_day = timedelta(days=1)
+        return ((t_exp == END_OF_DAY and not t_act and d_act == d_exp + one_day)
+                or (t_act == END_OF_DAY and not t_exp and d_exp == d_act + one_day))
+    # Summary: case-insensitive, passes if one string starts with the other
+    if key == "summary":
+        a, e = str(actual).lower(), str(expected).lower()
+        return a.startswith(e) or e.startswith(a)
+    # Everything else: equality for same types (lists/dicts via canonical JSON), string equality across types
+    exp_type = type(expected).__name__
+    if exp_type != type(actual).__name__:
+        return str(expected) == str(actual)
+    if exp_type in _SCALAR_TYPES:
+        return bool(expected == actual)
+    return _canonical_json(expected) == _canonical_json(actual)
+
+
+def _to_number(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _default_matches(tool_name: str, key: str, expected: Any) -> bool:
+    """Match for an argument the model omitted: only OK if the expected value is the tool default."""
+    defaults = TOOL_DEFAULTS.get(tool_name, {})
+    if key not in defaults:
+        return False
+    default = defaults[key]
+    if key == "summary":
+        return str(expected).lower() == str(default).lower()
+    if str(expected) == str(default):
+        return True
+    # Numbers compare by value (10 == 10.0)
+    if type(expected).__name__ not in _NUMBER_TYPES:
+        return False
+    exp_number, default_number = _to_number(expected), _to_number(default)
+    return exp_number is not None and default_number is not None and exp_number == default_number
+
+
+def argument_matches(tool_name: str, args: Dict[str, Any], key: str, expected: Any) -> bool:
+    """
+    Whether a tool call's args satisfy one expected argument. These are the matching rules of
+    both score_results and match_tool_calls.
+    """
+    return _value_matches(key, expected, args[key]) if key in args else _default_matches(tool_name, key, expected)
+
+
+def _memoized_matches(rows: List[tuple]) -> Iterator[bool]:
+    """argument_matches for (tool_name, args, key, expected) rows, computed once per distinct comparison."""
+    seen: Dict[tuple, bool] = {}
+    for name, args, key, expected in rows:
+        actual = args.get(key, _MISSING)
+        # Types are part of the key, so 1, 1.0 and True are not conflated
+        memo_key = (name, key, type(expected), expected, type(actual), actual)
+        try:
+            match = seen.get(memo_key)
+        except TypeError:
+            # Lists and dicts are not hashable
+            yield argument_matches(name, args, key, expected)
+            continue
+        if match is None:
+            match = seen[memo_key] = argument_matches(name, args, key, expected)
+        yield match
+
+
+def score_arguments(df: pd.DataFrame, calls: Optional[pd.DataFrame] = None,
+                    expected: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    Per-argument comparison for every tool call whose name matches the expected tool.
+    Returns one row per (row, call_idx, key) with columns ARGUMENT_COLUMNS.
+    """
+    df = df.reset_index(drop=True)
+    if calls is None:
+        calls = normalize_tool_calls(df)
+    if expected is None:
+        expected = normalize_expected_args(df)
+
+    expected_names = df["expected_tool_name"].to_numpy()
+    candidates = calls[calls["name"].to_numpy() == expected_names[calls["row"].to_numpy()]]
+    args = candidates[["row", "call_idx", "name", "args"]].merge(expected, on="row", how="inner")
+    if args.empty:
+        return pd.DataFrame(columns=ARGUMENT_COLUMNS)
+
+    rows = list(zip(args["name"].tolist(), args["args"].tolist(), args["key"].tolist(), args["expected_value"].tolist()))
+    args["present"] = np.fromiter((k in a for _, a, k, _ in rows), dtype=bool, count=len(rows))
+    args["actual_value"] = pd.Series([a.get(k) for _, a, k, _ in rows], dtype=object, index=args.index)
+    args["arg_match"] = np.fromiter(_memoized_matches(rows), dtype=bool, count=len(rows))
+    return args[ARGUMENT_COLUMNS]
+
+
+def score_results(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Score a whole results DataFrame (columns expected_tool_name, expected_tool_args,
+    actual_tool_calls; JSON strings or already-decoded lists/dicts).
+
+    Returns a copy of df with these columns added or replaced:
+        tool_name_match:          any tool call used the expected tool
+        first_call_name_match:    the first tool call used the expected tool
+        first_call_args_complete: the first tool call contains every expected argument key
+        evaluation_result:        "PASS" if any call matches the expected tool and all its arguments
+        matched_tool_call:        the first matching call as a JSON string, else None
+    """
+    out = df.reset_index(drop=True).copy()
+    n = len(out)
+    calls = normalize_tool_calls(out)
+    expected = normalize_expected_args(out)
+    arguments = score_arguments(out, calls, expected)
+
+    expected_names = out["expected_tool_name"].to_numpy()
+    call_rows = calls["row"].to_numpy()
+    calls["name_match"] = calls["name"].to_numpy() == expected_names[call_rows] if len(calls) else np.zeros(0, dtype=bool)
+
+    # A call passes when its name matches and none of its expected arguments failed
+    failed = arguments.loc[~arguments["arg_match"].astype(bool), ["row", "call_idx"]].drop_duplicates()
+    failed_index = pd.MultiIndex.from_frame(failed) if len(failed) else pd.MultiIndex.from_arrays([[], []])
+    call_index = pd.MultiIndex.from_frame(calls[["row", "call_idx"]])
+    calls["passed"] = calls["name_match"].to_numpy() & ~call_index.isin(failed_index)
+
+    tool_name_match = np.zeros(n, dtype=bool)
+    tool_name_match[call_rows[calls["name_match"].to_numpy()]] = True
+    out["tool_name_match"] = tool_name_match
+
+    first_calls = calls[calls["call_idx"] == 0]
+    first_rows = first_calls["row"].to_numpy()
+    first_call_name_match = np.zeros(n, dtype=bool)
+    first_call_name_match[first_rows] = first_calls["name_match"].to_numpy()
+    out["first_call_name_match"] = first_call_name_match
+
+    # Every expected key present in the first call's args (regardless of tool name)
+    codes, decoded = _factorize_json(out["expected_tool_args"], None)
+    expected_is_dict = np.array([isinstance(e, dict) for e in decoded], dtype=bool)[codes] if n else np.zeros(0, dtype=bool)
+    first_args_is_dict = np.zeros(n, dtype=bool)
+    first_args_is_dict[first_rows] = first_calls["call"].map(lambda c: isinstance(c.get("args"), dict)).to_numpy(dtype=bool)
+    first_keys = first_calls[["row", "call"]].merge(expected[["row", "key"]], on="row", how="inner")
+    key_missing = np.fromiter(
+        (not isinstance(c.get("args"), dict) or k not in c["args"] for c, k in zip(first_keys["call"].tolist(), first_keys["key"].tolist())),
+        dtype=bool, count=len(first_keys),
+    )
+    any_missing = np.zeros(n, dtype=bool)
+    any_missing[first_keys["row"].to_numpy()[key_missing]] = True
+    out["first_call_args_complete"] = expected_is_dict & first_args_is_dict & ~any_missing
+
+    passed = calls[calls["passed"]].drop_duplicates(subset="row", keep="first")
+    matched = pd.Series([None] * n, dtype=object)
+    matched.iloc[passed["row"].to_numpy()] = [
+        json.dumps({"name": c.get("name"), "args": a}) for c, a in zip(passed["call"].tolist(), passed["args"].tolist())
+    ]
+    out["matched_tool_call"] = matched
+    out["evaluation_result"] = np.where(matched.notna(), "PASS", "FAIL")
+    return out
+
+
+def match_tool_calls(actual_tool_calls: List[Dict[str, Any]], expected_tool_name: str, expected_tool_args: Dict[str, Any]) -> tuple:
+    """
+    Compare the actual tool calls of one row against the expected one, with the rules of
+    score_results (argument_matches) but without building DataFrames.
+    Returns (evaluation_result, matched_tool_call) where evaluation_result is "PASS" or "FAIL".
+    """
+    calls = _load_json(actual_tool_calls, [])
+    expected = _load_json(expected_tool_args, None)
+    expected_items = list(expected.items()) if isinstance(expected, dict) else []
+    for call in calls if isinstance(calls, list) else []:
+        if not isinstance(call, dict) or call.get("name") != expected_tool_name:
+            continue
+        args = call.get("args") if isinstance(call.get("args"), dict) else {}
+        if all(argument_matches(expected_tool_name, args, key, value) for key, value in expected_items):
+            # Round-tripped like score_results' matched_tool_call column
+            return "PASS", json.loads(json.dumps({"name": call.get("name"), "args": args}))
+    return "FAIL", None
+
+
+def rescore_file(input_path: str, output_path: str, chunksize: int = 50000) -> Dict[str, Any]:
+    """
+    Re-apply the current matching rules to a stored results CSV without calling any model.
+    The file is streamed in chunks; output_path receives the same columns with updated
+    evaluation_result and matched_tool_call. Returns a summary dict for the file.
+    """
+    rows = pass_before = pass_after = changed = 0
+    tmp_path = f"{output_path}.tmp"
+    header = True
+    for chunk in pd.read_csv(input_path, engine='python', chunksize=chunksize):
+        columns = list(chunk.columns)
+        chunk = chunk.dropna(subset=["expected_tool_name", "expected_tool_args"]).reset_index(drop=True)
+        if "actual_tool_calls" not in chunk:
+            chunk["actual_tool_calls"] = None
+            columns.append("actual_tool_calls")
+        before = chunk["evaluation_result"] if "evaluation_result" in chunk else pd.Series(["FAIL"] * len(chunk))
+        scored = score_results(chunk)
+        after = scored["evaluation_result"]
+        for column in ("evaluation_result", "matched_tool_call"):
+            if column not in columns:
+                columns.append(column)
+
+        rows += len(chunk)
+        pass_before += int((before == "PASS").sum())
+        pass_after += int((after == "PASS").sum())
+        changed += int((before.to_numpy() != after.to_numpy()).sum())
+        scored[columns].to_csv(tmp_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+    if header:
+        # Empty input: still produce an (empty) output file
+        pd.read_csv(input_path, nrows=0).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+
+    return {
+        "file": input_path,
+        "output": output_path,
+        "rows": rows,
+        "pass_before": pass_before,
+        "pass_after": pass_after,
+        "changed": changed,
+        "accuracy_before": pass_before / rows if rows else 0.0,
+        "accuracy_after": pass_after / rows if rows else 0.0,
+    }
@@ -0,0 +1,293 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+from langchain_core.messages import AIMessage
+
+from calendar_tools import CALENDAR_BACKENDS, configure_calendar_backend
+from instrumentation import MetricsCallbackHandler, PrometheusExporter, make_exporter
+from llm_cache import CACHE_MODES, DEFAULT_CACHE_DIR
+from main import GRAPH_MODES, build_graph, build_initial_messages, get_trace_handler, trace_config
+from prompts import TOOL_SCHEMA_MODES
+from providers import configure_providers
+from streaming import stream_events
+from tracing import TRACE_BACKENDS
+
+DEFAULT_MODEL = "qwen/qwen3-32b"
+
+
+class UnknownModelError(ValueError):
+    """A request named a model the server was not started with."""
+
+
+def split_models(spec: Optional[str]) -> List[str]:
+    return [m.strip() for m in (spec or "").split(",") if m.strip()]
+
+
+class GraphPool:
+    """
+    Compiled graphs per model identifier, built on first use and reused for every request.
+    All models share one pooled httpx.Client, so TLS connections to the provider stay open
+    between requests. Only allowed_models are ever built: the model comes from the request
+    body, and every new name would otherwise add a graph, metrics handler and model client.
+    """
+
+    def __init__(self, allowed_models: Sequence[str] = (DEFAULT_MODEL,), cache_mode: str = "off",
+                 cache_dir: str = DEFAULT_CACHE_DIR, max_connections: int = 100,
+                 metrics_file: Optional[str] = None, graph_mode: str = "default", trace_backend: str = "auto",
+                 trace_file: Optional[str] = None, fallback_model: Optional[str] = None, tool_schema: str = "full",
+                 resolve_dates: bool = False):
+        self.allowed_models = frozenset(allowed_models)
+        self.cache_mode = cache_mode
+        self.tool_schema = tool_schema
+        self.resolve_dates = resolve_dates
+        self.fallback_model = fallback_model
+        self.graph_mode = graph_mode
+        self.cache_dir = cache_dir
+        # Served on GET /metrics; metrics_file additionally gets every invocation
+        self.prometheus = PrometheusExporter()
+        self.exporters = [self.prometheus] + ([make_exporter(metrics_file)] if metrics_file else [])
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(120.0, connect=10.0),
+        )
+        self.trace_handler = get_trace_handler(trace_backend, trace_file)
+        self._graphs: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_identifier: str) -> Any:
+        graph = self._graphs.get(model_identifier)
+        if graph is None:
+            if model_identifier not in self.allowed_models:
+                raise UnknownModelError(f"Model '{model_identifier}' is not served here; "
+                                        f"available models: {', '.join(sorted(self.allowed_models))}.")
+            with self._lock:
+                graph = self._graphs.get(model_identifier)
+                if graph is None:
+                    graph = build_graph(model_identifier, cache_mode=self.cache_mode, cache_dir=self.cache_dir,
+                                        http_client=self.http_client,
+                                        metrics=MetricsCallbackHandler(model_identifier, self.exporters),
+                                        graph_mode=self.graph_mode, fallback_model=self.fallback_model,
+                                        tool_schema=self.tool_schema, resolve_dates=self.resolve_dates)
+                    self._graphs[model_identifier] = graph
+        return graph
+
+    @property
+    def models(self) -> List[str]:
+        return list(self._graphs)
+
+    def close(self) -> None:
+        self.http_client.close()
+
+
+def _serialize_message(message: Any) -> Dict[str, Any]:
+    data = {"type": message.type, "content": message.content}
+    if getattr(message, "tool_calls", None):
+        data["tool_calls"] = [{"name": tc.get("name"), "args": tc.get("args")} for tc in message.tool_calls]
+    return data
+
+
+def run_chat(pool: GraphPool, message: str, model_identifier: str) -> Dict[str, Any]:
+    """Run one chat turn through the warm graph for model_identifier."""
+    graph = pool.get(model_identifier)
+    start_time = time.time()
+    state = graph.invoke(
+        {"messages": build_initial_messages(model_identifier, message)},
+        config=trace_config(pool.trace_handler),
+    )
+    latency_ms = int((time.time() - start_time) * 1000)
+
+    messages = state["messages"]
+    tool_calls = [tc for m in messages if isinstance(m, AIMessage) for tc in _serialize_message(m).get("tool_calls", [])]
+    final = messages[-1] if messages else None
+    return {
+        "model": model_identifier,
+        "output": final.content if isinstance(final, AIMessage) else "",
+        "tool_calls": tool_calls,
+        "messages": [_serialize_message(m) for m in messages],
+        "latency_ms": latency_ms,
+    }
+
+
+def stream_chat(pool: GraphPool, message: str, model_identifier: str) -> Any:
+    """Run one chat turn with token streaming; yields the events of streaming.stream_events."""
+    graph = pool.get(model_identifier)
+    for event in stream_events(graph, {"messages": build_initial_messages(model_identifier, message)},
+                               config=trace_config(pool.trace_handler)):
+        if event["type"] == "done":
+            event["model"] = model_identifier
+        yield event
+
+
+class ChatRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /chat   {"message": "...", "model": "..."}  -> chat result as JSON
+    POST /chat/stream  (same body)                    -> newline-delimited JSON events, chunked
+    GET  /health                                      -> {"status": "ok", "models": [...], "allowed_models": [...]}
+    GET  /metrics                                     -> Prometheus text format
+    """
+
+    server_version = "CalendarThesisServer/0.1"
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix-socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else "unix"
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "models": self.server.pool.models,
+                                  "allowed_models": sorted(self.server.pool.allowed_models)})
+        elif self.path == "/metrics":
+            body = self.server.pool.prometheus.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": f"Unknown path '{self.path}'"})
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_ndjson(self, events: Any, model_identifier: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for event in events:
+                self._write_chunk(json.dumps(event).encode("utf-8") + b"\n")
+        except Exception as e:
+            # Headers are already sent; report the failure as the last event
+            print(f"Error during streamed chat for model '{model_identifier}': {e}")
+            self._write_chunk(json.dumps({"type": "error", "model": model_identifier, "error": str(e)}).encode("utf-8") + b"\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self) -> None:
+        if self.path not in ("/chat", "/chat/stream"):
+            self._send_json(404, {"error": f"Unknown path '{self.path}'"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            message = request["message"]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Expected a JSON body with a 'message' field: {e}"})
+            return
+
+        model_identifier = request.get("model") or self.server.default_model
+        try:
+            # Before any streamed output, so an unknown model is a plain 400
+            self.server.pool.get(str(model_identifier))
+        except UnknownModelError as e:
+            self._send_json(400, {"model": model_identifier, "error": str(e)})
+            return
+        except Exception as e:
+            # e.g. OPENROUTER_API_KEY not set, or the client could not be constructed
+            print(f"Error building graph for model '{model_identifier}': {e}")
+            self._send_json(500, {"model": model_identifier, "error": str(e)})
+            return
+        if self.path == "/chat/stream":
+            self._stream_ndjson(stream_chat(self.server.pool, str(message), model_identifier), model_identifier)
+            return
+        try:
+            result = run_chat(self.server.pool, str(message), model_identifier)
+        except Exception as e:
+            print(f"Error during chat for model '{model_identifier}': {e}")
+            self._send_json(500, {"model": model_identifier, "error": str(e)})
+            return
+        self._send_json(200, result)
+
+
+class ChatHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Any, pool: GraphPool, default_model: str):
+        self.pool = pool
+        self.default_model = default_model
+        super().__init__(address, ChatRequestHandler)
+
+
+class ChatUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, pool: GraphPool, default_model: str):
+        self.pool = pool
+        self.default_model = default_model
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, ChatRequestHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the LangGraph chatbot over HTTP with warm, reusable graphs.")
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='Host to bind the HTTP server to.')
+    parser.add_argument('--port', type=int, default=8000, help='Port to bind the HTTP server to.')
+    parser.add_argument('--unix_socket', type=str, default=None, help='Serve on this Unix socket path instead of host/port.')
+    parser.add_argument('--model', type=str, default=DEFAULT_MODEL, help='Model used when a request does not specify one.')
+    parser.add_argument('--models', type=str, default=None, help='Comma-separated models clients may request besides --model and --fallback_model. Requests for any other model get 400.')
+    parser.add_argument('--preload', type=str, default=None, help='Comma-separated models whose graphs are built at startup (also allowed for requests).')
+    parser.add_argument('--max_connections', type=int, default=100, help='Size of the shared HTTP connection pool.')
+    parser.add_argument('--cache', type=str, choices=CACHE_MODES, default="off", help='On-disk LLM response cache mode.')
+    parser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='Directory for the LLM response cache.')
+    parser.add_argument('--no_trace', '--no-trace', action='store_true', help='Disable tracing (same as --trace_backend off).')
+    parser.add_argument('--trace_backend', type=str, choices=TRACE_BACKENDS, default="auto", help='Where traces go: "auto" uses Langfuse when LANGFUSE_PUBLIC_KEY/LANGFUSE_SECRET_KEY are set, else --trace_file if given, else none.')
+    parser.add_argument('--trace_file', type=str, default=None, help='JSON lines trace file for the file backend (default: traces.jsonl).')
+    parser.add_argument('--graph_mode', type=str, choices=GRAPH_MODES, default="default", help='"fast" runs read-only tools concurrently and answers pure retrieval turns from a template.')
+    parser.add_argument('--fallback_model', type=str, default=None, help='Model (or comma-separated chain) that answers when a model call still fails after retries, e.g. with OpenRouter\'s 404 "No endpoints found that support tool use".')
+    parser.add_argument('--rate_limits', type=str, default=None, help='Per-provider request rate limits in requests per second[:burst], e.g. "openrouter=4,openai=10:20". Unlimited by default.')
+    parser.add_argument('--max_retries', type=int, default=3, help='Retries of a model call on 429/5xx/connection errors, with jittered exponential backoff.')
+    parser.add_argument('--tool_schema', type=str, choices=TOOL_SCHEMA_MODES, default="full", help='"compact" sends trimmed tool schemas (first-sentence descriptions, no defaults) to cut prompt tokens.')
+    parser.add_argument('--resolve_dates', action='store_true', help='Resolve relative dates and times ("next Tuesday afternoon") locally and add the absolute ranges to the message.')
+    parser.add_argument('--metrics_file', type=str, default=None, help='Also write per-invocation metrics here (JSON lines, or Prometheus text for *.prom).')
+    parser.add_argument('--calendar_backend', type=str, choices=CALENDAR_BACKENDS, default="local", help='Backend behind the calendar tools.')
+    parser.add_argument('--calendar_root_url', type=str, default=None, help='Calendar API root URL for the google backend (e.g. a local fake API).')
+    parser.add_argument('--calendar_mirror_path', type=str, default=None, help='SQLite file for the mirror backend (default: .calendar_mirror.sqlite).')
+    args = parser.parse_args()
+
+    configure_calendar_backend(args.calendar_backend, root_url=args.calendar_root_url, mirror_path=args.calendar_mirror_path)
+    configure_providers(args.rate_limits, args.max_retries)
+
+    allowed_models = [args.model] + split_models(args.fallback_model) + split_models(args.models) + split_models(args.preload)
+    pool = GraphPool(allowed_models, cache_mode=args.cache, cache_dir=args.cache_dir, max_connections=args.max_connections,
+                     metrics_file=args.metrics_file, graph_mode=args.graph_mode,
+                     trace_backend="off" if args.no_trace else args.trace_backend, trace_file=args.trace_file,
+                     fallback_model=args.fallback_model, tool_schema=args.tool_schema,
+                     resolve_dates=args.resolve_dates)
+    for model_identifier in split_models(args.preload):
+        pool.get(model_identifier)
+
+    if args.unix_socket:
+        server = ChatUnixServer(args.unix_socket, pool, args.model)
+        print(f"Serving on unix socket {args.unix_socket}")
+    else:
+        server = ChatHTTPServer((args.host, args.port), pool, args.model)
+        print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from langchain_core.utils.json import parse_partial_json
+
+
+class ToolCallAccumulator:
+    """
+    Reassembles streamed tool-call chunks. Argument JSON arrives in fragments; after every
+    fragment the arguments received so far are parsed leniently, so callers can show
+    e.g. {"start_datetime": "2024-07-17 14"} before the model has finished the call.
+    """
+
+    def __init__(self):
+        # index -> {"id", "name", "args_text"}
+        self._calls: Dict[int, Dict[str, Any]] = {}
+
+    def reset(self) -> None:
+        self._calls.clear()
+
+    def calls(self) -> List[Dict[str, Any]]:
+        """The accumulated tool calls, in index order."""
+        return [{"id": c["id"], "name": c["name"], "args": c.get("args") or {}}
+                for _, c in sorted(self._calls.items())]
+
+    def add(self, chunk: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """Add one tool_call_chunk; returns (index, call state with the partially parsed args)."""
+        index = chunk.get("index") or 0
+        call = self._calls.setdefault(index, {"id": None, "name": "", "args_text": ""})
+        if chunk.get("id"):
+            call["id"] = chunk["id"]
+        if chunk.get("name"):
+            call["name"] += chunk["name"]
+        call["args_text"] += chunk.get("args") or ""
+        try:
+            call["args"] = parse_partial_json(call["args_text"]) if call["args_text"] else {}
+        except ValueError:
+            # Not parseable yet (e.g. only a key fragment); keep the last good parse
+            call.setdefault("args", {})
+        return index, call
+
+
+def stream_events(graph: Any, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run the graph with token streaming (stream_mode="messages") and yield flat events:
+      {"type": "token", "text": ...}                                   text as it is generated
+      {"type": "tool_call_delta", "index", "id", "name", "args"}       tool call args parsed so far
+      {"type": "tool_call", "id", "name", "args"}                      complete tool call
+      {"type": "tool_result", "name", "content"}                       tool output
+      {"type": "done", "output", "tool_calls", "latency_ms", "ttft_ms"}
+    ttft_ms is the time until the first streamed token or tool-call fragment.
+    """
+    start = time.perf_counter()
+    ttft_ms: Optional[float] = None
+    accumulator = ToolCallAccumulator()
+    tool_calls: List[Dict[str, Any]] = []
+    output = ""
+    text_parts: List[str] = []
+    current_id = None
+
+    def finish_response() -> Iterator[Dict[str, Any]]:
+        # End of one streamed model response: emit its complete tool calls
+        nonlocal output, text_parts
+        for call in accumulator.calls():
+            tool_calls.append(call)
+            yield {"type": "tool_call", **call}
+        accumulator.reset()
+        if text_parts:
+            output, text_parts = "".join(text_parts).strip(), []
+
+    for message, metadata in graph.stream(inputs, config=config, stream_mode="messages"):
+        if isinstance(message, AIMessageChunk):
+            if message.id != current_id:
+                yield from finish_response()
+                current_id = message.id
+            if ttft_ms is None and (message.content or message.tool_call_chunks):
+                ttft_ms = (time.perf_counter() - start) * 1000
+            if isinstance(message.content, str) and message.content:
+                text_parts.append(message.content)
+                yield {"type": "token", "text": message.content}
+            for chunk in message.tool_call_chunks:
+                index, call = accumulator.add(chunk)
+                yield {"type": "tool_call_delta", "index": index, "id": call["id"], "name": call["name"],
+                       "args": call["args"]}
+            continue
+        yield from finish_response()
+        current_id = None
+        if isinstance(message, AIMessage):
+            # Non-streamed response (e.g. replayed from the response cache)
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - start) * 1000
+            if message.content:
+                output = str(message.content).strip()
+                yield {"type": "token", "text": str(message.content)}
+            for call in message.tool_calls:
+                call = {"id": call.get("id"), "name": call.get("name"), "args": call.get("args") or {}}
+                tool_calls.append(call)
+                yield {"type": "tool_call", **call}
+        elif isinstance(message, ToolMessage):
+            yield {"type": "tool_result", "name": message.name, "content": message.content}
+
+    yield from finish_response()
+    yield {"type": "done", "output": output, "tool_calls": tool_calls,
+           "latency_ms": int((time.perf_counter() - start) * 1000),
+           "ttft_ms": int(ttft_ms) if ttft_ms is not None else None}
+
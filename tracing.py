@@ -0,0 +1,345 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from instrumentation import usage_from_result
+
+# "auto": Langfuse when its keys are set, else the trace file when one is given, else off
+TRACE_BACKENDS = ("auto", "off", "langfuse", "file")
+DEFAULT_TRACE_FILE = "traces.jsonl"
+LANGFUSE_PUBLIC_KEY = os.getenv("LANGFUSE_PUBLIC_KEY", "")
+LANGFUSE_SECRET_KEY = os.getenv("LANGFUSE_SECRET_KEY", "")
+LANGFUSE_HOST = os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com")
+
+# Queue and batching defaults of the background exporter
+MAX_QUEUE_SIZE = 10000
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0
+# Inputs and outputs are truncated to this many characters before they are queued
+MAX_FIELD_CHARS = 2000
+# Graph nodes recorded as spans; the runnables inside them are not traced individually
+TRACED_NODES = ("chatbot", "tools", "respond")
+
+
+class FileTraceSink:
+    """Appends spans as JSON lines to a local file, for offline runs."""
+
+    def __init__(self, path: str = DEFAULT_TRACE_FILE):
+        self.path = path
+
+    def export(self, records: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+
+    def close(self) -> None:
+        pass
+
+
+class LangfuseTraceSink:
+    """
+    Sends spans to Langfuse as traces, spans and generations. The client (and the langfuse
+    package) is created on the exporter thread at the first export, never on the request path.
+    """
+
+    def __init__(self, public_key: str, secret_key: str, host: str = LANGFUSE_HOST):
+        self.public_key = public_key
+        self.secret_key = secret_key
+        self.host = host
+        self._client = None
+
+    def export(self, records: List[Dict[str, Any]]) -> None:
+        if self._client is None:
+            from langfuse import Langfuse
+            self._client = Langfuse(public_key=self.public_key, secret_key=self.secret_key, host=self.host)
+        for record in records:
+            start = datetime.fromtimestamp(record["start_time"], timezone.utc)
+            end = datetime.fromtimestamp(record["end_time"], timezone.utc)
+            common = {"name": record["name"], "input": record.get("input"), "output": record.get("output"),
+                      "metadata": record.get("metadata")}
+            if record["kind"] == "trace":
+                self._client.trace(id=record["trace_id"], timestamp=start, **common)
+                continue
+            observation = {"id": record["span_id"], "trace_id": record["trace_id"],
+                           "parent_observation_id": record.get("parent_id"), "start_time": start,
+                           "end_time": end, "level": "ERROR" if record.get("error") else None,
+                           "status_message": record.get("error"), **common}
+            if record["kind"] == "generation":
+                usage = record.get("usage") or {}
+                self._client.generation(model=record.get("model"), usage_details={
+                    "input": usage.get("prompt_tokens", 0), "output": usage.get("completion_tokens", 0)}, **observation)
+            else:
+                self._client.span(**observation)
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.flush()
+
+
+class BatchExporter:
+    """
+    Non-blocking, batched export of span records to a sink on a background thread.
+
+    submit() never waits: records go into a bounded queue and are dropped (and counted) when
+    it is full. The thread sends batches of up to batch_size records, or whatever arrived
+    within flush_interval seconds. Sink errors are counted and never reach the caller.
+    """
+
+    def __init__(self, sink: Any, max_queue_size: int = MAX_QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.submitted = 0
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, record: Dict[str, Any]) -> bool:
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def _export(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        try:
+            self.sink.export(batch)
+            self.exported += len(batch)
+        except Exception as e:
+            if not self.failed:
+                print(f"Trace export to {type(self.sink).__name__} failed, continuing without it: {e}", file=sys.stderr)
+            self.failed += len(batch)
+
+    def _run(self) -> None:
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if isinstance(item, threading.Event):
+                # flush() / close() marker: everything queued before it is in the batch
+                self._export(batch)
+                batch = []
+                item.set()
+                continue
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._export(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything submitted so far has been exported; False on timeout."""
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        try:
+            self.sink.close()
+        except Exception as e:
+            print(f"Closing trace sink {type(self.sink).__name__} failed: {e}", file=sys.stderr)
+
+    def stats(self) -> Dict[str, int]:
+        return {"submitted": self.submitted, "exported": self.exported, "dropped": self.dropped,
+                "failed": self.failed, "queued": self._queue.qsize()}
+
+
+def _truncate(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    text = value if isinstance(value, str) else str(value)
+    return text if len(text) <= MAX_FIELD_CHARS else text[:MAX_FIELD_CHARS] + "..."
+
+
+def _last_content(messages: Any) -> Optional[str]:
+    if isinstance(messages, Sequence) and messages and not isinstance(messages, str):
+        return _truncate(getattr(messages[-1], "content", None))
+    return None
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler that records one trace per top-level invocation, with spans for
+    the graph nodes, model calls (as generations) and tool calls. The callbacks only copy a few
+    fields into a span record and submit it to a BatchExporter, so tracing adds no I/O, no
+    network calls and no failure modes to a turn. Safe to share between concurrent invocations.
+    """
+
+    def __init__(self, exporter: BatchExporter):
+        self.exporter = exporter
+        # run_id -> open span record; only traced runs are kept
+        self._open: Dict[UUID, Dict[str, Any]] = {}
+        # run_id -> nearest traced ancestor (or itself), for every run of an open trace
+        self._traced_parent: Dict[UUID, UUID] = {}
+        # Tool calls of one step report from ToolNode's worker threads
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], kind: Optional[str], name: str,
+               **fields: Any) -> None:
+        with self._lock:
+            self._start_locked(run_id, parent_run_id, kind, name, fields)
+
+    def _start_locked(self, run_id: UUID, parent_run_id: Optional[UUID], kind: Optional[str], name: str,
+                      fields: Dict[str, Any]) -> None:
+        if parent_run_id is None:
+            self._traced_parent[run_id] = run_id
+            self._open[run_id] = {"kind": "trace", "trace_id": str(run_id), "span_id": str(run_id), "parent_id": None,
+                                  "name": name, "start_time": time.time(), **fields}
+            return
+        parent = self._traced_parent.get(parent_run_id)
+        if parent is None:
+            return
+        if kind is None:
+            # Not traced itself: its children attach to the nearest traced ancestor
+            self._traced_parent[run_id] = parent
+            return
+        self._traced_parent[run_id] = run_id
+        parent_record = self._open.get(parent)
+        trace_id = parent_record["trace_id"] if parent_record else str(parent)
+        self._open[run_id] = {"kind": kind, "trace_id": trace_id, "span_id": str(run_id),
+                              "parent_id": str(parent) if parent_record and parent_record["kind"] != "trace" else None,
+                              "name": name, "start_time": time.time(), **fields}
+
+    def _end(self, run_id: UUID, parent_run_id: Optional[UUID], error: Optional[BaseException] = None,
+             **fields: Any) -> None:
+        with self._lock:
+            self._traced_parent.pop(run_id, None)
+            record = self._open.pop(run_id, None)
+            if record is None:
+                return
+            if record["kind"] == "trace":
+                # Children that never finished (e.g. after an error) are not exported
+                trace_id = record["trace_id"]
+                for key in [k for k, v in self._open.items() if v["trace_id"] == trace_id]:
+                    self._open.pop(key, None)
+        record["end_time"] = time.time()
+        record.update({k: v for k, v in fields.items() if v is not None})
+        if error is not None:
+            record["error"] = _truncate(f"{type(error).__name__}: {error}")
+        self.exporter.submit(record)
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None,
+                       **kwargs: Any) -> None:
+        name = kwargs.get("name") or "graph"
+        if parent_run_id is None:
+            messages = inputs.get("messages") if isinstance(inputs, dict) else None
+            self._start(run_id, None, "trace", name, input=_last_content(messages))
+            return
+        node = (metadata or {}).get("langgraph_node")
+        kind = "span" if node in TRACED_NODES and name == node else None
+        self._start(run_id, parent_run_id, kind, name)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        output = None
+        if parent_run_id is None and isinstance(outputs, dict):
+            output = _last_content(outputs.get("messages"))
+        self._end(run_id, parent_run_id, output=output)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       **kwargs: Any) -> None:
+        self._end(run_id, parent_run_id, error=error)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None,
+                            **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, "generation", kwargs.get("name") or (serialized or {}).get("name") or "llm",
+                    model=(metadata or {}).get("ls_model_name"),
+                    metadata={"messages": len(messages[0]) if messages else 0})
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        prompt_tokens, completion_tokens = usage_from_result(response)
+        output = None
+        for generations in response.generations or []:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                tool_calls = getattr(message, "tool_calls", None)
+                output = _truncate(json.dumps(tool_calls, default=str)) if tool_calls else _truncate(generation.text)
+        self._end(run_id, parent_run_id, output=output, usage={
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens})
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                     **kwargs: Any) -> None:
+        self._end(run_id, parent_run_id, error=error)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, "tool", (serialized or {}).get("name") or kwargs.get("name") or "tool",
+                    input=_truncate(input_str))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._end(run_id, parent_run_id, output=_truncate(getattr(output, "content", output)))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                      **kwargs: Any) -> None:
+        self._end(run_id, parent_run_id, error=error)
+
+
+# One exporter (and background thread) per sink for the whole process
+_exporters: Dict[tuple, BatchExporter] = {}
+_exporters_lock = threading.Lock()
+
+
+def _exporter(key: tuple, make_sink: Any) -> BatchExporter:
+    with _exporters_lock:
+        exporter = _exporters.get(key)
+        if exporter is None:
+            exporter = _exporters[key] = BatchExporter(make_sink())
+        return exporter
+
+
+def make_trace_handler(backend: str = "auto", trace_file: Optional[str] = None) -> Optional[TracingCallbackHandler]:
+    """
+    Tracing callback handler for a backend in TRACE_BACKENDS, or None when tracing is off.
+    "langfuse" needs LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY; "file" writes JSON lines
+    to trace_file (default traces.jsonl).
+    """
+    if backend not in TRACE_BACKENDS:
+        raise ValueError(f"Unknown trace backend '{backend}', expected one of {TRACE_BACKENDS}.")
+    langfuse_configured = bool(LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY)
+    if backend == "auto":
+        backend = "langfuse" if langfuse_configured else "file" if trace_file else "off"
+    if backend == "off":
+        return None
+    if backend == "langfuse":
+        if not langfuse_configured:
+            print("Warning: Langfuse tracing requested but LANGFUSE_PUBLIC_KEY/LANGFUSE_SECRET_KEY are not set; tracing is off.")
+            return None
+        exporter = _exporter(("langfuse", LANGFUSE_HOST, LANGFUSE_PUBLIC_KEY),
+                             lambda: LangfuseTraceSink(LANGFUSE_PUBLIC_KEY, LANGFUSE_SECRET_KEY, LANGFUSE_HOST))
+    else:
+        path = trace_file or DEFAULT_TRACE_FILE
+        exporter = _exporter(("file", os.path.abspath(path)), lambda: FileTraceSink(path))
+    return TracingCallbackHandler(exporter)